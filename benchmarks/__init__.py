@@ -0,0 +1,2 @@
+'''Benchmarks for ckanta run against a local fake CKAN instance.
+'''
@@ -0,0 +1,297 @@
+'''In-process fake of the CKAN Action API used for benchmarking ckanta.
+
+Serves the actions ckanta commands make from an in-memory catalogue with
+configurable latency, error rate and catalogue size.
+'''
+import gzip
+import json
+import time
+import random
+import threading
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qsl
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+ACTION_PREFIX = '/api/3/action/'
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeCKAN:
+    '''Fake CKAN instance serving the Action API on a local port.
+
+    Each request is delayed by `latency` seconds and fails with a HTTP 500
+    for a fraction `error_rate` of requests; failures are drawn from a
+    generator seeded with `seed` so runs are repeatable.
+    '''
+    OBJECT_TYPES = ('package', 'group', 'organization', 'user')
+
+    def __init__(self, datasets=1000, groups=20, organizations=37, users=50,
+                 latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+        self.catalogue = {name: {} for name in self.OBJECT_TYPES}
+        # (object type, object name) -> {user id: capacity}
+        self.members = {}
+        for n in range(organizations):
+            self._add('organization', {'name': 'org-{:04}'.format(n),
+                                       'title': 'Organization {}'.format(n)})
+        for n in range(groups):
+            self._add('group', {'name': 'group-{:04}'.format(n),
+                                'title': 'Group {}'.format(n)})
+        for n in range(users):
+            self._add('user', {
+                'name': 'user-{:04}'.format(n),
+                'display_name': 'User {}'.format(n),
+                'email': 'user-{:04}@example.org'.format(n),
+                'apikey': 'apikey-{:04}'.format(n),
+                'org_name': 'Example', 'org_category': 'Government',
+                'country_state': 'Kano'
+            })
+        for n in range(datasets):
+            self._add('package', {
+                'name': 'dataset-{:06}'.format(n),
+                'title': 'Dataset {}'.format(n),
+                'owner_org': 'org-{:04}'.format(n % max(organizations, 1)),
+                'private': False, 'state': 'active', 'resources': []
+            })
+
+    def _add(self, object_type, record):
+        record = dict(record, id='{}-id-{}'.format(object_type, record['name']))
+        self.catalogue[object_type][record['name']] = record
+        return record
+
+    def _find(self, object_type, id_or_name):
+        objects = self.catalogue[object_type]
+        if id_or_name in objects:
+            return objects[id_or_name]
+        for record in objects.values():
+            if record['id'] == id_or_name:
+                return record
+        raise KeyError(id_or_name)
+
+    @property
+    def urlbase(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        handler = type('Handler', (_RequestHandler,), {'ckan': self})
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def dispatch(self, action_name, data):
+        '''Returns the status code and body of the response to an action.
+        '''
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if failed:
+            return (500, _error('Internal Server Error', 'Injected failure'))
+
+        object_type, _, verb = action_name.partition('_')
+        object_type = 'package' if object_type == 'dataset' else object_type
+        method = None
+        if object_type in self.catalogue:
+            method = getattr(self, '_do_{}'.format(verb), None)
+        elif object_type in ('member', 'eoc'):
+            # member_list and the access request extension's eoc_request_*
+            method = getattr(self, '_do_{}'.format(action_name), None)
+        if method is None:
+            return (400, _error('Bad request', 'Action name not known'))
+
+        try:
+            with self._lock:
+                return (200, _success(method(object_type, data)))
+        except KeyError as ex:
+            return (404, _error('Not Found Error', 'Not found: {}'.format(ex)))
+
+    def _do_list(self, object_type, data):
+        records = sorted(self.catalogue[object_type].values(),
+                         key=lambda r: r['name'])
+        offset = int(data.get('offset', 0))
+        limit = int(data.get('limit', len(records)))
+        records = records[offset:offset + limit]
+        if _is_true(data.get('all_fields')):
+            return records
+        return [record['name'] for record in records]
+
+    def _do_show(self, object_type, data):
+        return self._find(object_type, data['id'])
+
+    def _do_search(self, object_type, data):
+        # supports `field:value` query terms and a `name:{"after" TO *]`
+        # filter query as used for keyset paging
+        terms = [t.split(':', 1) for t in data.get('q', '').split()
+                 if ':' in t and t != '*:*']
+        after = None
+        if data.get('fq', '').startswith('name:{'):
+            after = data['fq'][len('name:{'):].split(' TO ')[0].strip('"')
+
+        records = [
+            record for record in sorted(self.catalogue[object_type].values(),
+                                        key=lambda r: r['name'])
+            if all(str(_get_field(record, field)) == value
+                   for (field, value) in terms)
+            and (after is None or record['name'] > after)
+        ]
+        start = int(data.get('start', 0))
+        rows = int(data.get('rows', 10))
+        return {'count': len(records), 'results': records[start:start + rows]}
+
+    def _do_create(self, object_type, data):
+        return self._add(object_type, data)
+
+    def _do_patch(self, object_type, data):
+        record = self._find(object_type, data['id'])
+        record.update(data)
+        return record
+
+    def _do_purge(self, object_type, data):
+        record = self._find(object_type, data['id'])
+        del self.catalogue[object_type][record['name']]
+
+    def _do_list_for_user(self, object_type, data):
+        user_id = self._find('user', data['id'])['id']
+        records = []
+        for (name, record) in sorted(self.catalogue[object_type].items()):
+            capacity = self.members.get((object_type, name), {}).get(user_id)
+            if capacity is not None:
+                records.append(dict(record, capacity=capacity))
+        return records
+
+    def _find_group(self, id_or_name):
+        for group_type in ('group', 'organization'):
+            try:
+                return (group_type, self._find(group_type, id_or_name))
+            except KeyError:
+                continue
+        raise KeyError(id_or_name)
+
+    def _do_member_create(self, object_type, data):
+        if object_type == 'member':
+            # member_create adds an object of any type to a group
+            object_type, record = self._find_group(data['id'])
+            table_name = data['object_type']
+            member = self._find(table_name, data['object'])
+            capacity = data.get('capacity')
+        else:
+            record = self._find(object_type, data['id'])
+            table_name, capacity = ('user', data.get('role'))
+            member = self._find('user', data['username'])
+
+        key = (object_type, record['name'])
+        self.members.setdefault(key, {})[member['id']] = capacity
+        return {'table_name': table_name, 'capacity': capacity}
+
+    def _do_member_list(self, object_type, data):
+        group_type, record = self._find_group(data['id'])
+        members = self.members.get((group_type, record['name']), {})
+        # ids are prefixed with the type of the object
+        table_name = data.get('object_type')
+        return [
+            [member_id, member_id.split('-id-')[0], capacity]
+            for (member_id, capacity) in sorted(members.items())
+            if table_name is None or member_id.startswith(table_name + '-')
+        ]
+
+    def _do_eoc_request_create(self, object_type, data):
+        return {'id': 'request-{}'.format(data['entity_id']),
+                'status': 'pending'}
+
+    def _do_eoc_request_patch(self, object_type, data):
+        return {'id': data['id'], 'status': data.get('status')}
+
+
+def _get_field(record, field):
+    if field == 'organization':
+        return record.get('owner_org')
+    return record.get(field)
+
+
+def _is_true(value):
+    return value in (True, 'true', 'True')
+
+
+def _success(result):
+    return {'help': '', 'success': True, 'result': result}
+
+
+def _error(type_, message):
+    return {'help': '', 'success': False,
+            'error': {'__type': type_, 'message': message}}
+
+
+def _decode_param(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes; without this delayed
+    # ACKs add ~40ms to every keep-alive request
+    disable_nagle_algorithm = True
+    ckan = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        data = {k: _decode_param(v) for (k, v) in parse_qsl(url.query)}
+        self._respond(url.path, data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self._respond(self.path, json.loads(body.decode('utf-8') or '{}'))
+
+    def _respond(self, path, data):
+        if not path.startswith(ACTION_PREFIX):
+            status, body = (404, _error('Not Found Error', path))
+        else:
+            action_name = path[len(ACTION_PREFIX):]
+            status, body = self.ckan.dispatch(action_name, data)
+
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            content = gzip.compress(content)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
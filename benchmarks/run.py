@@ -0,0 +1,276 @@
+'''Benchmarks ckanta commands against a local fake CKAN instance.
+
+Usage: python -m benchmarks.run [--datasets N] [--latency SECS] ...
+
+Each scenario runs against a fresh FakeCKAN and reports the requests made,
+requests/sec, p50/p99 latency (ms) and peak traced memory as JSON.
+'''
+import io
+import json
+import time
+import click
+import platform
+import tracemalloc
+from datetime import datetime
+from configparser import ConfigParser
+
+from ckanta import get_version
+from ckanta.common import ApiClient, CKANTAContext, CKANObject
+from ckanta.commands import CommandError, ListCommand, ShowCommand, UploadCommand, \
+     UploadDatasetCommand, PurgeCommand, MembershipGrantCommand, \
+     DatasetMembershipCommand
+from .fake_ckan import FakeCKAN
+
+
+CONFIG = '''
+[ckanta]
+national-states = NG-KN:Kano  NG-LA:Lagos  NG-FC:'Federal Capital Territory'
+grid-geoserver-urlbase = https://geo.example.org/ows
+grid-geoserver-service = WFS
+grid-geoserver-version = 1.0.0
+grid-geoserver-request = GetFeature
+grid-geoserver-outputFormat = csv
+grid-geoserver-authkey = k3y
+'''
+
+
+class TimedApiClient(ApiClient):
+    '''ApiClient recording the latency of each request it makes.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def _request(self, action_name, data, as_get, stream=False):
+        started = time.perf_counter()
+        try:
+            return super()._request(action_name, data, as_get, stream)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+    def with_apikey(self, apikey):
+        client = super().with_apikey(apikey)
+        client.latencies = self.latencies
+        return client
+
+
+def percentile(values, pct):
+    '''Returns the nearest-rank percentile of values.
+    '''
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, int(round(pct / 100.0 * len(ordered))) - 1)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _build_context(urlbase, workers):
+    configp = ConfigParser()
+    configp.read_string(CONFIG)
+    client = TimedApiClient(urlbase, 'benchmark-apikey', max_retries=0,
+                            pool_maxsize=max(workers, 1))
+    return CKANTAContext(configp, client)
+
+
+def _csv(header, rows):
+    return io.StringIO('\n'.join([header] + rows) + '\n')
+
+
+def run_list(context, ckan, options):
+    cmd = ListCommand(context, object='dataset')
+    try:
+        for _ in cmd.iter_records(page_size=options['page_size']):
+            pass
+    except CommandError:
+        # a failed page ends the listing as it does on the cli
+        pass
+
+
+def run_show(context, ckan, options):
+    names = sorted(ckan.catalogue['package'])[:options['items']]
+    for name in names:
+        try:
+            ShowCommand(context, object='dataset', id=name).execute()
+        except CommandError:
+            pass
+
+
+def run_upload(context, ckan, options):
+    infile = _csv('title,description', [
+        'Benchmark Group {0},Group number {0}'.format(n)
+        for n in range(options['items'])
+    ])
+    cmd = UploadCommand(context, object='group', infile=infile)
+    cmd.execute(workers=options['workers'])
+
+
+def run_upload_dataset(context, ckan, options):
+    infile = _csv('title,sector_id,res:url', [
+        "Benchmark Dataset {},health,layer:{};state_code='KN'".format(
+            n, n % 10)
+        for n in range(options['items'])
+    ])
+    cmd = UploadDatasetCommand(context, infile, 'kano,lagos', None, None,
+                               'CSV')
+    cmd.execute(workers=options['workers'])
+
+
+def run_purge(context, ckan, options):
+    names = sorted(ckan.catalogue['package'])[:options['items']]
+    cmd = PurgeCommand(context, 'dataset', _csv(names[0], names[1:]), [])
+    cmd.execute(workers=options['workers'], outfile=io.StringIO())
+
+
+def run_membership_grant(context, ckan, options):
+    groups = sorted(ckan.catalogue['group'])
+    cmd = MembershipGrantCommand(context, 'user-0000', 'member', groups,
+                                 CKANObject.GROUP)
+    cmd.execute(as_get=False, workers=options['workers'])
+
+
+def run_dataset_access_grant(context, ckan, options):
+    names = sorted(ckan.catalogue['package'])[:options['items']]
+    cmd = MembershipGrantCommand(context, 'user-0000', 'member', names,
+                                 CKANObject.DATASET)
+    cmd.execute(as_get=False, workers=options['workers'])
+
+
+def run_membership_dataset(context, ckan, options):
+    names = sorted(ckan.catalogue['package'])[:options['items']]
+    groups = sorted(ckan.catalogue['group'])
+    infile = io.StringIO(''.join(
+        '{}  {}\n'.format(name, groups[n % len(groups)])
+        for (n, name) in enumerate(names)
+    ))
+    cmd = DatasetMembershipCommand(context, infile)
+    cmd.execute(workers=options['workers'])
+
+
+SCENARIOS = (
+    ('list', run_list),
+    ('show', run_show),
+    ('upload', run_upload),
+    ('upload-dataset', run_upload_dataset),
+    ('purge', run_purge),
+    ('membership-grant', run_membership_grant),
+    ('dataset-access-grant', run_dataset_access_grant),
+    ('membership-dataset', run_membership_dataset),
+)
+
+
+def _run_once(scenario, server_options, options, trace_memory):
+    with FakeCKAN(**server_options) as ckan:
+        context = _build_context(ckan.urlbase, options['workers'])
+        if trace_memory:
+            tracemalloc.start()
+
+        started = time.perf_counter()
+        try:
+            scenario(context, ckan, options)
+        finally:
+            elapsed = time.perf_counter() - started
+            peak = None
+            if trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            context.client.close()
+        return (ckan, context.client, elapsed, peak)
+
+
+def run_scenario(scenario, server_options, options, trace_memory=True):
+    '''Runs a scenario and returns its measurements.
+
+    Timings come from a run without tracing as tracemalloc slows execution
+    down; peak memory, which includes transient allocations made by the
+    in-process server, from a second traced run.
+    '''
+    ckan, client, elapsed, _ = _run_once(
+        scenario, server_options, options, False
+    )
+    peak = None
+    if trace_memory:
+        peak = _run_once(scenario, server_options, options, True)[3]
+
+    latencies = client.latencies
+    return {
+        'requests': ckan.requests,
+        'errors': ckan.errors,
+        'seconds': round(elapsed, 4),
+        'requests_per_sec': round(ckan.requests / elapsed, 2)
+                            if elapsed else None,
+        'latency_ms': {
+            'p50': _to_ms(percentile(latencies, 50)),
+            'p99': _to_ms(percentile(latencies, 99)),
+            'mean': _to_ms(sum(latencies) / len(latencies))
+                    if latencies else None,
+        },
+        'peak_memory_bytes': peak
+    }
+
+
+def _to_ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def _get_version():
+    try:
+        return get_version()
+    except Exception:
+        return None
+
+
+def run_benchmarks(server_options, options, scenarios=None,
+                   trace_memory=True):
+    '''Runs the named scenarios, all by default, and returns a report.
+    '''
+    results = {}
+    for (name, scenario) in SCENARIOS:
+        if scenarios and name not in scenarios:
+            continue
+        results[name] = run_scenario(
+            scenario, server_options, options, trace_memory
+        )
+
+    return {
+        'ckanta': _get_version(),
+        'python': platform.python_version(),
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'server': server_options,
+        'options': options,
+        'results': results
+    }
+
+
+@click.command()
+@click.option('--datasets', type=click.IntRange(1), default=2000,
+              help='Number of datasets in the fake catalogue.')
+@click.option('--latency', type=float, default=0.002,
+              help='Seconds the fake server takes per request.')
+@click.option('--error-rate', type=float, default=0.0,
+              help='Fraction of requests failing with HTTP 500.')
+@click.option('-n', '--items', type=click.IntRange(1), default=200,
+              help='Items created, shown, purged or granted per scenario.')
+@click.option('-w', '--workers', type=click.IntRange(1), default=1)
+@click.option('--page-size', type=click.IntRange(1), default=100)
+@click.option('-s', '--scenario', 'scenarios', multiple=True,
+              type=click.Choice([name for (name, _) in SCENARIOS]))
+@click.option('--no-memory', default=False, is_flag=True,
+              help='Skip the traced run measuring peak memory.')
+@click.option('-o', '--outfile', type=click.File('w'), default='-')
+def main(datasets, latency, error_rate, items, workers, page_size, scenarios,
+         no_memory, outfile):
+    '''Benchmarks ckanta commands against a local fake CKAN instance.
+    '''
+    server_options = {
+        'datasets': datasets, 'latency': latency, 'error_rate': error_rate
+    }
+    options = {'items': items, 'workers': workers, 'page_size': page_size}
+    report = run_benchmarks(server_options, options, scenarios,
+                            not no_memory)
+    json.dump(report, outfile, indent=2)
+    outfile.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+'''On-disk cache for responses of read actions made through ApiClient.
+'''
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import os.path as fs
+
+from .common import ConfigError, get_config, default_cache_dir
+
+
+_log = logging.getLogger(__name__)
+
+
+def _parse_ttls(value):
+    '''Parses per-action TTLs written as `action:seconds` pairs separated by
+    whitespace.
+    '''
+    ttls = {}
+    for entry in (value or '').split():
+        action_name, ttl = entry.split(':')
+        ttls[action_name.strip()] = int(ttl)
+    return ttls
+
+
+class ResponseCache:
+    '''SQLite backed, size-bounded LRU cache for read action responses.
+
+    Entries are keyed by instance, identity (apikey), action name and the
+    canonicalized payload and expire after a per-action TTL. Writes made to
+    an instance invalidate the entries for the objects they affect.
+    Responses carrying credentials are never stored.
+    '''
+    FILENAME = 'responses.sqlite'
+    DEFAULT_TTL = 300
+    MAX_ENTRIES = 10000
+    ACTION_TTLS = {
+        'user_show': 60,
+        'organization_list_for_user': 60,
+        'group_list_authz': 60,
+    }
+
+    # objects whose cached reads are stale after a write to the key object
+    AFFECTED_OBJECTS = {
+        'package': ('package', 'group', 'organization'),
+        # group_member_create etc. change the members listed by member_list
+        'group': ('group', 'organization', 'package', 'member'),
+        'organization': ('organization', 'group', 'package', 'member'),
+        'member': ('member', 'group', 'organization', 'package'),
+        'user': ('user', 'group', 'organization', 'member'),
+    }
+
+    # fields of responses (e.g. user_show for sysadmins) kept off the disk
+    SECRET_FIELDS = ('apikey',)
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            instance TEXT NOT NULL,
+            object TEXT NOT NULL,
+            action TEXT NOT NULL,
+            expires REAL NOT NULL,
+            accessed REAL NOT NULL,
+            value TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ix_responses_object
+            ON responses (instance, object);
+        CREATE INDEX IF NOT EXISTS ix_responses_accessed
+            ON responses (accessed);
+    '''
+
+    def __init__(self, path=None, default_ttl=None, ttls=None,
+                 max_entries=None, refresh=False):
+        self.path = path or fs.join(default_cache_dir(), self.FILENAME)
+        self.default_ttl = default_ttl or self.DEFAULT_TTL
+        self.ttls = dict(self.ACTION_TTLS, **(ttls or {}))
+        self.max_entries = max_entries or self.MAX_ENTRIES
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @classmethod
+    def from_config(cls, configp, refresh=False):
+        '''Creates a cache using the `cache-*` settings in the [ckanta]
+        section of the config; returns None unless `cache` is enabled.
+        '''
+        def _get(name):
+            try:
+                return get_config(configp, name) if configp else None
+            except ConfigError:
+                return None
+
+        enabled = (_get('cache') or 'no').lower()
+        if enabled not in ('yes', 'true', 'on', '1'):
+            return None
+
+        try:
+            path = _get('cache-path')
+            default_ttl = _get('cache-ttl')
+            max_entries = _get('cache-max-entries')
+            return cls(
+                fs.expanduser(path) if path else None,
+                int(default_ttl) if default_ttl else None,
+                _parse_ttls(_get('cache-ttls')),
+                int(max_entries) if max_entries else None,
+                refresh
+            )
+        except ValueError as ex:
+            raise ConfigError('Invalid cache setting: {}'.format(ex)) from ex
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            import sqlite3
+
+            dirpath = fs.dirname(self.path)
+            if dirpath:
+                os.makedirs(dirpath, exist_ok=True)
+
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.executescript(self.SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def get_object(action_name):
+        '''Returns the CKAN object an action reads or writes.
+        '''
+        target_object = action_name.split('_')[0]
+        return 'package' if target_object == 'dataset' else target_object
+
+    def build_key(self, instance, identity, action_name, data):
+        value = json.dumps(
+            [instance, identity, action_name, data or {}],
+            sort_keys=True, separators=(',', ':')
+        )
+        return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+    def get(self, instance, identity, action_name, data):
+        '''Returns the cached response for the request or None.
+        '''
+        if self.refresh:
+            return None
+
+        key = self.build_key(instance, identity, action_name, data)
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT value FROM responses WHERE key = ? AND expires > ?',
+                (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+
+            self.conn.execute(
+                'UPDATE responses SET accessed = ? WHERE key = ?', (now, key)
+            )
+            self.conn.commit()
+        _log.debug('cache hit: {} {}'.format(action_name, data))
+        return json.loads(row[0])
+
+    def set(self, instance, identity, action_name, data, response):
+        '''Stores the response for the request evicting the least recently
+        used entries beyond the size limit; responses holding any of the
+        SECRET_FIELDS aren't stored.
+        '''
+        value = json.dumps(response)
+        if any('"{}"'.format(f) in value for f in self.SECRET_FIELDS):
+            _log.debug('not cached, has secrets: {}'.format(action_name))
+            return
+
+        key = self.build_key(instance, identity, action_name, data)
+        now = time.time()
+        ttl = self.ttls.get(action_name, self.default_ttl)
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, instance, self.get_object(action_name), action_name,
+                 now + ttl, now, value)
+            )
+            self.conn.execute(
+                'DELETE FROM responses WHERE key IN ('
+                '  SELECT key FROM responses ORDER BY accessed DESC'
+                '  LIMIT -1 OFFSET ?)', (self.max_entries,)
+            )
+            self.conn.commit()
+
+    def invalidate(self, instance, action_name):
+        '''Drops cached entries for the instance made stale by a write to
+        the named action.
+        '''
+        target_object = self.get_object(action_name)
+        objects = self.AFFECTED_OBJECTS.get(target_object)
+        with self._lock:
+            if objects is None:
+                self.conn.execute(
+                    'DELETE FROM responses WHERE instance = ?', (instance,)
+                )
+            else:
+                self.conn.execute(
+                    'DELETE FROM responses WHERE instance = ? AND object IN '
+                    '({})'.format(', '.join('?' * len(objects))),
+                    (instance,) + objects
+                )
+            self.conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute('DELETE FROM responses')
+            self.conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
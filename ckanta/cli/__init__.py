@@ -1,21 +1,37 @@
 '''Command-Line Interface for CKANTA
 '''
+import io
 import sys
 import enum
+import json
+import threading
 import click
 import logging
 from pprint import pprint
-from ckanta.common import read_config, get_instance_config, \
-     get_config, log_error, ConfigError, ApiClient, Config, \
+from ckanta.common import load_config, compile_config, get_instance_config, \
+     find_instance_names, get_config, log_error, iter_concurrent, \
+     ConfigError, ApiClient, Config, \
      CKANTAContext, CKANObject, MembershipRole
+from ckanta.cache import ResponseCache
+from ckanta.index import CatalogueIndex
+from ckanta.journal import Journal, hash_file
 from ckanta.commands import CommandError, ListCommand, ShowCommand, \
-     MembershipCommand, MembershipGrantCommand, UploadCommand, \
-     UploadDatasetCommand, PurgeCommand
+     DumpCommand, MembershipCommand, MembershipGrantCommand, \
+     DatasetMembershipCommand, UploadCommand, \
+     UploadDatasetCommand, PatchCommand, MirrorCommand, IndexBuildCommand, \
+     PurgeCommand
 
 
 _log = logging.getLogger(__name__)
 CONFIG_PATH = '~/.config/ckanta.conf'
 
+# commands which can be run against several instances at once
+FAN_OUT_COMMANDS = ('list', 'show', 'purge', 'membership')
+
+# commands taking the instances to run against as arguments instead of -i
+INSTANCE_ARGUMENT_COMMANDS = ('mirror',)
+CONNECT_KEY = 'ckanta.connect'
+
 
 def _configure_logger_dev():
     '''Configures the default logger for development.
@@ -23,48 +39,250 @@ def _configure_logger_dev():
     logging.basicConfig(level=logging.DEBUG)
 
 
+def _write_ndjson(records, outfile, lock=None):
+    '''Writes records to outfile as newline-delimited JSON as they arrive;
+    lines are written holding lock if given.
+    '''
+    for record in records:
+        line = '{}\n'.format(json.dumps(record))
+        if lock is None:
+            outfile.write(line)
+            continue
+        with lock:
+            outfile.write(line)
+    outfile.flush()
+
+
+def _fan_out(context, run, show=pprint):
+    '''Runs run(context) for the context of each selected instance and
+    passes the results to show.
+
+    Instances are run concurrently when there are several, with results
+    shown in order under the name of each instance.
+    '''
+    contexts = context.instances
+    if len(contexts) == 1:
+        try:
+            show(run(context))
+        except CommandError as ex:
+            log_error(ex, context, _log)
+        return
+
+    outcomes = iter_concurrent(run, contexts, workers=len(contexts))
+    for (instance_context, result, ex) in outcomes:
+        click.echo('[{}]'.format(instance_context.instance))
+        if ex is not None:
+            log_error(ex, instance_context, _log)
+        else:
+            show(result)
+        click.echo()
+
+
+class _TaggedWriter:
+    '''Writes lines to a file shared across threads prefixed with a tag,
+    e.g. the name of the instance they come from.
+    '''
+
+    def __init__(self, outfile, tag, lock):
+        self.outfile = outfile
+        self.tag = tag
+        self.lock = lock
+
+    def write(self, line):
+        with self.lock:
+            self.outfile.write('[{}] {}'.format(self.tag, line))
+
+    def flush(self):
+        with self.lock:
+            self.outfile.flush()
+
+
+def _open_journal(context, command_name, resume, *identity):
+    '''Opens the checkpoint journal for a bulk command run against the
+    context's instance.
+    '''
+    journal = Journal.open(command_name, context.client.urlbase, *identity,
+                           resume=resume)
+    _log.debug('journal: {}'.format(journal.path))
+    return journal
+
+
+def _hash_input(infile, resume):
+    '''Returns the digest of infile identifying its journal and a file to
+    read it from; a resume of piped input, which has no digest, is refused
+    as it can't be told apart from the input of another run.
+    '''
+    digest, infile = hash_file(infile)
+    if digest is None and resume:
+        raise CommandError(
+            '--resume requires a file; piped input cannot be matched to an '
+            'earlier run.'
+        )
+    return (digest, infile)
+
+
+def _report_stats(contexts, as_table, outfile):
+    '''Prints the request stats of the context clients to stderr and/or
+    writes them as JSON to outfile; keyed by instance if there are several.
+    '''
+    if not contexts:
+        return
+
+    if as_table:
+        for context in contexts:
+            header = '' if len(contexts) == 1 else '[{}]\n'.format(
+                context.instance)
+            click.echo('\n{}{}'.format(
+                header, context.client.stats.format_table()), err=True)
+
+    if outfile is not None:
+        stats = contexts[0].client.stats.as_dict()
+        if len(contexts) > 1:
+            stats = {c.instance: c.client.stats.as_dict() for c in contexts}
+        json.dump(stats, outfile, indent=2)
+        outfile.write('\n')
+
+
+def _start_profiler(ctx, mode, path):
+    '''Profiles the rest of the run writing the results to path and a
+    summary to stderr on exit.
+    '''
+    from ckanta.profiling import Profiler
+
+    profiler = Profiler(mode, path)
+
+    def _stop():
+        click.echo('\n{}'.format(profiler.stop()), err=True)
+        click.echo('Profile written to: {}'.format(profiler.path), err=True)
+
+    ctx.call_on_close(_stop)
+    profiler.start()
+
+
 @click.group()
 @click.option('-u', '--urlbase')
 @click.option('-k', '--apikey')
-@click.option('-i', '--instance', default='grid-local')
+@click.option('-i', '--instance', 'instances', multiple=True,
+              default=['grid-local'],
+              help='Instance to run against; repeat, comma-separate or use '
+                   'a glob (e.g. grid-*) to run list, show, purge or '
+                   'membership against several concurrently.')
 @click.option('-p', '--post', default=False, is_flag=True)
 @click.option('-d', '--debug', default=False, is_flag=True)
+@click.option('--no-cache', default=False, is_flag=True,
+              help='Do not use cached responses for read actions.')
+@click.option('--refresh', default=False, is_flag=True,
+              help='Ignore cached responses but cache fresh ones.')
+@click.option('--stats', default=False, is_flag=True,
+              help='Print per-action request stats on exit.')
+@click.option('--stats-json', type=click.File('w'), default=None,
+              help='Write per-action request stats as JSON to file.')
+@click.option('--profile', type=click.Choice(['cpu', 'mem']), default=None,
+              help='Profile the command run with cProfile or tracemalloc.')
+@click.option('--profile-out', type=click.Path(dir_okay=False), default=None,
+              help='File to write profile results to; defaults to '
+                   'ckanta.pstats or ckanta.tracemalloc.')
 @click.pass_context
-def ckanta(ctx, urlbase, apikey, instance, post, debug):
+def ckanta(ctx, urlbase, apikey, instances, post, debug, no_cache, refresh,
+           stats, stats_json, profile, profile_out):
+    if profile:
+        _start_profiler(ctx, profile, profile_out)
+
     if debug:
         _configure_logger_dev()
 
+    configp, national_states = (None, None)
     try:
-        configp = read_config(CONFIG_PATH)
+        configp, national_states = load_config(CONFIG_PATH)
     except ConfigError as ex:
         _log.info('Config file not found: {}'.format(CONFIG_PATH))
 
+    cache = None
+    if not no_cache:
+        try:
+            cache = ResponseCache.from_config(configp, refresh)
+        except ConfigError as ex:
+            click.echo('error: {}\n'.format(ex))
+            sys.exit()
+
+    contexts = []
+
+    def connect(name, client=None):
+        '''Returns a context for the named instance; its client is created
+        from the config unless given.
+        '''
+        if client is None:
+            if configp is None:
+                raise ConfigError('File not found: {}'.format(CONFIG_PATH))
+            client = ApiClient.from_config(
+                get_instance_config(configp, name), cache=cache
+            )
+
+        # context to hold ckanta specific context; one per instance
+        context = CKANTAContext(configp, client, not post, debug,
+                                national_states, name)
+        context.instances = contexts
+        contexts.append(context)
+
+        # all commands share the client's connection pool; release on exit
+        ctx.call_on_close(client.close)
+        return context
+
+    # commands naming the instances they run against as arguments connect
+    # to them through this
+    ctx.meta[CONNECT_KEY] = connect
+    if stats or stats_json:
+        ctx.call_on_close(lambda: _report_stats(contexts, stats, stats_json))
+    if cache is not None:
+        ctx.call_on_close(cache.close)
+    if ctx.invoked_subcommand in INSTANCE_ARGUMENT_COMMANDS:
+        return
+
     # mutually exclused: (urlbase, apikey) and instance
     if urlbase is not None and apikey is not None:
-        client = ApiClient(urlbase, apikey)
+        connect(None, ApiClient(urlbase, apikey, cache=cache))
     else:
         try:
-            cfg = get_instance_config(configp, instance)
+            if configp is None:
+                raise ConfigError('File not found: {}'.format(CONFIG_PATH))
+            patterns = [
+                p.strip() for value in instances for p in value.split(',')
+            ]
+            for name in find_instance_names(configp, patterns):
+                connect(name)
         except ConfigError as ex:
+            click.echo('error: {}'.format(ex))
             click.echo('Try providing the config parameters directly instead.\n')
             sys.exit()
-        client = ApiClient(cfg.urlbase, cfg.apikey)
 
-    # context to hold ckanta specific context
-    context = CKANTAContext(configp, client, not post, debug)
-    ctx.obj = context
+    if len(contexts) > 1 and ctx.invoked_subcommand not in FAN_OUT_COMMANDS:
+        click.echo('error: Only {} can be run against several instances.\n'
+                   .format(', '.join(FAN_OUT_COMMANDS)))
+        sys.exit()
+    ctx.obj = contexts[0]
 
 
 @ckanta.command()
 @click.option('-i', '--instance', default='local')
 @click.option('-l', '--list', default=False, is_flag=True)
 @click.option('--show-key', default=False, is_flag=True)
+@click.option('--compile', 'compile_', default=False, is_flag=True,
+              help='Parse the config file into a snapshot read at startup.')
 @click.pass_obj
-def config(context, instance, list, show_key):
+def config(context, instance, list, show_key, compile_):
     '''Explore configured settings for CKANTA.
     '''
     client = context.client
 
+    if compile_:
+        try:
+            _, _, snapshot_path = compile_config(CONFIG_PATH)
+        except ConfigError as ex:
+            click.echo('error: {}\n'.format(ex))
+            sys.exit()
+        click.echo('Config compiled: {}'.format(snapshot_path))
+        return
+
     if list and instance != 'local':
         click.echo('error: The options -i/--instance and -l/--list are '
                    'mutually exclusive. Use just one!\n')
@@ -83,14 +301,15 @@ def config(context, instance, list, show_key):
             return
 
         try:
-            conf = _load_config(instance)
+            configp, _ = load_config(CONFIG_PATH)
+            conf = get_instance_config(configp, instance)
             _show_config_item(conf)
         except ConfigError as ex:
             sys.exit()
 
     def _list_config_sections():
         try:
-            configp = read_config(CONFIG_PATH)
+            configp, _ = load_config(CONFIG_PATH)
         except ConfigError as ex:
             errmsg = 'error: Config file not found: {}'.format(CONFIG_PATH)
             map(lambda f: f(errmsg), (_log.error, click.echo))
@@ -111,8 +330,20 @@ def config(context, instance, list, show_key):
 @ckanta.command('list')
 @click.argument('object', type=click.Choice(ListCommand.TARGET_OBJECTS))
 @click.option('-o', '--option', multiple=True)
+@click.option('--ndjson', default=False, is_flag=True,
+              help='Stream all records as newline-delimited JSON.')
+@click.option('-s', '--page-size', type=click.IntRange(1),
+              default=ListCommand.PAGE_SIZE,
+              help='Number of records requested per page with --ndjson.')
+@click.option('--outfile', type=click.File('w'), default='-',
+              help='File to write records to with --ndjson.')
+@click.option('--stream', default=False, is_flag=True,
+              help='Decode records as pages arrive with --ndjson.')
+@click.option('--local', default=False, is_flag=True,
+              help='Answer from the index built with `index build`.')
 @click.pass_obj
-def ckanta_list(context, object, option):
+def ckanta_list(context, object, option, ndjson, page_size, outfile, stream,
+                local):
     '''Retrieve a list of objects (dataset, group, organization, user) from
     a CKAN instance.
     '''
@@ -123,21 +354,53 @@ def ckanta_list(context, object, option):
     ))
     _log.debug('parsed options: {}'.format(option_dict))
 
-    try:
-        cmd = ListCommand(context, object=object, **option_dict)
-        result = cmd.execute(as_get=context.as_get)
-        pprint(result['result'])
-    except CommandError as ex:
-        func = _log.error if not context.debug else _log.exception
-        func('error: {}'.format(ex))
+    if ndjson:
+        # records of several instances are tagged with the instance name
+        lock = threading.Lock()
+
+        def _stream(instance_context):
+            if local:
+                urlbase = instance_context.client.urlbase
+                with CatalogueIndex.open(urlbase) as catalogue_index:
+                    records = catalogue_index.list(object, **option_dict)
+            else:
+                cmd = ListCommand(instance_context, object=object,
+                                  **option_dict)
+                records = cmd.iter_records(instance_context.as_get, page_size,
+                                           stream)
+            if len(context.instances) > 1:
+                records = (
+                    {'instance': instance_context.instance, 'record': record}
+                    for record in records
+                )
+            _write_ndjson(records, outfile, lock)
+
+        workers = len(context.instances)
+        for (instance_context, _, ex) in iter_concurrent(
+                _stream, context.instances, workers):
+            if ex is not None:
+                log_error(ex, instance_context, _log)
+        return
+
+    def _list(instance_context):
+        if local:
+            urlbase = instance_context.client.urlbase
+            with CatalogueIndex.open(urlbase) as catalogue_index:
+                return catalogue_index.list(object, **option_dict)
+        cmd = ListCommand(instance_context, object=object, **option_dict)
+        return cmd.execute(as_get=instance_context.as_get)['result']
+
+    _fan_out(context, _list)
 
 
 @ckanta.command()
 @click.argument('object', type=click.Choice(ShowCommand.TARGET_OBJECTS))
 @click.argument('id', type=str)
 @click.option('-o', '--option', multiple=True)
+@click.option('--local', default=False, is_flag=True,
+              help='Answer from the index built with `index build`.')
 @click.pass_obj
-def show(context, object, id, option):
+def show(context, object, id, option, local):
     '''Show an object (dataset, group, organization, user) in detail.
     '''
     # option -> List; item format: key=value
@@ -146,16 +409,79 @@ def show(context, object, id, option):
         option
     ))
     _log.debug('parsed options: {}'.format(option_dict))
-    result = {}
 
+    def _show(instance_context):
+        if local:
+            urlbase = instance_context.client.urlbase
+            with CatalogueIndex.open(urlbase) as catalogue_index:
+                return {'success': True,
+                        'result': catalogue_index.show(object, id)}
+        cmd = ShowCommand(instance_context, object=object, id=id,
+                          **option_dict)
+        return cmd.execute(as_get=instance_context.as_get)
+
+    _fan_out(context, _show)
+
+
+@ckanta.group()
+@click.pass_obj
+def index(context):
+    '''Manage the local index of a CKAN instance's catalogue.
+    '''
+    pass
+
+
+@index.command('build')
+@click.option('-o', '--object', 'objects', multiple=True,
+              type=click.Choice(IndexBuildCommand.TARGET_OBJECTS),
+              help='Object type to index; repeat for several. All by default.')
+@click.pass_obj
+def index_build(context, objects):
+    '''Copy datasets, organizations, groups and users into a local SQLite
+    index answering `list --local` and `show --local`.
+    '''
     try:
-        cmd = ShowCommand(context, object=object, id=id, **option_dict)
-        result = cmd.execute(as_get=context.as_get)
+        catalogue_index = CatalogueIndex.open(context.client.urlbase)
+        cmd = IndexBuildCommand(context, catalogue_index, objects)
+        summary = cmd.execute(as_get=context.as_get)
+        pprint({'path': catalogue_index.path, 'summary': dict(summary)})
     except CommandError as ex:
-        func = _log.error if not context.debug else _log.exception
-        func('error: {}'.format(ex))
-        return
-    pprint(result)
+        log_error(ex, context, _log)
+
+
+@ckanta.group()
+@click.pass_obj
+def dump(context):
+    '''Export full metadata of objects on a CKAN instance.
+    '''
+    pass
+
+
+@dump.command('dataset')
+@click.option('-q', '--query', default=None,
+              help='Solr query selecting the datasets to dump.')
+@click.option('-f', '--field', 'fields', multiple=True,
+              help='Field to include in each record; defaults to all.')
+@click.option('-r', '--rows', type=click.IntRange(1),
+              default=DumpCommand.ROWS,
+              help='Number of datasets requested per page.')
+@click.option('--start', type=click.IntRange(0), default=0)
+@click.option('--include-private', default=False, is_flag=True)
+@click.option('--outfile', type=click.File('w'), default='-')
+@click.option('--stream', default=False, is_flag=True,
+              help='Decode datasets as pages arrive.')
+@click.pass_obj
+def dump_dataset(context, query, fields, rows, start, include_private,
+                 outfile, stream):
+    '''Dump datasets as newline-delimited JSON using paged package_search
+    requests.
+    '''
+    try:
+        cmd = DumpCommand(context, 'dataset', query, fields, rows, start,
+                          include_private)
+        _write_ndjson(cmd.iter_records(context.as_get, stream), outfile)
+    except CommandError as ex:
+        log_error(ex, context, _log)
 
 
 @ckanta.group()
@@ -181,15 +507,11 @@ def membership_list(context, userid, check_groups):
         with specified user Id has membership.
     :type check_groups: boolean
     '''
-    result = {}
-    try:
-        cmd = MembershipCommand(context, userid, check_groups)
-        result = cmd.execute(as_get=False)
-    except CommandError as ex:
-        func = _log.error if not context.debug else _log.exception
-        func('error: {}'.format(ex))
-        return
-    pprint(result)
+    def _list(instance_context):
+        cmd = MembershipCommand(instance_context, userid, check_groups)
+        return cmd.execute(as_get=False)
+
+    _fan_out(context, _list)
 
 
 @membership.command('grant')
@@ -198,44 +520,134 @@ def membership_list(context, userid, check_groups):
 @click.option('-d', '--dataset', 'datasets', multiple=True)
 @click.option('-g', '--group', 'groups', multiple=True)
 @click.option('-o', '--org', 'orgs', multiple=True)
+@click.option('--infile', type=click.File('r'), default=None,
+              help="CSV of grants with a 'user' column and a 'group', "
+                   "'organization' or 'dataset' column.")
+@click.option('-w', '--workers', type=click.IntRange(1), default=1,
+              help='Number of concurrent grant requests.')
+@click.option('--resume', default=False, is_flag=True,
+              help='Skip grants completed by an earlier interrupted run.')
 @click.pass_obj
-def membership_grant(context, userid, role, datasets, groups, orgs):
+def membership_grant(context, userid, role, datasets, groups, orgs, infile,
+                     workers, resume):
     '''Grants user access priviledge on a group, organization or dataset.
+
+    USERID takes a comma-separated list of users, or - if all grants are
+    read from --infile. Grants of a role a user already holds are skipped.
     '''
-    if datasets:
-        click.echo('Processing user access grant for dataset(s)...')
-        obj_type = CKANObject.DATASET
-        cmd = MembershipGrantCommand(context, userid, role, datasets, obj_type)
-        result = cmd.execute(as_get=False)
-        pprint(result)
+    pairs, digest = ({}, None)
+    if infile is not None:
+        try:
+            digest, infile = _hash_input(infile, resume)
+            pairs = MembershipGrantCommand.read_grants(infile)
+        except CommandError as ex:
+            log_error(ex, context, _log)
+            return
 
-    for (objects, obj_type) in (
-        (groups, CKANObject.GROUP), 
-        (orgs, CKANObject.ORGANIZATION)
-    ):
-        if not objects:
-            continue
+    targets = [
+        (objects, obj_type) for (objects, obj_type) in (
+            (datasets, CKANObject.DATASET),
+            (groups, CKANObject.GROUP),
+            (orgs, CKANObject.ORGANIZATION)
+        ) if objects or pairs.get(obj_type)
+    ]
+
+    def _grant(instance_context):
+        results = []
+        for (objects, obj_type) in targets:
+            cmd = MembershipGrantCommand(instance_context, userid, role,
+                                         objects, obj_type,
+                                         pairs.get(obj_type))
+            with _open_journal(instance_context, 'membership-grant', resume,
+                               userid, role, obj_type.name, digest,
+                               *sorted(objects)) as journal:
+                result = cmd.execute(as_get=False, journal=journal,
+                                     workers=workers)
+            results.append((obj_type, result))
+        return results
+
+    def _show(results):
+        for (obj_type, result) in results:
+            msgfmt = 'User {} for {}(s):'
+            click.echo(msgfmt.format(
+                'access grant' if obj_type == CKANObject.DATASET
+                else 'membership', obj_type.name.lower()
+            ))
+            pprint(result)
+
+    _fan_out(context, _grant, _show)
+
+
+@membership.command('dataset')
+@click.option('--infile', type=click.File('r'), default=None,
+              help='File mapping a dataset to a group per line, separated '
+                   'by a tab or two or more spaces.')
+@click.option('-d', '--data', 'pairs', multiple=True,
+              help="'DATASET GROUP' pair; repeat for several.")
+@click.option('-c', '--capacity', default=DatasetMembershipCommand.CAPACITY)
+@click.option('-w', '--workers', type=click.IntRange(1), default=1,
+              help='Number of concurrent member_create requests.')
+@click.option('--resume', default=False, is_flag=True,
+              help='Skip pairs completed by an earlier interrupted run.')
+@click.pass_obj
+def membership_dataset(context, infile, pairs, capacity, workers, resume):
+    '''Add datasets to groups.
+    '''
+    try:
+        pairs = list(DatasetMembershipCommand.read_pairs(pairs))
+    except CommandError as ex:
+        log_error(ex, context, _log)
+        return
+    if infile is None and not pairs:
+        click.echo('error: --infile or -d/--data required\n')
+        return
 
-        click.echo('Processing user membership for {}(s)...'.format(
-            obj_type.name.lower()))
+    digest, content = (None, None)
+    if infile is not None:
+        try:
+            digest, infile = _hash_input(infile, resume)
+        except CommandError as ex:
+            log_error(ex, context, _log)
+            return
+        if len(context.instances) > 1:
+            # each instance reads the mapping afresh; a single one streams it
+            content = infile.read()
 
-        cmd = MembershipGrantCommand(context, userid, role, objects, obj_type)
-        result = cmd.execute(as_get=False)
-        pprint(result)
+    def _add(instance_context):
+        mapping = io.StringIO(content) if content is not None else infile
+        cmd = DatasetMembershipCommand(instance_context, mapping, pairs,
+                                       capacity)
+        keys = ['{}:{}'.format(*pair) for pair in pairs]
+        with _open_journal(instance_context, 'membership-dataset', resume,
+                           capacity, digest, *keys) as journal:
+            return cmd.execute(as_get=instance_context.as_get,
+                               journal=journal, workers=workers)
+
+    _fan_out(context, _add)
 
 
 @ckanta.command()
 @click.argument('object', type=click.Choice(UploadCommand.TARGET_OBJECTS))
 @click.argument('infile', type=click.File('r'))
+@click.option('-w', '--workers', type=click.IntRange(1), default=1,
+              help='Number of concurrent create requests.')
+@click.option('--resume', default=False, is_flag=True,
+              help='Skip rows completed by an earlier interrupted run.')
+@click.option('--sync', default=False, is_flag=True,
+              help='Create new, patch changed and skip unchanged objects.')
 @click.confirmation_option(help="Have you reviewed parameters and want to proceed?")
 @click.pass_obj
-def upload(context, object, infile):
+def upload(context, object, infile, workers, resume, sync):
     '''Create objects (dataset) on a CKAN instance.
     '''
     try:
+        digest, infile = _hash_input(infile, resume)
         kwargs = {'object': object, 'infile': infile}
         cmd = UploadCommand(context, **kwargs)
-        result = cmd.execute(as_get=False)
+        with _open_journal(context, 'upload', resume, object,
+                           digest) as journal:
+            result = cmd.execute(as_get=False, workers=workers,
+                                 journal=journal, sync=sync)
         pprint(result)
     except CommandError as ex:
         log_error(ex, context, _log)
@@ -248,35 +660,186 @@ def upload(context, object, infile):
 @click.option('-a', '--authkey', type=click.STRING, default=None)
 @click.option('-f', '--format', 
               type=click.Choice(UploadDatasetCommand.TARGET_FORMATS.keys()))
+@click.option('-w', '--workers', type=click.IntRange(1), default=1,
+              help='Number of concurrent create requests.')
+@click.option('--resume', default=False, is_flag=True,
+              help='Skip rows completed by an earlier interrupted run.')
+@click.option('--sync', default=False, is_flag=True,
+              help='Create new, patch changed and skip unchanged datasets.')
 @click.confirmation_option(help="Have you reviewed parameters and want to proceed?")
 @click.pass_obj
-def upload_dataset(context, infile, owner_orgs, urlbase, authkey, format):
+def upload_dataset(context, infile, owner_orgs, urlbase, authkey, format,
+                   workers, resume, sync):
     try:
+        digest, infile = _hash_input(infile, resume)
         cmd = UploadDatasetCommand(
             context, infile, owner_orgs, urlbase, authkey, format
         )
-        result = cmd.execute(as_get=False)
+        with _open_journal(context, 'upload-dataset', resume, digest,
+                           owner_orgs) as journal:
+            result = cmd.execute(as_get=False, workers=workers,
+                                 journal=journal, sync=sync)
         pprint(result)
     except CommandError as ex:
         log_error(ex, context, _log)
 
 
-@ckanta.command()
-@click.argument('object', type=click.Choice(PurgeCommand.TARGET_OBJECTS))
-@click.option('--infile', type=click.File('r'))
+def _parse_assignments(ctx, param, values):
+    '''Parses `field=value` option values into a dict.
+    '''
+    assignments = {}
+    for value in values:
+        field, sep, assigned = value.partition('=')
+        if not sep or not field.strip():
+            raise click.BadParameter(
+                'Expected field=value, got: {}'.format(value))
+        assignments[field.strip()] = assigned
+    return assignments
+
+
+@ckanta.group()
+@click.pass_obj
+def patch(context):
+    '''Change fields of existing objects on a CKAN instance.
+    '''
+    pass
+
+
+@patch.command('dataset')
+@click.option('-q', '--query', default=None,
+              help='Solr query selecting the datasets to patch.')
+@click.option('--infile', type=click.File('r'),
+              help='File listing ids or names of datasets to patch.')
 @click.option('--id', 'ids', multiple=True)
+@click.option('--set', 'set_fields', multiple=True,
+              callback=_parse_assignments, metavar='FIELD=VALUE',
+              help='Field to set to a value; repeat for several.')
+@click.option('--unset', 'unset_fields', multiple=True, metavar='FIELD',
+              help='Field to clear; repeat for several.')
+@click.option('--template', 'templates', multiple=True,
+              callback=_parse_assignments, metavar='FIELD=TEMPLATE',
+              help="Field to set from other fields, e.g. "
+                   "'title={title} ({organization[title]})'.")
+@click.option('-w', '--workers', type=click.IntRange(1), default=1,
+              help='Number of concurrent patch requests.')
+@click.option('--resume', default=False, is_flag=True,
+              help='Skip datasets patched by an earlier interrupted run.')
+@click.confirmation_option(help="Have you reviewed parameters and want to proceed?")
 @click.pass_obj
-def purge(context, object, infile, ids):
-    '''Purge objects on a CKAN instance.
+def patch_dataset(context, query, infile, ids, set_fields, unset_fields,
+                  templates, workers, resume):
+    '''Patch datasets selected by query and/or id using package_patch.
     '''
     try:
-        kwargs = {'object': object, 'ids': ids, 'infile': infile}
-        cmd = PurgeCommand(context, **kwargs)
-        result = cmd.execute(as_get=False)
+        digest = None
+        if infile is not None:
+            digest, infile = _hash_input(infile, resume)
+
+        cmd = PatchCommand(context, 'dataset', query, infile, ids,
+                           set_fields, unset_fields, templates)
+        changes = json.dumps([set_fields, unset_fields, templates],
+                             sort_keys=True)
+        with _open_journal(context, 'patch', resume, query, digest, changes,
+                           *ids) as journal:
+            result = cmd.execute(as_get=context.as_get, workers=workers,
+                                 journal=journal)
         pprint(result)
     except CommandError as ex:
         log_error(ex, context, _log)
 
 
+@ckanta.command()
+@click.argument('source', type=click.STRING)
+@click.argument('target', type=click.STRING)
+@click.option('-o', '--object', 'objects', multiple=True,
+              type=click.Choice(MirrorCommand.TARGET_OBJECTS),
+              help='Object type to mirror; repeat for several. All by default.')
+@click.option('-q', '--query', type=click.STRING, default=None,
+              help='Solr query selecting the datasets to mirror.')
+@click.option('-w', '--workers', type=click.IntRange(1), default=1,
+              help='Number of concurrent create or patch requests.')
+@click.confirmation_option(help="Have you reviewed parameters and want to proceed?")
+@click.pass_context
+def mirror(ctx, source, target, objects, query, workers):
+    '''Copy organizations, groups and datasets from the SOURCE instance
+    to the TARGET instance.
+    '''
+    connect = ctx.meta[CONNECT_KEY]
+    try:
+        source_context, target_context = connect(source), connect(target)
+    except ConfigError as ex:
+        click.echo('error: {}\n'.format(ex))
+        sys.exit()
+
+    try:
+        cmd = MirrorCommand(target_context, source_context, objects, query)
+        for (object_type, result) in cmd.execute(workers=workers).items():
+            click.echo('{}:'.format(object_type))
+            pprint(result)
+    except CommandError as ex:
+        log_error(ex, target_context, _log)
+
+
+@ckanta.command()
+@click.argument('object', type=click.Choice(PurgeCommand.TARGET_OBJECTS))
+@click.option('--infile', type=click.File('r'))
+@click.option('--id', 'ids', multiple=True)
+@click.option('--resume', default=False, is_flag=True,
+              help='Skip ids purged by an earlier interrupted run.')
+@click.option('-w', '--workers', type=click.IntRange(1), default=1,
+              help='Number of concurrent purge requests.')
+@click.option('--outfile', type=click.File('w'), default=None,
+              help='File to write outcomes to as they complete; only a '
+                   'summary is printed.')
+@click.option('-q', '--query', default=None,
+              help='Solr query selecting datasets to purge, e.g. '
+                   "'organization:abia state:draft'.")
+@click.option('--dry-run', default=False, is_flag=True,
+              help='Print the number of datasets matching --query only.')
+@click.pass_obj
+def purge(context, object, infile, ids, resume, workers, outfile, query,
+          dry_run):
+    '''Purge objects on a CKAN instance.
+    '''
+    if dry_run:
+        def _count(instance_context):
+            cmd = PurgeCommand(instance_context, object, None, [], query)
+            return {'count': cmd.count(as_get=instance_context.as_get)}
+
+        _fan_out(context, _count)
+        return
+
+    digest, content = (None, None)
+    if infile is not None:
+        try:
+            digest, infile = _hash_input(infile, resume)
+        except CommandError as ex:
+            log_error(ex, context, _log)
+            return
+        if len(context.instances) > 1:
+            # each instance reads the ids afresh; a single one streams them
+            content = infile.read()
+
+    lock = threading.Lock()
+
+    def _purge(instance_context):
+        kwargs = {
+            'object': object, 'ids': ids, 'query': query,
+            'infile': io.StringIO(content) if content is not None else infile
+        }
+        results = outfile
+        if outfile is not None and len(context.instances) > 1:
+            results = _TaggedWriter(outfile, instance_context.instance, lock)
+
+        cmd = PurgeCommand(instance_context, **kwargs)
+        identity = (object, digest) + ((query,) if query else ()) + ids
+        with _open_journal(instance_context, 'purge', resume,
+                           *identity) as journal:
+            return cmd.execute(as_get=False, journal=journal,
+                               workers=workers, outfile=results)
+
+    _fan_out(context, _purge)
+
+
 if __name__ == '__main__':
     ckanta()
@@ -1,25 +1,174 @@
 import re
 import csv
+import json
 import click
+import hashlib
 import logging
-from itertools import chain
-from urllib.parse import unquote
+from itertools import chain, islice
+from urllib.parse import quote, unquote
 
-from furl import furl
-from slugify import slugify
 from collections import OrderedDict, namedtuple
-from .common import CKANTAError, CKANObject, MembershipRole, ApiClient
+from .common import CKANTAError, CKANObject, MembershipRole, \
+     iter_concurrent, aiter_concurrent
 
 
 _log = logging.getLogger()
 
 
+def _slugify(text):
+    # imported on first use; keeps it off the CLI startup path
+    from slugify import slugify
+    return slugify(text)
+
+
+def _normalize(value):
+    '''Normalizes a payload value so values read from a CSV file compare
+    equal to the typed values returned by CKAN.
+    '''
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, dict):
+        return {k: _normalize(v) for (k, v) in value.items()}
+    if isinstance(value, (list, tuple)):
+        # order of extras, groups etc. returned by CKAN isn't significant
+        items = [_normalize(v) for v in value]
+        return sorted(items, key=lambda v: json.dumps(v, sort_keys=True))
+    return value
+
+
+def _project(remote, local):
+    '''Returns the part of a remote value having the shape of local value.
+    '''
+    if isinstance(local, dict):
+        remote = remote if isinstance(remote, dict) else {}
+        return {k: _project(remote.get(k), v) for (k, v) in local.items()}
+    if isinstance(local, (list, tuple)) and local and \
+            isinstance(local[0], dict):
+        keys = set(chain(*[item.keys() for item in local]))
+        return [
+            {k: item.get(k) for k in keys if k in item}
+            for item in (remote or []) if isinstance(item, dict)
+        ]
+    return remote
+
+
+def content_hash(value):
+    '''Returns a hash of the normalized content of value.
+    '''
+    content = json.dumps(_normalize(value), sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def diff_payload(payload, remote):
+    '''Returns the fields of payload whose values differ from the remote
+    object; an empty dict if both have the same content.
+    '''
+    projected = _project(remote, payload)
+    if content_hash(payload) == content_hash(projected):
+        return {}
+
+    return {
+        field: value for (field, value) in payload.items()
+        if _normalize(value) != _normalize(projected.get(field))
+    }
+
+
 class CommandError(CKANTAError):
     '''Expection raise for Command execution related errors.
     '''
     pass
 
 
+def _fetch_records(api_client, action_name, payload, as_get, stream=False,
+                   path=('result',)):
+    '''Yields the records at path within the response to an action; they
+    are decoded as the response streams in if stream is set.
+    '''
+    try:
+        if stream:
+            yield from api_client.iter_result(action_name, payload, as_get,
+                                              path)
+        else:
+            result = api_client(action_name, payload, as_get)
+            if hasattr(result, '__await__'):
+                # paging runs outside an event loop
+                result.close()
+                raise CKANTAError(
+                    'Paged records are not supported asynchronously'
+                )
+            for key in path:
+                result = result[key]
+            yield from result
+    except CKANTAError:
+        raise
+    except Exception as ex:
+        raise CommandError('API request failed.') from ex
+
+
+class _RemoteIndex:
+    '''Compact index of existing objects by name holding only their id and
+    a hash of their content in the shape of a payload sent for them.
+
+    Payloads of another shape than the one indexed, or whose content hash
+    differs, are taken to have changed as a whole.
+    '''
+
+    def __init__(self, records, shape):
+        self.entries = {
+            record['name']: (record['id'],
+                             content_hash(_project(record, shape)))
+            for record in records
+        }
+
+    def diff(self, payload):
+        '''Returns the id of the existing object for payload and the fields
+        to patch; None if there is no such object.
+        '''
+        entry = self.entries.get(payload.get('name'))
+        if entry is None:
+            return None
+
+        remote_id, digest = entry
+        if content_hash(payload) == digest:
+            return (remote_id, {})
+        return (remote_id, dict(payload))
+
+
+class _RemoteLookup:
+    '''Looks up existing objects by name as payloads are sent; used in place
+    of a `_RemoteIndex` where objects are few but have large records.
+    '''
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+
+    def diff(self, payload):
+        '''Returns the id of the existing object for payload and its changed
+        fields; None if there is no such object.
+        '''
+        name = payload.get('name')
+        remote = self.fetch(name) if name else None
+        if remote is None:
+            return None
+        return (remote['id'], diff_payload(payload, remote))
+
+
+class _ClientContext:
+    '''Context delegating to another but for the client used.
+    '''
+
+    def __init__(self, context, client):
+        self._context = context
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+
 class CommandBase:
     TARGET_OBJECTS = []
 
@@ -46,11 +195,165 @@ class CommandBase:
         if target_object == 'dataset':
             args['object'] = 'package'
 
+    def execute(self, as_get=True):
+        raise NotImplementedError()
+
+    async def execute_async(self, as_get=True):
+        '''Executes the command using an AsyncApiClient as context client.
+
+        Subclasses which support running on an event loop override this.
+        '''
+        errmsg = '{} cannot be executed asynchronously'
+        raise CommandError(errmsg.format(type(self).__name__))
+
+    def _send_payloads(self, action_name, factory, workers=1, journal=None,
+                       remote_index=None):
+        '''Sends each payload produced by factory to the named action.
+
+        Payloads are dispatched to a bounded pool of workers when workers
+        is greater than 1; outcomes are reported in the order of the
+        payloads irrespective of the order in which requests complete.
+        Payloads completed in an earlier run recorded in journal are
+        skipped and successful ones are recorded as they complete.
+
+        If remote_index, a `_RemoteIndex` or `_RemoteLookup` of existing
+        objects, is given payloads are synced instead: only new objects are
+        created, changed ones patched and unchanged ones skipped.
+        '''
+        if workers > 1:
+            self.api_client.resize_pool(workers)
+
+        def _send(payload):
+            name, data, mark = self._plan_request(
+                action_name, payload, remote_index
+            )
+            if name is not None:
+                _log.debug('{} payload: {}'.format(name, data))
+                self.api_client(name, data, as_get=False)
+            if journal is not None:
+                journal.record(self._get_payload_key(payload))
+            return mark
+
+        if journal is not None:
+            factory = journal.filter(factory, self._get_payload_key)
+
+        passed, action_result = (0, [])
+        for (payload, mark, ex) in iter_concurrent(_send, factory, workers):
+            passed += self._record_outcome(action_result, payload, ex, mark)
+        return self._build_send_summary(
+            action_result, passed, journal, remote_index is not None
+        )
+
+    def _plan_request(self, action_name, payload, remote_index=None):
+        '''Returns the (action name, payload, outcome mark) of the request
+        to make for a payload; the action name is None if no request is
+        needed as the remote object is already up to date.
+        '''
+        if remote_index is None:
+            return (action_name, payload, '+')
+
+        found = remote_index.diff(payload)
+        if found is None:
+            return (action_name, payload, '+')
+
+        remote_id, changes = found
+        if not changes:
+            return (None, None, '=')
+
+        changes['id'] = remote_id
+        patch_action = '{}_patch'.format(action_name.rsplit('_', 1)[0])
+        return (patch_action, changes, '~')
+
+    async def _send_payloads_async(self, action_name, factory, workers=1,
+                                   journal=None):
+        '''Asynchronous counterpart of `_send_payloads`; workers caps the
+        number of requests awaited concurrently.
+        '''
+        self.api_client.resize_pool(workers)
+
+        async def _send(payload):
+            _log.debug('{} payload: {}'.format(action_name, payload))
+            result = await self.api_client(action_name, payload, as_get=False)
+            if journal is not None:
+                journal.record(self._get_payload_key(payload))
+            return result
+
+        if journal is not None:
+            factory = journal.filter(factory, self._get_payload_key)
+
+        passed, action_result = (0, [])
+        async for (payload, _, ex) in aiter_concurrent(_send, factory, workers):
+            passed += self._record_outcome(action_result, payload, ex)
+        return self._build_send_summary(action_result, passed, journal)
+
+    def _get_payload_key(self, payload):
+        return payload.get('name', '?')
+
+    def _index_remote(self, factory, records):
+        '''Returns factory and a `_RemoteIndex` of the existing objects in
+        records in the shape of the first payload of factory; records are
+        only retrieved if there is a payload.
+        '''
+        first = next(factory, None)
+        if first is None:
+            return (factory, _RemoteIndex([], {}))
+        return (chain([first], factory), _RemoteIndex(records, first))
+
+    def _get_uncached_client(self):
+        '''Returns the client bypassing the response cache; reads deciding
+        what to write are made with it so they never see stale objects.
+        '''
+        without_cache = getattr(self.api_client, 'without_cache', None)
+        return without_cache() if without_cache else self.api_client
+
+    def _get_uncached_context(self):
+        return _ClientContext(self.context, self._get_uncached_client())
+
+    def _show_remote(self, target_object, name, as_get=True):
+        '''Returns the named object of the instance or None if not found.
+        '''
+        action_name = '{}_show'.format(target_object)
+        client = self._get_uncached_client()
+        try:
+            return client(action_name, {'id': name}, as_get)['result']
+        except Exception as ex:
+            response = getattr(ex, 'response', None)
+            if getattr(response, 'status_code', None) == 404:
+                return None
+            raise
+
+    def _record_outcome(self, action_result, payload, ex, mark='+'):
+        if ex is not None:
+            _log.error('API request failed. {}'.format(ex))
+            action_result.append('x {}'.format(payload.get('name', '?')))
+            return 0
+
+        action_result.append('{} {}'.format(mark, payload.get('name', '?')))
+        return 1
+
+    def _build_send_summary(self, action_result, passed, journal=None,
+                            synced=False):
+        total_items = len(action_result)
+        summary = {
+            'total': total_items, 'passed': passed,
+            'failed': total_items - passed
+        }
+        if journal is not None:
+            summary['skipped'] = journal.skipped
+        if synced:
+            marks = [entry[0] for entry in action_result]
+            summary.update({
+                'created': marks.count('+'), 'patched': marks.count('~'),
+                'unchanged': marks.count('=')
+            })
+        return {'result': action_result, 'summary': summary}
+
 
 class ListCommand(CommandBase):
     '''Retrieve and list objects from a CKAN instance.
     '''
     TARGET_OBJECTS = ('dataset', 'group', 'organization', 'user')
+    PAGE_SIZE = 500
 
     def _build_group_payload(self):
         payload = {
@@ -80,7 +383,7 @@ class ListCommand(CommandBase):
         payload.update(self.action_args)
         return payload
 
-    def execute(self, as_get=True):
+    def _build_request(self):
         target_object = self.action_args.pop('object')
         action_name = '{}_list'.format(target_object)
 
@@ -93,12 +396,63 @@ class ListCommand(CommandBase):
         _log.debug('action: {}, unified payload: {}'.format(
             action_name, payload
         ))
+        return (action_name, payload)
+
+    def execute(self, as_get=True):
+        action_name, payload = self._build_request()
         try:
             result = self.api_client(action_name, payload, as_get=as_get)
         except Exception as ex:
             raise CommandError('API request failed.') from ex
         return result
 
+    async def execute_async(self, as_get=True):
+        action_name, payload = self._build_request()
+        try:
+            result = await self.api_client(action_name, payload, as_get=as_get)
+        except Exception as ex:
+            raise CommandError('API request failed.') from ex
+        return result
+
+    def iter_records(self, as_get=True, page_size=None, stream=False):
+        '''Yields listed objects one at a time, walking through pages of
+        page_size records using the limit/offset arguments of the action.
+
+        Only a single page is held in memory at any time; with stream set
+        records are yielded as they are decoded so not even a whole page is.
+        '''
+        action_name, payload = self._build_request()
+        page_size = page_size or self.PAGE_SIZE
+        offset = int(payload.pop('offset', 0))
+
+        first_record = None
+        while True:
+            page_payload = dict(payload, limit=page_size, offset=offset)
+            records = _fetch_records(self.api_client, action_name,
+                                     page_payload, as_get, stream)
+            count, page_first = (0, None)
+            try:
+                for record in records:
+                    # stop when the action ignores paging and keeps
+                    # returning the same records
+                    if count == 0:
+                        if record == first_record:
+                            break
+                        page_first = record
+
+                    count += 1
+                    yield record
+            finally:
+                records.close()
+
+            # servers cap `limit` so a short page isn't necessarily the
+            # last; only an empty one is
+            if count == 0:
+                break
+
+            first_record = page_first
+            offset += count
+
 
 class ShowCommand(CommandBase):
     '''Retrieve and show an object from a CKAN instance.
@@ -115,18 +469,165 @@ class ShowCommand(CommandBase):
     def _build_dataset_payload(self):
         return {}
 
-    def execute(self, as_get=True):
+    def _build_request(self):
         object_id = self.action_args.pop('id')
         target_object = self.action_args.pop('object')
         action_name = '{}_show'.format(target_object)
+        return (action_name, {'id': object_id})
 
-        payload = {'id': object_id}
+    def execute(self, as_get=True):
+        action_name, payload = self._build_request()
         try:
             result = self.api_client(action_name, payload, as_get=as_get)
         except Exception as ex:
             raise CommandError('API request failed.') from ex
         return result
 
+    async def execute_async(self, as_get=True):
+        action_name, payload = self._build_request()
+        try:
+            result = await self.api_client(action_name, payload, as_get=as_get)
+        except Exception as ex:
+            raise CommandError('API request failed.') from ex
+        return result
+
+
+class DumpCommand(CommandBase):
+    '''Export full metadata of objects on a CKAN instance in bulk.
+    '''
+    TARGET_OBJECTS = ('dataset',)
+    ROWS = 1000
+    SEARCH_PATH = ('result', 'results')
+
+    def __init__(self, context, object, query=None, fields=None, rows=None,
+                 start=0, include_private=False, include_drafts=False):
+        super().__init__(context, object=object)
+        self.query = query or '*:*'
+        self.fields = list(fields or [])
+        self.rows = rows or self.ROWS
+        self.start = start
+        self.include_private = include_private
+        self.include_drafts = include_drafts
+
+    def _build_package_payload(self):
+        payload = {
+            'q': self.query,
+            'sort': 'name asc',
+            'include_private': self.include_private
+        }
+        if self.include_drafts:
+            payload['include_drafts'] = True
+        if self.fields:
+            # package_search converts a string `fl` into a single item list
+            # which it then joins with spaces; this works for GET and POST
+            payload['fl'] = ' '.join(self.fields)
+        return payload
+
+    def _project(self, record):
+        if not self.fields:
+            return record
+        return {field: record.get(field) for field in self.fields}
+
+    def _build_request(self):
+        target_object = self.action_args['object']
+        action_name = '{}_search'.format(target_object)
+        payload = getattr(self, '_build_{}_payload'.format(target_object))()
+        _log.debug('action: {}, payload: {}'.format(action_name, payload))
+        return (action_name, payload)
+
+    def count(self, as_get=True):
+        '''Returns the number of matching records without retrieving any.
+        '''
+        action_name, payload = self._build_request()
+        try:
+            result = self.api_client(action_name, dict(payload, rows=0),
+                                     as_get)
+        except Exception as ex:
+            raise CommandError('API request failed.') from ex
+        return result['result']['count']
+
+    def iter_records(self, as_get=True, stream=False, keyset=False):
+        '''Yields matching records one at a time, paging through the search
+        action with `rows`/`start` so only a single page is held in memory;
+        with stream set records are yielded as they are decoded.
+
+        With keyset set pages are instead selected by filtering on names
+        after the last one seen, which stays correct while the matching
+        records are being purged or changed.
+        '''
+        action_name, payload = self._build_request()
+        if keyset:
+            yield from self._iter_keyset_records(action_name, payload,
+                                                 as_get, stream)
+            return
+
+        start = self.start
+        while True:
+            page_payload = dict(payload, rows=self.rows, start=start)
+            if stream:
+                # the count isn't decoded from a streamed response and
+                # servers cap `rows`, so only an empty page is the last
+                records = _fetch_records(self.api_client, action_name,
+                                         page_payload, as_get, stream,
+                                         self.SEARCH_PATH)
+                count = 0
+                try:
+                    for record in records:
+                        count += 1
+                        yield self._project(record)
+                finally:
+                    records.close()
+
+                start += count
+                if count == 0:
+                    break
+                continue
+
+            try:
+                result = self.api_client(action_name, page_payload, as_get)
+            except Exception as ex:
+                raise CommandError('API request failed.') from ex
+
+            records = result['result']['results']
+            for record in records:
+                yield self._project(record)
+
+            start += len(records)
+            if not records or start >= result['result']['count']:
+                break
+
+    def _iter_keyset_records(self, action_name, payload, as_get=True,
+                             stream=False):
+        if self.fields and 'name' not in self.fields:
+            payload['fl'] = '{} name'.format(payload['fl'])
+
+        last_name = None
+        while True:
+            page_payload = dict(payload, rows=self.rows, start=0)
+            if last_name is not None:
+                page_payload['fq'] = 'name:{{"{}" TO *]'.format(
+                    last_name.replace('\\', '\\\\').replace('"', '\\"')
+                )
+
+            records = _fetch_records(self.api_client, action_name,
+                                     page_payload, as_get, stream,
+                                     self.SEARCH_PATH)
+            count = 0
+            try:
+                for record in records:
+                    count += 1
+                    last_name = record['name']
+                    yield self._project(record)
+            finally:
+                records.close()
+
+            # servers cap `rows` so only an empty page is the last
+            if count == 0:
+                break
+
+    def execute(self, as_get=True):
+        return list(self.iter_records(as_get))
+
 
 class MembershipCommand(CommandBase):
     COMMAND = '::list'
@@ -138,17 +639,20 @@ class MembershipCommand(CommandBase):
         self.check_group = check_group
         self.userid = userid
 
-    def execute(self, as_get):
+    def _build_requests(self):
         payload = {'id': self.userid}
         action_names = self.TARGET_ACTIONS
         _log.debug('action_names: {}; payload: {}'.format(
             action_names, payload)
         )
 
-        results = []
         targets = action_names[:1] if not self.check_group else action_names
+        return [(action_name, payload) for action_name in targets]
+
+    def execute(self, as_get):
+        results = []
         try:
-            for action_name in targets:
+            for (action_name, payload) in self._build_requests():
                 # title = action_name.split('_')[0]
                 result = self.api_client(action_name, payload, as_get)
                 results.append(result)
@@ -156,16 +660,72 @@ class MembershipCommand(CommandBase):
             raise CommandError('API request failed.') from ex
         return results
 
+    async def execute_async(self, as_get):
+        import asyncio
+
+        try:
+            results = await asyncio.gather(*[
+                self.api_client(action_name, payload, as_get)
+                for (action_name, payload) in self._build_requests()
+            ])
+        except Exception as ex:
+            raise CommandError('API request failed.') from ex
+        return list(results)
+
 
 class MembershipGrantCommand(CommandBase):
+    '''Grants users a role on groups, organizations or datasets.
+
+    Grants are made for every user and object given plus any (user, object)
+    pairs. Current memberships are retrieved once beforehand so grants of a
+    role users already hold are skipped; the rest are made concurrently.
+    '''
     TARGET_OBJECTS = ('user',)
+    USER_FIELD = 'user'
 
-    def __init__(self, context, userid, role, objects, object_type):
+    def __init__(self, context, userid, role, objects, object_type,
+                 pairs=None):
         super().__init__(context, object='user')
         self.role = MembershipRole.from_name(role)
         self.object_type = object_type
         self.objects = objects
-        self.userid = userid
+
+        userids = userid
+        if isinstance(userid, str):
+            userids = [u.strip() for u in userid.split(',')]
+        self.userids = [u for u in (userids or []) if u and u != '-']
+
+        grants = [(u, obj) for u in self.userids for obj in (objects or [])]
+        grants.extend(tuple(pair) for pair in (pairs or []))
+        self.grants = list(OrderedDict.fromkeys(grants))
+
+    @classmethod
+    def read_grants(cls, file_obj):
+        '''Reads (user, object) pairs from a CSV file with a `user` column
+        and a column named after the object type, i.e. `group`,
+        `organization` or `dataset`. Returns the pairs keyed by CKANObject.
+        '''
+        reader = csv.DictReader(file_obj, delimiter=',')
+        fields = [f for f in (reader.fieldnames or []) if f != cls.USER_FIELD]
+        object_types = [
+            obj for obj in (
+                CKANObject.GROUP, CKANObject.ORGANIZATION, CKANObject.DATASET
+            ) if obj.name.lower() in fields
+        ]
+        if cls.USER_FIELD not in (reader.fieldnames or []) or not object_types:
+            raise CommandError(
+                "Grants file requires a 'user' column and a 'group', "
+                "'organization' or 'dataset' column"
+            )
+
+        grants = OrderedDict((obj, []) for obj in object_types)
+        for row in reader:
+            userid = (row.get(cls.USER_FIELD) or '').strip()
+            for obj_type in object_types:
+                object_id = (row.get(obj_type.name.lower()) or '').strip()
+                if userid and object_id:
+                    grants[obj_type].append((userid, object_id))
+        return grants
 
     def _get_access_request_payload(self, object_id, user_dict):
         return {
@@ -182,7 +742,71 @@ class MembershipGrantCommand(CommandBase):
             'country_state': user_dict['country_state']
         }
 
-    def _create_membership(self, object_id):
+    def _get_grant_key(self, grant):
+        return '{}:{}'.format(*grant)
+
+    def _fetch_organization_memberships(self, grants, as_get, workers):
+        client = self._get_uncached_client()
+
+        def _fetch(userid):
+            payload = {'id': userid, 'permission': 'read'}
+            action_name = 'organization_list_for_user'
+            return client(action_name, payload, as_get)['result']
+
+        memberships = {}
+        userids = list(OrderedDict.fromkeys(u for (u, _) in grants))
+        for (userid, orgs, ex) in iter_concurrent(_fetch, userids, workers):
+            if ex is not None:
+                _log.warning('Failed retrieving organizations of {}: {}'.format(
+                    userid, ex))
+                continue
+
+            for org in orgs:
+                for key in (org.get('id'), org.get('name')):
+                    memberships[(userid, key)] = org.get('capacity')
+        return memberships
+
+    def _fetch_group_memberships(self, grants, as_get, workers):
+        # group_list_authz lists the groups of the caller rather than those
+        # of a given user, so the members of each group are listed instead
+        client = self._get_uncached_client()
+
+        def _fetch_user_id(userid):
+            result = client('user_show', {'id': userid}, as_get)
+            return result['result']['id']
+
+        def _fetch_members(group):
+            payload = {'id': group, 'object_type': 'user'}
+            result = client('member_list', payload, as_get)
+            return {member[0]: member[2] for member in result['result']}
+
+        user_ids, members = ({}, {})
+        for (mapping, func, keys) in (
+            (user_ids, _fetch_user_id, [u for (u, _) in grants]),
+            (members, _fetch_members, [g for (_, g) in grants])
+        ):
+            keys = list(OrderedDict.fromkeys(keys))
+            for (key, value, ex) in iter_concurrent(func, keys, workers):
+                if ex is not None:
+                    _log.warning('Failed retrieving {} memberships: {}'.format(
+                        key, ex))
+                    continue
+                mapping[key] = value
+
+        return {
+            (userid, group): members.get(group, {}).get(user_ids.get(userid))
+            for (userid, group) in grants
+        }
+
+    def _fetch_memberships(self, grants, as_get, workers=1):
+        '''Returns the roles users currently hold on the target objects as a
+        mapping of (user, object) pairs to role names.
+        '''
+        if self.object_type == CKANObject.ORGANIZATION:
+            return self._fetch_organization_memberships(grants, as_get, workers)
+        return self._fetch_group_memberships(grants, as_get, workers)
+
+    def _create_membership(self, userid, object_id):
         if self.role == MembershipRole.NONE:
             click.echo('Skipping operation as dropping membership (role=none) '
                        'is not supported yet')
@@ -192,53 +816,115 @@ class MembershipGrantCommand(CommandBase):
         target_object = self.object_type.name.lower()
         action_name = '{}_member_create'.format(target_object)
         payload = {
-            'id': object_id, 'username': self.userid, 
+            'id': object_id, 'username': userid,
             'role': role_name
         }
         self.api_client(action_name, data=payload, as_get=False)
 
-    def _grant_dataset_access(self):
-        passed, action_result = (0, [])
-        total = len(self.objects)
-        result = {}
+    def _run_grants(self, grants, grant_func, journal=None, workers=1):
+        '''Makes grants using grant_func on a pool of workers and returns the
+        result summary; grant_func returns '=' for grants already in place
+        and '+' for those made.
+        '''
+        if workers > 1:
+            self.api_client.resize_pool(workers)
+
+        def _grant(grant):
+            mark = grant_func(*grant)
+            if journal is not None:
+                journal.record(self._get_grant_key(grant))
+            return mark
+
+        passed, marks, action_result = (0, [], [])
+        for (grant, mark, ex) in iter_concurrent(_grant, grants, workers):
+            if ex is not None:
+                action_result.append('. {}: {}: err: {}'.format(
+                    grant[0], grant[1], ex))
+                continue
+
+            marks.append(mark)
+            action_result.append('{} {}: {}'.format(mark, *grant))
+            passed += 1
+
+        result = self._build_result_summary(action_result, len(grants), passed)
+        result['summary']['unchanged'] = marks.count('=')
+        return result
 
-        # 1: first retrieve apikey for user to be granted access
-        _log.info('Retrieving details for user requiring access...')
-        try:
-            action_name = 'user_show'
-            result = self.api_client(action_name, {'id': self.userid}, False)
-            result = result['result']
-            _log.info('Requesting user details retrieved')
-        except Exception as ex:
-            _log.info('Failed retrieving details for user needing access')
-            return self._build_result_summary(action_result, total, passed)
+    def _grant_memberships(self, as_get, journal=None, workers=1):
+        grants = self.grants
+        if journal is not None:
+            grants = list(journal.filter(grants, self._get_grant_key))
 
-        # 2: make access request using retrieved user details
-        fullname = result['display_name']
-        _log.info("Making access request as '{}'".format(fullname))
-        for objectid in self.objects:
-            try:
-                # make request as user whom needs access
-                action_name = 'eoc_request_create'
-                payload = self._get_access_request_payload(objectid, result)
-                client = ApiClient(self.api_client.urlbase, result['apikey'])
-                result = client(action_name, payload, False)
-                request_id = result['result']['id']
-                _log.info('Access request made for {}. Got: {}'.format(
-                    objectid, request_id))
-
-                # patch request as user running script
-                action_name = 'eoc_request_patch'
-                payload = {'id': request_id, 'status': 'approved'}
-                result = self.api_client(action_name, payload, False)
-                _log.info('Access request granted\n')
+        memberships = {}
+        if grants and self.role != MembershipRole.NONE:
+            memberships = self._fetch_memberships(grants, as_get, workers)
 
-                passed += 1
-            except Exception as ex:
-                action_result.append('. {}: err: {}'.format(objectid, ex))
+        role_name = self.role.name.lower()
 
-        result = self._build_result_summary(action_result, total, passed)
-        return result
+        def _grant(userid, object_id):
+            if memberships.get((userid, object_id)) == role_name:
+                return '='
+            self._create_membership(userid, object_id)
+            return '+'
+
+        return self._run_grants(grants, _grant, journal, workers)
+
+    def _fetch_users(self, userids, workers=1):
+        '''Retrieves the details, including apikey, of users as a mapping of
+        user ids to user dicts; users which cannot be retrieved are left out.
+        '''
+        def _fetch(userid):
+            return self.api_client('user_show', {'id': userid}, False)['result']
+
+        users = {}
+        for (userid, user_dict, ex) in iter_concurrent(_fetch, userids, workers):
+            if ex is not None:
+                _log.error('Failed retrieving details of user {}: {}'.format(
+                    userid, ex))
+                continue
+            users[userid] = user_dict
+        return users
+
+    def _grant_dataset_access(self, journal=None, workers=1):
+        '''Grants access to datasets by making an access request as each
+        user and approving it as the user running the command.
+
+        Requests are made through a single client per user, sharing the
+        connection pool, while the create and approve steps of different
+        grants run concurrently on the pool of workers.
+        '''
+        grants = self.grants
+        if journal is not None:
+            grants = list(journal.filter(grants, self._get_grant_key))
+
+        _log.info('Retrieving details for users requiring access...')
+        userids = list(OrderedDict.fromkeys(u for (u, _) in grants))
+        users = self._fetch_users(userids, workers)
+        clients = {
+            userid: self.api_client.with_apikey(user_dict['apikey'])
+            for (userid, user_dict) in users.items()
+        }
+
+        def _grant(userid, object_id):
+            user_dict = users.get(userid)
+            if user_dict is None:
+                raise CommandError('Failed retrieving user details')
+
+            # make request as user whom needs access
+            payload = self._get_access_request_payload(object_id, user_dict)
+            result = clients[userid]('eoc_request_create', payload, False)
+            request_id = result['result']['id']
+            _log.info('Access request made for {}. Got: {}'.format(
+                object_id, request_id))
+
+            # approve request as user running script
+            payload = {'id': request_id, 'status': 'approved'}
+            self.api_client('eoc_request_patch', payload, False)
+            _log.info('Access request granted for {} on {}'.format(
+                userid, object_id))
+            return '+'
+
+        return self._run_grants(grants, _grant, journal, workers)
 
     def _build_result_summary(self, action_result, total, passed):
         return {
@@ -248,29 +934,153 @@ class MembershipGrantCommand(CommandBase):
             }
         }
 
-    def execute(self, as_get):
+    def execute(self, as_get, journal=None, workers=1):
         if self.object_type == CKANObject.DATASET:
-            result = self._grant_dataset_access()
+            result = self._grant_dataset_access(journal, workers)
         elif self.object_type in (CKANObject.GROUP, CKANObject.ORGANIZATION):
-            passed, action_result = (0, [])
-            for obj in self.objects:
-                try:
-                    self._create_membership(obj)
-                    action_result.append('+ {}'.format(obj))
-                    passed += 1
-                except Exception as ex:
-                    action_result.append('. {}: err: {}'.format(obj, ex))
-            
-            total = len(self.objects)
-            result = self._build_result_summary(action_result, total, passed)
+            result = self._grant_memberships(as_get, journal, workers)
         return result
 
 
+class DatasetMembershipCommand(CommandBase):
+    '''Adds datasets to groups.
+
+    (dataset, group) pairs are read a batch at a time and grouped by group.
+    The members of each group of a batch are retrieved once so that pairs
+    of datasets, given by id, already in the group are skipped; the
+    remaining member_create requests are made concurrently. Repeated pairs
+    are dropped and a failed pair doesn't stop the others.
+    '''
+    TARGET_OBJECTS = ('dataset',)
+    BATCH_SIZE = 1000
+    CAPACITY = 'member'
+
+    def __init__(self, context, infile=None, pairs=None, capacity=None):
+        super().__init__(context, object='dataset')
+        self.infile = infile
+        self.pairs = [tuple(pair) for pair in (pairs or [])]
+        self.capacity = capacity or self.CAPACITY
+
+    @staticmethod
+    def read_pairs(lines):
+        '''Yields (dataset, group) pairs from lines ending with a dataset
+        and group separated by tabs or two or more spaces, or by a single
+        space if a line has nothing else; lines starting or ending with #
+        are skipped and a line ending with [] ends the mapping.
+        '''
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#') or line.endswith('#'):
+                continue
+            elif line.endswith('[]'):
+                return
+
+            parts = [p for p in re.split(r'\t|\s{2,}', line) if p.strip()]
+            if len(parts) < 2:
+                parts = line.split()
+            if len(parts) < 2:
+                raise CommandError('Invalid mapping line: {}'.format(line))
+            yield tuple(p.strip() for p in parts[-2:])
+
+    def _get_pair_key(self, pair):
+        return '{}:{}'.format(*pair)
+
+    def _fetch_members(self, groups, as_get, workers=1):
+        '''Returns the ids of the datasets in each group keyed by group; a
+        group whose members cannot be retrieved has none.
+        '''
+        client = self._get_uncached_client()
+
+        def _fetch(group):
+            payload = {'id': group, 'object_type': 'package'}
+            result = client('member_list', payload, as_get)
+            return set(member[0] for member in result['result'])
+
+        members = {}
+        for (group, dataset_ids, ex) in iter_concurrent(_fetch, groups,
+                                                        workers):
+            if ex is not None:
+                _log.warning('Failed retrieving members of {}: {}'.format(
+                    group, ex))
+                dataset_ids = set()
+            members[group] = dataset_ids
+        return members
+
+    def _iter_unique(self, pairs):
+        seen = set()
+        for pair in pairs:
+            if pair not in seen:
+                seen.add(pair)
+                yield pair
+
+    def _add_batch(self, batch, as_get, journal=None, workers=1):
+        grouped = OrderedDict()
+        for (dataset, group) in batch:
+            grouped.setdefault(group, []).append(dataset)
+        members = self._fetch_members(list(grouped), as_get, workers)
+
+        def _add(pair):
+            dataset, group = pair
+            mark = '='
+            if dataset not in members[group]:
+                payload = {
+                    'id': group, 'object': dataset, 'object_type': 'package',
+                    'capacity': self.capacity
+                }
+                self.api_client('member_create', payload, as_get=False)
+                mark = '+'
+            if journal is not None:
+                journal.record(self._get_pair_key(pair))
+            return mark
+
+        pairs = [(d, g) for (g, datasets) in grouped.items() for d in datasets]
+        return iter_concurrent(_add, pairs, workers)
+
+    def execute(self, as_get=True, journal=None, workers=1):
+        if workers > 1:
+            self.api_client.resize_pool(workers)
+
+        pairs = iter(self.pairs)
+        if self.infile is not None:
+            pairs = chain(pairs, self.read_pairs(self.infile))
+        pairs = self._iter_unique(pairs)
+        if journal is not None:
+            pairs = journal.filter(pairs, self._get_pair_key)
+
+        passed, unchanged, action_result = (0, 0, [])
+        while True:
+            batch = list(islice(pairs, self.BATCH_SIZE))
+            if not batch:
+                break
+
+            for (pair, mark, ex) in self._add_batch(batch, as_get, journal,
+                                                    workers):
+                if ex is not None:
+                    action_result.append('. {}: {}: err: {}'.format(
+                        pair[0], pair[1], ex))
+                    continue
+
+                action_result.append('{} {}: {}'.format(mark, *pair))
+                unchanged += int(mark == '=')
+                passed += 1
+
+        total = len(action_result)
+        summary = {
+            'total': total, 'passed': passed, 'failed': total - passed,
+            'unchanged': unchanged
+        }
+        if journal is not None:
+            summary['skipped'] = journal.skipped
+        return {'result': action_result, 'summary': summary}
+
+
 class UploadCommand(CommandBase):
     '''Creates an object on a CKAN instance.
     '''
     NATIONAL_KEY = 'national:'
     TARGET_OBJECTS = ('group', 'organization')
+    # max page size of *_list actions with all_fields set on CKAN defaults
+    REMOTE_PAGE_SIZE = 25
 
     def _validate_action_args(self, args):
         '''Validates that action args provided on the cli are valid.
@@ -285,6 +1095,14 @@ class UploadCommand(CommandBase):
         file_arg = args.get('infile', None)
         assert file_arg is not None, "'infile' argument expected"
 
+    def _iter_remote_records(self):
+        '''Yields existing objects of the target type a page at a time.
+        '''
+        target_object = self.action_args['object']
+        cmd = ListCommand(self._get_uncached_context(), object=target_object,
+                          all_fields=True, include_extras=True)
+        return cmd.iter_records(page_size=self.REMOTE_PAGE_SIZE)
+
     def _get_group_payload_factory(self, payload_method, file_obj):
         reader = csv.DictReader(file_obj, delimiter=',')
         for row in reader:
@@ -292,7 +1110,7 @@ class UploadCommand(CommandBase):
 
     def _build_group_payload(self, row_dict):
         row_dict.setdefault('state', 'active')
-        row_dict.setdefault('name', slugify(row_dict.get('title')))
+        row_dict.setdefault('name', _slugify(row_dict.get('title')))
         return row_dict
 
     def _get_organization_payload_factory(self, payload_method, file_obj):
@@ -303,7 +1121,7 @@ class UploadCommand(CommandBase):
 
     def _build_organization_payload(self, row_dict, extras=None):
         row_dict.setdefault('state', 'active')
-        row_dict.setdefault('name', slugify(row_dict.get('title')))
+        row_dict.setdefault('name', _slugify(row_dict.get('title')))
 
         # handle extras
         extras_list = []
@@ -320,7 +1138,7 @@ class UploadCommand(CommandBase):
             row_dict['extras'] = extras_list
         return row_dict
 
-    def execute(self, as_get=True):
+    def _get_payload_factory(self):
         file_obj = self.action_args.pop('infile')
         target_object = self.action_args.pop('object')
         action_name = '{}_create'.format(target_object)
@@ -343,25 +1161,22 @@ class UploadCommand(CommandBase):
         )
 
         factory = factory_method(payload_method, file_obj)
-        passed, action_result = (0, [])
-        for payload in factory:
-            _log.debug('{} payload: {}'.format(target_object, payload))
-            try:
-                self.api_client(action_name, payload, as_get=False)
-                action_result.append('+ {}'.format(payload.get('name', '?')))
-                passed += 1
-            except Exception as ex:
-                _log.error('API request failed. {}'.format(ex))
-                action_result.append('x {}'.format(payload.get('name', '?')))
-
-        total_items = len(action_result)
-        return {
-            'result': action_result, 
-            'summary': {
-                'total': total_items, 'passed': passed,
-                'failed': total_items - passed
-            }
-        }
+        return (action_name, factory)
+
+    def execute(self, as_get=True, workers=1, journal=None, sync=False):
+        records = self._iter_remote_records() if sync else None
+        action_name, factory = self._get_payload_factory()
+        remote_index = None
+        if sync:
+            factory, remote_index = self._index_remote(factory, records)
+        return self._send_payloads(action_name, factory, workers, journal,
+                                   remote_index)
+
+    async def execute_async(self, as_get=True, workers=1, journal=None):
+        action_name, factory = self._get_payload_factory()
+        return await self._send_payloads_async(
+            action_name, factory, workers, journal
+        )
 
 
 class UploadDatasetCommand(CommandBase):
@@ -369,6 +1184,8 @@ class UploadDatasetCommand(CommandBase):
     '''
     VARTAG_STATE = '${state_code}'
     REPTTN_STATE = re.compile("state(?:code|_code)='(.+)'")
+    # placeholder for state codes in compiled urls; survives url encoding
+    STATE_MARKER = 'CKANTASTATECODE'
     NATIONAL_KEY = 'national:'
     TARGET_OBJECTS = ('dataset',)
     TARGET_FORMATS = {
@@ -387,6 +1204,24 @@ class UploadDatasetCommand(CommandBase):
         if not isinstance(owner_orgs, (list, tuple)):
             owner_orgs = owner_orgs.split(',')
         self.owner_orgs = owner_orgs
+        self._url_templates = {}
+
+    def _iter_remote_records(self):
+        '''Yields existing datasets of the owner organizations a page at a
+        time.
+        '''
+        norm = lambda n: n.replace(self.NATIONAL_KEY, '')
+        query = 'organization:({})'.format(
+            ' OR '.join(norm(orgname) for orgname in self.owner_orgs)
+        )
+        cmd = DumpCommand(self._get_uncached_context(), 'dataset',
+                          query=query, include_private=True)
+        for record in cmd.iter_records():
+            # owner_org is an id on CKAN while payloads name organizations
+            organization = record.get('organization')
+            if isinstance(organization, dict) and organization.get('name'):
+                record['owner_org'] = organization['name']
+            yield record
 
     def _get_package_payload_factory(self, payload_method, file_obj):
         reader = csv.DictReader(file_obj, delimiter=',')
@@ -394,9 +1229,11 @@ class UploadDatasetCommand(CommandBase):
         norm = lambda n: n.replace(self.NATIONAL_KEY, '')
         for row in reader:
             for orgname in self.owner_orgs:
-                row.setdefault('owner_org', norm(orgname))
-                row.setdefault('locations', norm(orgname))
-                yield payload_method(row, orgname)
+                # payloads may be sent concurrently so each org gets a copy
+                org_row = dict(row)
+                org_row.setdefault('owner_org', norm(orgname))
+                org_row.setdefault('locations', norm(orgname))
+                yield payload_method(org_row, orgname)
 
     def _build_package_payload(self, row_dict, orgname):
         ## required package attributes:
@@ -414,7 +1251,7 @@ class UploadDatasetCommand(CommandBase):
         row_dict.setdefault('type', 'dataset')
         row_dict.setdefault('state', 'active')
         row_dict.setdefault('private', 'false')
-        row_dict.setdefault('name', slugify(row_dict.get('title')))
+        row_dict.setdefault('name', _slugify(row_dict.get('title')))
 
         # use sector_id to define sector
         sector_id = row_dict.get('sector_id', '')
@@ -432,11 +1269,13 @@ class UploadDatasetCommand(CommandBase):
         #     res:name, res:url, 
         ## optinal resource attributes
         #     res:description
-        res_dict = {
-            k[4:]: row_dict[k]
-            for k in row_dict.keys()
-            if k.startswith('res:') and k[4:] and row_dict[k]
-        }
+        # res:* columns are moved off the package payload; they aren't
+        # package fields and would otherwise always differ when syncing
+        res_dict = {}
+        for key in [k for k in row_dict if k.startswith('res:')]:
+            value = row_dict.pop(key)
+            if key[4:] and value:
+                res_dict[key[4:]] = value
         if not res_dict or 'url' not in res_dict:
             return
 
@@ -453,6 +1292,29 @@ class UploadDatasetCommand(CommandBase):
         return res_dict
 
     def _build_resource_url(self, res_url, orgname):
+        '''Returns the resource url for the organization.
+
+        Urls are built from templates compiled once per distinct `res:url`
+        value; the state code of the organization is then substituted at
+        the points found within the CQL filter.
+        '''
+        parts = self._url_templates.get(res_url)
+        if parts is None:
+            parts = self._compile_resource_url(res_url)
+            self._url_templates[res_url] = parts
+
+        if len(parts) == 1:
+            return parts[0]
+
+        state_code = self.context.national_states[orgname].code
+        return quote(state_code, safe='').join(parts)
+
+    def _compile_resource_url(self, res_url):
+        '''Builds the resource url for res_url with a marker in place of the
+        state code and returns the url split at the markers.
+        '''
+        from furl import furl
+
         built_url = None
         if res_url.startswith('http'):
             built_url = furl(unquote(res_url))
@@ -493,21 +1355,23 @@ class UploadDatasetCommand(CommandBase):
             if param_value:
                 built_url.args[param_key] = param_value
 
-        # replace state_code in CQL_FILTER
-        cql_filter = built_url.args['CQL_FILTER']
-        state_code = self.context.national_states[orgname].code
-        if self.VARTAG_STATE in cql_filter:
-            cql_filter = cql_filter.replace(self.VARTAG_STATE, state_code)
-            built_url.args['CQL_FILTER'] = cql_filter
-        else:
-            match = self.REPTTN_STATE.search(cql_filter)
-            if match:
-                found = match.groups()[0]
-                cql_filter = cql_filter.replace(found, state_code)
+        # mark where state_code goes in CQL_FILTER
+        cql_filter = built_url.args.get('CQL_FILTER')
+        if cql_filter:
+            if self.VARTAG_STATE in cql_filter:
+                cql_filter = cql_filter.replace(
+                    self.VARTAG_STATE, self.STATE_MARKER
+                )
                 built_url.args['CQL_FILTER'] = cql_filter
-        return built_url.url
-
-    def execute(self, as_get=True):
+            else:
+                match = self.REPTTN_STATE.search(cql_filter)
+                if match:
+                    found = match.groups()[0]
+                    cql_filter = cql_filter.replace(found, self.STATE_MARKER)
+                    built_url.args['CQL_FILTER'] = cql_filter
+        return built_url.url.split(self.STATE_MARKER)
+
+    def _get_payload_factory(self):
         file_obj = self.infile
         target_object = self.action_args.pop('object')
         action_name = '{}_create'.format(target_object)
@@ -530,26 +1394,290 @@ class UploadDatasetCommand(CommandBase):
         )
 
         factory = factory_method(payload_method, file_obj)
-        passed, action_result = (0, [])
-        for payload in factory:
-            _log.debug('{} payload: {}'.format(target_object, payload))
+        return (action_name, factory)
+
+    def execute(self, as_get=True, workers=1, journal=None, sync=False):
+        records = self._iter_remote_records() if sync else None
+        action_name, factory = self._get_payload_factory()
+        remote_index = None
+        if sync:
+            factory, remote_index = self._index_remote(factory, records)
+        return self._send_payloads(action_name, factory, workers, journal,
+                                   remote_index)
+
+    async def execute_async(self, as_get=True, workers=1, journal=None):
+        action_name, factory = self._get_payload_factory()
+        return await self._send_payloads_async(
+            action_name, factory, workers, journal
+        )
+
 
+class PatchCommand(CommandBase):
+    '''Changes fields of existing datasets on a CKAN instance.
+
+    Datasets are selected by a search query and/or ids; fields are set to
+    a value, unset or set from a template formatted with the fields of the
+    dataset, e.g. `{title} ({organization[title]})`.
+    '''
+    TARGET_OBJECTS = ('dataset',)
+
+    def __init__(self, context, object, query=None, infile=None, ids=None,
+                 set_fields=None, unset_fields=None, templates=None):
+        super().__init__(context, object=object)
+        self.query = query
+        self.infile = infile
+        self.ids = ids or []
+        self.set_fields = dict(set_fields or {})
+        self.unset_fields = list(unset_fields or [])
+        self.templates = dict(templates or {})
+
+        if not (self.set_fields or self.unset_fields or self.templates):
+            raise CommandError('No field changes provided.')
+        if query is None and infile is None and not self.ids:
+            raise CommandError('No query or ids selecting datasets provided.')
+
+    def _iter_targets(self):
+        '''Yields (key, record) pairs for the selected datasets; record is
+        None for datasets selected by id whose fields aren't needed.
+        '''
+        ids = chain(*[id.split(',') for id in self.ids])
+        if self.infile:
+            ids = chain(ids, self.infile)
+        for obj_id in (id.strip() for id in ids if id and id.strip()):
+            yield (obj_id, None)
+
+        if self.query is not None:
+            # only changed fields are needed to skip unchanged datasets
+            # unless templates refer to others
+            fields = None
+            if not self.templates:
+                fields = ['id', 'name'] + list(self.set_fields) + \
+                         self.unset_fields
+            cmd = DumpCommand(self._get_uncached_context(), 'dataset',
+                              query=self.query, fields=fields,
+                              include_private=True)
+            # keyset paging as patches may change which datasets match
+            for record in cmd.iter_records(keyset=True):
+                yield (record['name'], record)
+
+    def _build_changes(self, record):
+        changes = dict(self.set_fields)
+        changes.update((field, '') for field in self.unset_fields)
+        for (field, template) in self.templates.items():
             try:
-                self.api_client(action_name, payload, as_get=False)
-                action_result.append('+ {}'.format(payload.get('name', '?')))
-                passed += 1
-            except Exception as ex:
-                _log.error('API request failed. {}'.format(ex))
-                action_result.append('x {}'.format(payload.get('name', '?')))
+                changes[field] = template.format_map(record)
+            except (KeyError, IndexError, AttributeError) as ex:
+                raise CommandError('Template field not found: {}'.format(
+                    ex)) from ex
+        return changes
+
+    def _patch(self, target, as_get=True):
+        '''Patches a dataset and returns the outcome mark; no request is
+        made if it already has the changes.
+        '''
+        key, record = target
+        if record is None and self.templates:
+            client = self._get_uncached_client()
+            record = client('package_show', {'id': key},
+                            as_get=as_get)['result']
+
+        changes = self._build_changes(record or {})
+        if record is not None:
+            # search results leave out fields without a value (e.g. extras)
+            # and projected records have them as None; such a field is
+            # changed even if it is being unset
+            changes = dict(
+                diff_payload(changes, record),
+                **{f: v for (f, v) in changes.items()
+                   if record.get(f) is None}
+            )
+            if not changes:
+                return '='
 
-        total_items = len(action_result)
-        return {
-            'result': action_result, 
-            'summary': {
-                'total': total_items, 'passed': passed,
-                'failed': total_items - passed
-            }
+        changes['id'] = record['id'] if record else key
+        _log.debug('package_patch payload: {}'.format(changes))
+        self.api_client('package_patch', changes, as_get=False)
+        return '~'
+
+    def execute(self, as_get=True, workers=1, journal=None):
+        if workers > 1:
+            self.api_client.resize_pool(workers)
+
+        def _patch(target):
+            mark = self._patch(target, as_get)
+            if journal is not None:
+                journal.record(target[0])
+            return mark
+
+        targets = self._iter_targets()
+        if journal is not None:
+            targets = journal.filter(targets, lambda target: target[0])
+
+        passed, action_result = (0, [])
+        for (target, mark, ex) in iter_concurrent(_patch, targets, workers):
+            passed += self._record_outcome(
+                action_result, {'name': target[0]}, ex, mark
+            )
+        return self._build_send_summary(action_result, passed, journal, True)
+
+
+class MirrorCommand(CommandBase):
+    '''Copies organizations, groups and datasets from a source CKAN
+    instance onto the instance of the command context.
+
+    Objects are read a page at a time from the source and synced onto the
+    destination as with `upload --sync`: missing objects are created,
+    changed ones patched and unchanged ones skipped. Each object is looked
+    up on the destination as it is sent.
+    '''
+    # in dependency order; datasets refer to organizations and groups
+    TARGET_OBJECTS = ('organization', 'group', 'dataset')
+    PAGE_SIZE = 100
+    # fields set by CKAN or refering to objects by instance specific ids
+    SERVER_FIELDS = frozenset((
+        'id', 'revision_id', 'created', 'metadata_created',
+        'metadata_modified', 'creator_user_id', 'display_name',
+        'image_display_url', 'package_count', 'member_count',
+        'num_followers', 'num_resources', 'num_tags', 'organization',
+        'tracking_summary', 'relationships_as_object',
+        'relationships_as_subject', 'users', 'packages', 'capacity',
+        'is_organization',
+    ))
+    RESOURCE_SERVER_FIELDS = frozenset((
+        'id', 'package_id', 'revision_id', 'created', 'last_modified',
+        'metadata_modified', 'position', 'cache_url', 'cache_last_updated',
+        'datastore_active', 'tracking_summary', 'url_type',
+    ))
+
+    def __init__(self, context, source, objects=None, query=None):
+        super().__init__(context, object=self.TARGET_OBJECTS[0])
+        self.source = source
+        self.query = query
+        objects = objects or self.TARGET_OBJECTS
+        for target_object in objects:
+            assert target_object in self.TARGET_OBJECTS, (
+                'Invalid target object. Any of these expected: {}'.format(
+                    self.TARGET_OBJECTS
+                ))
+        self.objects = [o for o in self.TARGET_OBJECTS if o in objects]
+
+    def _iter_records(self, context, target_object, query=None):
+        if target_object == 'dataset':
+            cmd = DumpCommand(context, 'dataset', query=query,
+                              rows=self.PAGE_SIZE, include_private=True)
+            return cmd.iter_records()
+
+        cmd = ListCommand(context, object=target_object, all_fields=True,
+                          include_extras=True)
+        return cmd.iter_records(page_size=UploadCommand.REMOTE_PAGE_SIZE)
+
+    def _get_remote_lookup(self, target_object, payload_method):
+        '''Returns a lookup of existing objects on the destination by name
+        in the shape of the payloads built for them.
+        '''
+        object_type = target_object.replace('dataset', 'package')
+
+        def _fetch(name):
+            record = self._show_remote(object_type, name)
+            if record is None:
+                return None
+            return dict(payload_method(record), id=record['id'])
+        return _RemoteLookup(_fetch)
+
+    def _build_group_payload(self, record):
+        payload = {
+            k: v for (k, v) in record.items() if k not in self.SERVER_FIELDS
         }
+        if payload.get('extras'):
+            payload['extras'] = [
+                {'key': e['key'], 'value': e['value']}
+                for e in payload['extras']
+            ]
+        return payload
+
+    def _build_organization_payload(self, record):
+        return self._build_group_payload(record)
+
+    def _build_dataset_payload(self, record):
+        payload = self._build_group_payload(record)
+
+        # refer to related objects by name as ids differ across instances
+        organization = record.get('organization')
+        if organization:
+            payload['owner_org'] = organization['name']
+        for field in ('groups', 'tags'):
+            if field in record:
+                payload[field] = [{'name': o['name']} for o in record[field]]
+
+        if 'resources' in record:
+            payload['resources'] = [
+                {k: v for (k, v) in resource.items()
+                 if k not in self.RESOURCE_SERVER_FIELDS}
+                for resource in record['resources']
+            ]
+        return payload
+
+    def _mirror(self, target_object, workers=1):
+        payload_method = getattr(
+            self, '_build_{}_payload'.format(target_object)
+        )
+        remote_index = self._get_remote_lookup(target_object, payload_method)
+        factory = (
+            payload_method(record) for record in
+            self._iter_records(self.source, target_object, self.query)
+        )
+
+        action_name = '{}_create'.format(
+            target_object.replace('dataset', 'package')
+        )
+        return self._send_payloads(action_name, factory, workers,
+                                   remote_index=remote_index)
+
+    def execute(self, as_get=False, workers=1):
+        result = OrderedDict()
+        for target_object in self.objects:
+            _log.debug('mirroring {} objects'.format(target_object))
+            result[target_object] = self._mirror(target_object, workers)
+        return result
+
+
+class IndexBuildCommand(CommandBase):
+    '''Copies the catalogue of a CKAN instance into a local index.
+    '''
+    TARGET_OBJECTS = ('organization', 'group', 'dataset', 'user')
+
+    def __init__(self, context, index, objects=None):
+        super().__init__(context, object=self.TARGET_OBJECTS[0])
+        self.index = index
+        objects = objects or self.TARGET_OBJECTS
+        for target_object in objects:
+            assert target_object in self.TARGET_OBJECTS, (
+                'Invalid target object. Any of these expected: {}'.format(
+                    self.TARGET_OBJECTS
+                ))
+        self.objects = [o for o in self.TARGET_OBJECTS if o in objects]
+
+    def _iter_records(self, target_object, as_get=True):
+        if target_object == 'dataset':
+            cmd = DumpCommand(self.context, 'dataset', include_private=True)
+            return cmd.iter_records(as_get)
+
+        kwargs = {'all_fields': True}
+        if target_object != 'user':
+            kwargs['include_extras'] = True
+        cmd = ListCommand(self.context, object=target_object, **kwargs)
+        return cmd.iter_records(as_get, UploadCommand.REMOTE_PAGE_SIZE)
+
+    def execute(self, as_get=True):
+        summary = OrderedDict()
+        with self.index.rebuild(self.api_client.urlbase) as writer:
+            for target_object in self.objects:
+                summary[target_object] = writer.add(
+                    target_object, self._iter_records(target_object, as_get)
+                )
+                _log.info('indexed {} {} object(s)'.format(
+                    summary[target_object], target_object))
+        return summary
 
 
 class PurgeCommand(CommandBase):
@@ -557,30 +1685,107 @@ class PurgeCommand(CommandBase):
     """
     TARGET_OBJECTS = ('dataset', 'group')
 
-    def __init__(self, context, object, infile, ids):
+    def __init__(self, context, object, infile, ids, query=None):
         super().__init__(context, object=object)
         self.infile = infile
         self.ids = ids
+        self.query = query
+        self.duplicates = 0
+        if query is not None and self.action_args['object'] != 'package':
+            raise CommandError('Only datasets can be selected by query.')
+
+    def _get_search(self):
+        return DumpCommand(self._get_uncached_context(), 'dataset',
+                           query=self.query, fields=['name'],
+                           include_private=True, include_drafts=True)
+
+    def count(self, as_get=True):
+        '''Returns the number of datasets matching the query.
+        '''
+        if self.query is None:
+            raise CommandError('A query is required to count datasets.')
+        return self._get_search().count(as_get)
 
-    def execute(self, as_get=False):
+    def _iter_unique(self, ids):
+        '''Yields ids not seen before, counting the others in duplicates.
+        '''
+        seen = set()
+        for obj_id in ids:
+            if obj_id in seen:
+                self.duplicates += 1
+                continue
+            seen.add(obj_id)
+            yield obj_id
+
+    def _build_requests(self):
         target_object = self.action_args.pop('object')
         target_object = target_object.replace('package', 'dataset')
         action_name = '{}_purge'.format(target_object)
 
-        ids_list = list(filter(
-            lambda id: id and id.strip() != "",
-            chain(*[id.split(',') for id in self.ids])
-        ))
-
+        # ids are read from infile as they are needed so purging of a single
+        # instance can start before a piped listing completes; piped input
+        # isn't hashed for the journal
+        ids = chain(*[id.split(',') for id in self.ids])
         if self.infile:
-            lines = self.infile.readlines()
-            ids_list.extend([ln.strip() for ln in lines])
+            ids = chain(ids, self.infile)
+        if self.query is not None:
+            # keyset paging as matches disappear from the results when purged
+            records = self._get_search().iter_records(keyset=True)
+            ids = chain(ids, (record['name'] for record in records))
+        ids_list = (id.strip() for id in ids if id and id.strip() != "")
+        return (action_name, self._iter_unique(ids_list))
+
+    def execute(self, as_get=False, journal=None, workers=1, outfile=None):
+        '''Purges the objects, up to workers at a time.
+
+        Outcomes are returned as a list or, if outfile is given, written to
+        it a line at a time as they complete and a summary returned instead.
+        '''
+        action_name, ids_list = self._build_requests()
+        if journal is not None:
+            ids_list = journal.filter(ids_list)
+        if workers > 1:
+            self.api_client.resize_pool(workers)
+
+        def _purge(obj_id):
+            self.api_client(action_name, {'id': obj_id}, as_get=as_get)
+            if journal is not None:
+                journal.record(obj_id)
+
+        result, passed, total = ([], 0, 0)
+        for (obj_id, _, ex) in iter_concurrent(_purge, ids_list, workers):
+            if ex is not None:
+                _log.debug('purge failed: {}: {}'.format(obj_id, ex))
+            outcome = '{} {}'.format('+' if ex is None else '.', obj_id)
+            passed += int(ex is None)
+            total += 1
+            if outfile is None:
+                result.append(outcome)
+            else:
+                outfile.write('{}\n'.format(outcome))
+                outfile.flush()
+
+        if outfile is None:
+            return result
+
+        summary = {
+            'total': total, 'passed': passed, 'failed': total - passed,
+            'duplicates': self.duplicates
+        }
+        if journal is not None:
+            summary['skipped'] = journal.skipped
+        return {'summary': summary}
+
+    async def execute_async(self, as_get=False, workers=1):
+        if self.query is not None:
+            raise CommandError('Purging by query cannot be done '
+                               'asynchronously')
+        action_name, ids_list = self._build_requests()
+
+        async def _purge(obj_id):
+            await self.api_client(action_name, {'id': obj_id}, as_get=as_get)
 
         result = []
-        for obj_id in ids_list:
-            try:
-                self.api_client(action_name, {'id': obj_id}, as_get=as_get)
-                result.append('+ {}'.format(obj_id))
-            except Exception as ex:
-                result.append('. {}'.format(obj_id))
+        async for (obj_id, _, ex) in aiter_concurrent(_purge, ids_list, workers):
+            result.append('{} {}'.format('+' if ex is None else '.', obj_id))
         return result
@@ -1,14 +1,29 @@
+import os
+import copy
+import codecs
 import enum
 import json
-import requests
+import time
+import random
+import hashlib
+import logging
 import itertools
+import threading
 import os.path as fs
-from pathlib import Path
 from configparser import ConfigParser
-from collections import namedtuple, OrderedDict
+from collections import namedtuple, OrderedDict, deque
 
-from slugify import slugify
 
+_log = logging.getLogger(__name__)
+CONFIG_SNAPSHOT = 'config.json'
+READ_ACTION_SUFFIXES = (
+    '_show', '_list', '_search', '_list_for_user', '_list_authz'
+)
+
+# actions which leave an instance in the same state when repeated
+RETRY_SAFE_SUFFIXES = READ_ACTION_SUFFIXES + (
+    '_purge', '_patch', '_delete', 'member_create'
+)
 
 
 class CKANTAError(Exception):
@@ -21,12 +36,12 @@ class ConfigError(CKANTAError):
     pass
 
 
-class Config(namedtuple('Config', ['urlbase', 'apikey', 'name'])):
-    '''Config object which optional can carry a name.
+class Config(namedtuple('Config', ['urlbase', 'apikey', 'name', 'options'])):
+    '''Config object which optional can carry a name and client options.
     '''
 
-    def __new__(cls, urlbase, apikey, name=None):
-        return super().__new__(cls, urlbase, apikey, name)
+    def __new__(cls, urlbase, apikey, name=None, options=None):
+        return super().__new__(cls, urlbase, apikey, name, options or {})
 
 
 class EnumMixin:
@@ -57,6 +72,16 @@ class CKANObject(EnumMixin, enum.Enum):
     DATASET = 4
 
 
+State = namedtuple('State', ['code', 'name'])
+
+
+def default_cache_dir():
+    '''Returns the directory where CKANTA keeps cached data.
+    '''
+    cache_home = os.environ.get('XDG_CACHE_HOME') or '~/.cache'
+    return fs.join(fs.expanduser(cache_home), 'ckanta')
+
+
 def read_config(fpath):
     '''Reads the CKANTA configuration at the specified path.
     '''
@@ -70,6 +95,117 @@ def read_config(fpath):
     return configp
 
 
+def parse_national_states(value):
+    '''Parses the `national-states` setting into an ordered mapping of
+    slugified state names to State entries.
+    '''
+    from slugify import slugify
+
+    states = OrderedDict()
+    for entry in itertools.chain(*[
+        ln.split('  ') for ln in value.split('\n') if ln
+    ]):
+        code, name = entry.strip().split(':')
+        name = name.replace("'", '').strip()
+        states[slugify(name)] = State(code, name)
+    return states
+
+
+def _get_snapshot_path(snapshot_path=None):
+    return snapshot_path or fs.join(default_cache_dir(), CONFIG_SNAPSHOT)
+
+
+def compile_config(fpath, snapshot_path=None):
+    '''Reads the CKANTA configuration at the specified path and stores a
+    snapshot of it, including the parsed national-states index, which
+    load_config can read without parsing the file again.
+
+    Returns the config parser, national states and snapshot path.
+    '''
+    configp = read_config(fpath)
+    fpath = fs.expandvars(fs.expanduser(fpath))
+    stat = os.stat(fpath)
+
+    try:
+        value = get_config(configp, 'national-states')
+    except ConfigError:
+        value = None
+    states = parse_national_states(value) if value else None
+
+    snapshot = {
+        'source': fpath,
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'defaults': configp.defaults(),
+        'sections': {
+            name: {
+                key: configp.get(name, key, raw=True)
+                for key in configp[name]
+            } for name in configp.sections()
+        },
+        'national_states': [
+            [slug, state.code, state.name]
+            for (slug, state) in (states or {}).items()
+        ] if states is not None else None
+    }
+
+    snapshot_path = _get_snapshot_path(snapshot_path)
+    os.makedirs(fs.dirname(snapshot_path), exist_ok=True)
+    tmp_path = '{}.tmp'.format(snapshot_path)
+    if fs.exists(tmp_path):
+        os.remove(tmp_path)
+
+    # the snapshot holds the apikeys of every instance; readable by the
+    # owner only like ckanta.conf should be
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as fp:
+        json.dump(snapshot, fp)
+    os.replace(tmp_path, snapshot_path)
+    return (configp, states, snapshot_path)
+
+
+def load_config(fpath, snapshot_path=None):
+    '''Reads the CKANTA configuration at the specified path using the
+    compiled snapshot when one exists.
+
+    A snapshot is used only while the modification time and size of the
+    config file match those it was compiled from; a stale snapshot is
+    compiled again. Returns the config parser and the national states
+    index, which is None unless read from a snapshot.
+    '''
+    snapshot_path = _get_snapshot_path(snapshot_path)
+    try:
+        with open(snapshot_path, 'r') as fp:
+            snapshot = json.load(fp)
+    except (OSError, ValueError):
+        return (read_config(fpath), None)
+
+    fpath = fs.expandvars(fs.expanduser(fpath))
+    try:
+        stat = os.stat(fpath)
+    except OSError as ex:
+        raise ConfigError('File not found: {}'.format(fpath)) from ex
+
+    if (snapshot.get('source'), snapshot.get('mtime'), snapshot.get('size')) \
+            != (fpath, stat.st_mtime_ns, stat.st_size):
+        _log.debug('Config snapshot is stale; compiling again')
+        configp, states, _ = compile_config(fpath, snapshot_path)
+        return (configp, states)
+
+    configp = ConfigParser()
+    configp.read_dict(dict(
+        snapshot['sections'], **{configp.default_section: snapshot['defaults']}
+    ))
+
+    states = None
+    if snapshot['national_states'] is not None:
+        states = OrderedDict(
+            (slug, State(code, name))
+            for (slug, code, name) in snapshot['national_states']
+        )
+    return (configp, states)
+
+
 def get_config(configp, name, section_name=None):
     '''Returns the configuration for the specified name
     '''
@@ -94,7 +230,157 @@ def get_instance_config(configp, name='local'):
     values = list(map(
         lambda k: section.get(k), ('urlbase', 'apikey')
     ))
-    return Config(*values)
+    options = _read_client_options(section)
+    return Config(*values, name=name, options=options)
+
+
+def find_instance_names(configp, patterns):
+    '''Returns the names of the configured instances matching any of the
+    patterns given as instance names or shell-style globs.
+    '''
+    import fnmatch
+
+    prefix = 'instance:'
+    names = [
+        section[len(prefix):] for section in configp.sections()
+        if section.startswith(prefix)
+    ]
+
+    matched = []
+    for pattern in patterns:
+        found = [name for name in names if fnmatch.fnmatchcase(name, pattern)]
+        if not found:
+            errmsg = 'No configured instance matches: {}'
+            raise ConfigError(errmsg.format(pattern))
+        matched.extend(name for name in found if name not in matched)
+    return matched
+
+
+def _read_client_options(section):
+    '''Extracts ApiClient options set within an instance config section.
+    '''
+    options = {}
+    try:
+        for (key, getter) in ApiClient.CONFIG_OPTIONS:
+            if key in section:
+                value = getattr(section, getter)(key)
+                options[key.replace('-', '_')] = value
+    except ValueError as ex:
+        errmsg = 'Invalid option value in section [{}]: {}'
+        raise ConfigError(errmsg.format(section.name, ex)) from ex
+    return options
+
+
+def iter_concurrent(func, items, workers=1, window=None):
+    '''Calls func with each entry of items using a bounded pool of workers.
+
+    Yields (item, result, error) tuples in the same order as items, with at
+    most `window` calls (twice the number of workers by default) in flight
+    at any time. Items are drawn from the iterable lazily on the calling
+    thread so payload factories need not be thread-safe.
+    '''
+    def _call(item):
+        try:
+            return (item, func(item), None)
+        except Exception as ex:
+            return (item, None, ex)
+
+    if workers <= 1:
+        for item in items:
+            yield _call(item)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    window = window or workers * 2
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            pending.append(executor.submit(_call, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+async def aiter_concurrent(func, items, limit=1, window=None):
+    '''Awaits the coroutine function func with each entry of items.
+
+    The asynchronous counterpart of iter_concurrent; at most `limit` calls
+    are awaited concurrently while up to `window` (twice the limit by
+    default) are scheduled ahead. Yields (item, result, error) tuples in
+    the same order as items.
+    '''
+    import asyncio
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _call(item):
+        async with semaphore:
+            try:
+                return (item, await func(item), None)
+            except Exception as ex:
+                return (item, None, ex)
+
+    window = window or limit * 2
+    pending = deque()
+    for item in items:
+        pending.append(asyncio.ensure_future(_call(item)))
+        if len(pending) >= window:
+            yield await pending.popleft()
+
+    while pending:
+        yield await pending.popleft()
+
+
+def is_read_action(action_name):
+    '''Returns True if the named action only reads data from an instance.
+    '''
+    return action_name.endswith(READ_ACTION_SUFFIXES)
+
+
+def is_retry_safe_action(action_name):
+    '''Returns True if the named action can safely be repeated after a
+    request whose outcome is unknown.
+    '''
+    return action_name.endswith(RETRY_SAFE_SUFFIXES)
+
+
+def parse_retry_after(value):
+    '''Returns the delay in seconds requested by a Retry-After header value
+    given either as seconds or as an HTTP date.
+    '''
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    from email.utils import parsedate_to_datetime
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def encode_params(data):
+    '''Encodes an action payload as query string parameters for a GET.
+
+    Booleans are spelt the way CKAN's validators expect them and nested
+    values are JSON encoded.
+    '''
+    params = {}
+    for (key, value) in (data or {}).items():
+        if isinstance(value, bool):
+            value = str(value).lower()
+        elif isinstance(value, (dict, list, tuple)):
+            value = json.dumps(value)
+        params[key] = value
+    return params
 
 
 def log_error(ex, context, logger):
@@ -102,13 +388,293 @@ def log_error(ex, context, logger):
     func('error: {}'.format(ex))
 
 
+class _JSONStream:
+    '''Text buffer over chunks of a JSON document read on demand; consumed
+    text is dropped as more is read.
+    '''
+    WHITESPACE = ' \t\n\r'
+    DELIMITERS = ',]}' + WHITESPACE
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        '''Reads the next chunk into the buffer; returns False at the end of
+        the document.
+        '''
+        for chunk in self.chunks:
+            text = self.text_decoder.decode(chunk)
+            if text:
+                self.buffer = self.buffer[self.pos:] + text
+                self.pos = 0
+                return True
+        self.eof = True
+        return False
+
+    def peek(self):
+        '''Returns the next non-whitespace character without consuming it.
+        '''
+        while True:
+            while self.pos < len(self.buffer) and \
+                    self.buffer[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of JSON document')
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError('Expected one of {!r} at {!r}'.format(
+                chars, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+        return char
+
+    def decode(self):
+        '''Decodes the next value, reading chunks until it is complete.
+        '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+
+            # a number may continue in the next chunk, e.g. after a `.`,
+            # `e` or sign where the decoder stops; it is only complete when
+            # followed by a delimiter
+            is_number = isinstance(value, (int, float)) and \
+                not isinstance(value, bool)
+            if not is_number or self.eof or (
+                    end < len(self.buffer) and
+                    self.buffer[end] in self.DELIMITERS):
+                self.pos = end
+                return value
+            self.fill()
+
+
+def iter_json_items(chunks, path=('result',)):
+    '''Yields the items of the array found at a path of object keys within
+    a JSON document read from chunks of bytes, decoding an item at a time.
+
+    Only the item being decoded and the unread part of a chunk are held in
+    memory; values before the array are decoded and discarded while the
+    rest of the document after it is not read.
+    '''
+    stream = _JSONStream(chunks)
+    for key in path:
+        stream.expect('{')
+        while True:
+            if stream.peek() == '}':
+                raise ValueError('Key not found: {}'.format(key))
+            name = stream.decode()
+            stream.expect(':')
+            if name == key:
+                break
+            stream.decode()
+            if stream.expect(',}') == '}':
+                raise ValueError('Key not found: {}'.format(key))
+
+    stream.expect('[')
+    if stream.peek() == ']':
+        return
+    while True:
+        yield stream.decode()
+        if stream.expect(',]') == ']':
+            return
+
+
+class RateLimiter:
+    '''Token bucket limiting the rate at which requests are made.
+
+    Tokens are replenished at `rate` per second up to `burst` tokens; each
+    request takes a token and waits when none is available.
+    '''
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('rate must be greater than 0')
+
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        '''Takes a token and returns the number of seconds to wait before
+        it may be used.
+        '''
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+
+class RequestStats:
+    '''Per-action counts, sizes, status codes and latencies of the requests
+    made by a client.
+
+    Latencies are the time taken for a response to arrive in full and are
+    counted in the histogram bucket of the first upper bound (in seconds)
+    they fall under. Responses served from the cache are only counted;
+    for streamed responses the time until the body starts arriving and the
+    Content-Length are recorded.
+    '''
+    LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    TABLE_COLUMNS = (
+        'action', 'requests', 'errors', 'retries', 'cached', 'sent',
+        'received', 'mean ms', 'max ms'
+    )
+
+    def __init__(self):
+        self.actions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_entry(self, action_name):
+        entry = self.actions.get(action_name)
+        if entry is None:
+            entry = self.actions[action_name] = {
+                'requests': 0, 'errors': 0, 'retries': 0, 'cached': 0,
+                'bytes_sent': 0, 'bytes_received': 0, 'status_codes': {},
+                'latency': {
+                    'total': 0.0, 'max': 0.0,
+                    'histogram': [0] * (len(self.LATENCY_BUCKETS) + 1)
+                }
+            }
+        return entry
+
+    def record(self, action_name, status_code, latency, bytes_sent=0,
+               bytes_received=0, retry=False):
+        '''Records a request made for the action; status_code is None for
+        requests which failed without a response.
+        '''
+        bucket = len(self.LATENCY_BUCKETS)
+        for (index, bound) in enumerate(self.LATENCY_BUCKETS):
+            if latency <= bound:
+                bucket = index
+                break
+
+        status = str(status_code) if status_code is not None else 'error'
+        with self._lock:
+            entry = self._get_entry(action_name)
+            entry['requests'] += 1
+            entry['retries'] += int(retry)
+            if status_code is None or status_code >= 400:
+                entry['errors'] += 1
+            entry['bytes_sent'] += bytes_sent
+            entry['bytes_received'] += bytes_received
+            entry['status_codes'][status] = \
+                entry['status_codes'].get(status, 0) + 1
+
+            entry['latency']['total'] += latency
+            entry['latency']['max'] = max(entry['latency']['max'], latency)
+            entry['latency']['histogram'][bucket] += 1
+
+    def record_cached(self, action_name):
+        with self._lock:
+            self._get_entry(action_name)['cached'] += 1
+
+    def as_dict(self):
+        '''Returns the stats keyed by action name in a JSON friendly form.
+        '''
+        bounds = ['<={}'.format(b) for b in self.LATENCY_BUCKETS] + [
+            '>{}'.format(self.LATENCY_BUCKETS[-1])
+        ]
+        with self._lock:
+            stats = copy.deepcopy(self.actions)
+
+        for entry in stats.values():
+            latency = entry['latency']
+            latency['mean'] = (
+                latency['total'] / entry['requests']
+                if entry['requests'] else 0.0
+            )
+            latency['histogram'] = OrderedDict(
+                zip(bounds, latency['histogram'])
+            )
+        return stats
+
+    def format_table(self):
+        '''Returns the stats as a plain text table with a row per action.
+        '''
+        rows = [self.TABLE_COLUMNS]
+        for (action_name, entry) in self.as_dict().items():
+            rows.append((
+                action_name, entry['requests'], entry['errors'],
+                entry['retries'], entry['cached'], entry['bytes_sent'],
+                entry['bytes_received'],
+                '{:.1f}'.format(entry['latency']['mean'] * 1000),
+                '{:.1f}'.format(entry['latency']['max'] * 1000)
+            ))
+
+        widths = [max(len(str(row[i])) for row in rows)
+                  for i in range(len(self.TABLE_COLUMNS))]
+        lines = []
+        for row in rows:
+            cells = [str(row[0]).ljust(widths[0])] + [
+                str(value).rjust(width)
+                for (value, width) in zip(row[1:], widths[1:])
+            ]
+            lines.append('  '.join(cells))
+        lines.insert(1, '  '.join('-' * width for width in widths))
+        return '\n'.join(lines)
+
+
+def _get_body_size(body):
+    if body is None:
+        return 0
+    return len(body.encode('utf-8') if isinstance(body, str) else body)
+
+
 class ApiClient:
     API_URL_SUBPATH = 'api/3/action'
+    POOL_CONNECTIONS = 10
+    POOL_MAXSIZE = 10
+    MAX_RETRIES = 3
+    BACKOFF_FACTOR = 0.5
+    MAX_BACKOFF = 60
+    RETRY_STATUSES = (429, 502, 503, 504)
+    STREAM_CHUNK_SIZE = 64 * 1024
 
-    def __init__(self, urlbase, apikey, action_urlsubpath=None):
+    # (config key, ConfigParser getter) for options read from the
+    # [instance:NAME] section of the config file
+    CONFIG_OPTIONS = (
+        ('pool-connections', 'getint'),
+        ('pool-maxsize', 'getint'),
+        ('keep-alive', 'getboolean'),
+        ('timeout', 'getfloat'),
+        ('rate-limit', 'getfloat'),
+        ('rate-burst', 'getint'),
+        ('max-retries', 'getint'),
+        ('backoff-factor', 'getfloat'),
+        ('max-backoff', 'getfloat'),
+    )
+
+    def __init__(self, urlbase, apikey, action_urlsubpath=None, session=None,
+                 pool_connections=None, pool_maxsize=None, keep_alive=True,
+                 timeout=None, cache=None, rate_limit=None, rate_burst=None,
+                 max_retries=None, backoff_factor=None, max_backoff=None):
         if urlbase and urlbase.endswith('/'):
             urlbase = urlbase[:-1]
-        
+
         if action_urlsubpath:
             if action_urlsubpath.startswith('/'):
                 action_urlsubpath = action_urlsubpath[1:]
@@ -119,6 +685,105 @@ class ApiClient:
         self.urlbase = urlbase
         self.apikey = apikey
 
+        self.pool_connections = pool_connections or self.POOL_CONNECTIONS
+        self.pool_maxsize = pool_maxsize or self.POOL_MAXSIZE
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.cache = cache
+
+        self.rate_limiter = None
+        if rate_limit:
+            self.rate_limiter = RateLimiter(rate_limit, rate_burst)
+        self.max_retries = (
+            self.MAX_RETRIES if max_retries is None else max_retries
+        )
+        self.backoff_factor = (
+            self.BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+        )
+        self.max_backoff = max_backoff or self.MAX_BACKOFF
+        self._session_lock = threading.Lock()
+        self._session = session
+        self.stats = RequestStats()
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        '''Creates a client for the instance described by a Config object.
+        '''
+        options = dict(config.options or {})
+        options.update(kwargs)
+        return cls(config.urlbase, config.apikey, **options)
+
+    @property
+    def session(self):
+        '''Returns the pooled session used for making requests.
+
+        The session is created on first use and keeps connections to the
+        instance alive across requests.
+        '''
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self):
+        import requests
+
+        session = requests.Session()
+        self._mount_adapter(session)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def _mount_adapter(self, session):
+        from requests.adapters import HTTPAdapter
+
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    def resize_pool(self, maxsize):
+        '''Grows the connection pool to hold at least maxsize connections.
+
+        Used to size the pool to the number of workers issuing concurrent
+        requests so connections are not discarded after each request.
+        '''
+        if maxsize <= self.pool_maxsize:
+            return
+
+        self.pool_maxsize = maxsize
+        if self._session is not None:
+            self._mount_adapter(self._session)
+
+    def with_apikey(self, apikey):
+        '''Returns a client for the same instance which authenticates with
+        the provided apikey while sharing this client's connection pool,
+        cache and rate limiter.
+        '''
+        client = copy.copy(self)
+        client._session = self.session
+        client.apikey = apikey
+        return client
+
+    def without_cache(self):
+        '''Returns a client for the same instance and identity which
+        bypasses the response cache while sharing this client's connection
+        pool and rate limiter; for reads deciding what to write.
+        '''
+        client = copy.copy(self)
+        client._session = self.session
+        client.cache = None
+        return client
+
+    def close(self):
+        '''Releases the connections held by the client's session.
+        '''
+        if self._session is not None:
+            self._session.close()
+
     def build_action_url(self, action_name):
         urlfmt = '{urlbase}/{urlsubpath}/{action_name}'.format(
             urlbase=self.urlbase, 
@@ -131,52 +796,299 @@ class ApiClient:
         '''Performs an API request.
         
         A GET is made by default if as_get remains True otherwise a POST
-        request if set to False.
+        request if set to False. Responses to read actions are served from
+        and stored in the cache if one is set, while other actions
+        invalidate the cached entries they affect.
         '''
+        if self.cache is None:
+            return self._request(action_name, data, as_get)
+
+        if not is_read_action(action_name):
+            try:
+                return self._request(action_name, data, as_get)
+            finally:
+                self.cache.invalidate(self.urlbase, action_name)
+
+        identity = hashlib.sha1((self.apikey or '').encode()).hexdigest()
+        result = self.cache.get(self.urlbase, identity, action_name, data)
+        if result is not None:
+            self.stats.record_cached(action_name)
+        else:
+            result = self._request(action_name, data, as_get)
+            self.cache.set(self.urlbase, identity, action_name, data, result)
+        return result
+
+    def iter_result(self, action_name, data=None, as_get=True,
+                    path=('result',)):
+        '''Performs an API request and yields the items of the array at
+        path within the response as they are decoded from the body.
+
+        The response is streamed with gzip transfer encoding requested so
+        only a chunk of the body and an item are held in memory at a time.
+        Responses aren't cached and requests failing after the response
+        started streaming aren't retried.
+        '''
+        resp = self._request(action_name, data, as_get, stream=True)
+        try:
+            chunks = resp.iter_content(self.STREAM_CHUNK_SIZE)
+            yield from iter_json_items(chunks, path)
+        finally:
+            resp.close()
+
+    def get_retry_delay(self, action_name, attempt, status_code=None,
+                        retry_after=None):
+        '''Returns the seconds to wait before retrying a failed request or
+        None if it should not be retried.
+
+        Requests rejected with a 429 are retried for any action as these
+        never reached the application; other failures are retried only for
+        actions which are safe to repeat. Delays grow exponentially with
+        full jitter unless the server asks for one with Retry-After.
+        '''
+        if attempt >= self.max_retries:
+            return None
+        if status_code != 429 and not is_retry_safe_action(action_name):
+            return None
+
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+
+        delay = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        return random.uniform(0, delay)
+
+    def _request(self, action_name, data, as_get, stream=False):
+        '''Performs an API request retrying failures which allow it and
+        returns the decoded response, or the response itself if stream.
+        '''
+        import requests
+
+        if not as_get:
+            assert data is not None, "Payload required for making a POST request"
+
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            started = time.perf_counter()
+            try:
+                resp = self._send(action_name, data, as_get, stream)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                self.stats.record(action_name, None,
+                                  time.perf_counter() - started,
+                                  retry=attempt > 0)
+                delay = self.get_retry_delay(action_name, attempt)
+                if delay is None:
+                    raise
+                reason = ex
+            else:
+                # the body of a streamed response is yet to be read; its
+                # size on the wire is taken from the headers instead
+                request = resp.request
+                self.stats.record(
+                    action_name, resp.status_code,
+                    time.perf_counter() - started,
+                    (len(request.url) + _get_body_size(request.body))
+                    if request is not None else 0,
+                    int(resp.headers.get('Content-Length') or 0)
+                    if stream else len(resp.content), attempt > 0
+                )
+
+                delay = None
+                if resp.status_code in self.RETRY_STATUSES:
+                    retry_after = parse_retry_after(
+                        resp.headers.get('Retry-After')
+                    )
+                    delay = self.get_retry_delay(
+                        action_name, attempt, resp.status_code, retry_after
+                    )
+                if delay is None:
+                    if stream and resp.status_code >= 400:
+                        resp.close()
+                    resp.raise_for_status()
+                    return resp if stream else resp.json()
+                resp.close()
+                reason = 'HTTP {}'.format(resp.status_code)
+
+            attempt += 1
+            _log.warning('{} failed ({}); retry {} of {} in {:.2f}s'.format(
+                action_name, reason, attempt, self.max_retries, delay
+            ))
+            time.sleep(delay)
+
+    def _send(self, action_name, data, as_get, stream=False):
         headers = {'Authorization': self.apikey}
+        if stream:
+            headers['Accept-Encoding'] = 'gzip'
+
         action_url = self.build_action_url(action_name)
         if as_get:
-            resp = requests.get(action_url, headers=headers)
-        else:
+            return self.session.get(action_url, headers=headers,
+                                    params=encode_params(data),
+                                    timeout=self.timeout, stream=stream)
+
+        headers['Content-Type'] = 'application/json; charset=utf8'
+        return self.session.post(action_url, headers=headers,
+                                 data=json.dumps(data),
+                                 timeout=self.timeout, stream=stream)
+
+    def __repr__(self):
+        msgfmt = '<ApiClient (urlbase={}, apikey=***)>'
+        return msgfmt.format(self.urlbase)
+
+
+class AsyncApiClient(ApiClient):
+    '''ApiClient which performs requests on an asyncio event loop.
+
+    Calling the client returns a coroutine; otherwise it is configured and
+    used just like ApiClient except that responses are not cached. Requires
+    the optional `aiohttp` package.
+    '''
+
+    def _build_session(self):
+        try:
+            import aiohttp
+        except ImportError as ex:
+            raise CKANTAError(
+                "AsyncApiClient requires 'aiohttp'. Install it using the "
+                "'async' extra: pip install ckanta[async]"
+            ) from ex
+
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_maxsize,
+            force_close=not self.keep_alive
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+
+    def resize_pool(self, maxsize):
+        '''Grows the connection pool to hold at least maxsize connections.
+
+        The pool of a session already in use cannot be resized.
+        '''
+        if self._session is None:
+            self.pool_maxsize = max(self.pool_maxsize, maxsize)
+
+    async def close(self):
+        '''Releases the connections held by the client's session.
+        '''
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def __call__(self, action_name, data=None, as_get=True):
+        '''Performs an API request.
+
+        A GET is made by default if as_get remains True otherwise a POST
+        request if set to False.
+        '''
+        import asyncio
+        import aiohttp
+
+        if not as_get:
             assert data is not None, "Payload required for making a POST request"
 
-            headers['Content-Type'] = 'application/json; charset=utf8'
-            resp = requests.post(action_url, headers=headers,
-                                 data=json.dumps(data))
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                await asyncio.sleep(self.rate_limiter.reserve())
+
+            started = time.perf_counter()
+            try:
+                async with self._send(action_name, data, as_get) as resp:
+                    body = await resp.read()
+                    self.stats.record(
+                        action_name, resp.status,
+                        time.perf_counter() - started,
+                        len(str(resp.url)) + _get_body_size(
+                            json.dumps(data) if not as_get else None),
+                        len(body), attempt > 0
+                    )
+
+                    delay = None
+                    if resp.status in self.RETRY_STATUSES:
+                        retry_after = parse_retry_after(
+                            resp.headers.get('Retry-After')
+                        )
+                        delay = self.get_retry_delay(
+                            action_name, attempt, resp.status, retry_after
+                        )
+                    if delay is None:
+                        resp.raise_for_status()
+                        return await resp.json(content_type=None)
+                    reason = 'HTTP {}'.format(resp.status)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as ex:
+                self.stats.record(action_name, None,
+                                  time.perf_counter() - started,
+                                  retry=attempt > 0)
+                delay = self.get_retry_delay(action_name, attempt)
+                if delay is None:
+                    raise
+                reason = ex
+
+            attempt += 1
+            _log.warning('{} failed ({}); retry {} of {} in {:.2f}s'.format(
+                action_name, reason, attempt, self.max_retries, delay
+            ))
+            await asyncio.sleep(delay)
 
-        resp.raise_for_status()
-        return resp.json()
+    def iter_result(self, action_name, data=None, as_get=True,
+                    path=('result',)):
+        raise CKANTAError(
+            'Streamed responses are not supported asynchronously'
+        )
+
+    def _request(self, action_name, data, as_get, stream=False):
+        raise CKANTAError(
+            'Blocking requests are not supported asynchronously'
+        )
+
+    def _send(self, action_name, data, as_get):
+        headers = {'Authorization': self.apikey}
+        action_url = self.build_action_url(action_name)
+        if as_get:
+            return self.session.get(action_url, headers=headers,
+                                    params=encode_params(data))
+
+        headers['Content-Type'] = 'application/json; charset=utf8'
+        return self.session.post(action_url, headers=headers,
+                                 data=json.dumps(data))
 
     def __repr__(self):
-        msgfmt = '<ApiClient (urlbase={}, apikey=***)>'
+        msgfmt = '<AsyncApiClient (urlbase={}, apikey=***)>'
         return msgfmt.format(self.urlbase)
 
 
 class CKANTAContext: 
     NATIONAL_KEY = 'national:'
 
-    def __init__(self, configp, client, as_get=False, debug=False):
+    def __init__(self, configp, client, as_get=False, debug=False,
+                 national_states=None, instance=None):
         self.__configp = configp
         self.client = client
         self.as_get = as_get
         self.debug = debug
+        self.instance = instance
+
+        # contexts of all the instances a command is run against
+        self.instances = [self]
+
+        if national_states is not None:
+            setattr(self, '__national_states', national_states)
 
     @property
     def national_states(self):
         key = '__national_states'
         if not hasattr(self, key):
-            states = OrderedDict()
-            State = namedtuple('State', ['code', 'name'])
-
             value = self.get_config('national-states')
-            for entry in itertools.chain(*[
-                ln.split('  ') for ln in value.split('\n') if ln
-            ]):
-                code, name = entry.strip().split(':')
-                name = name.replace("'", '').strip()
-                states[slugify(name)] = State(code, name)
-
-            setattr(self, key, states)
+            setattr(self, key, parse_national_states(value))
         return getattr(self, key)
 
     def get_config(self, name, section=None):
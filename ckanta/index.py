@@ -0,0 +1,229 @@
+'''Local SQLite copy of the catalogue of a CKAN instance for answering list
+and show queries offline.
+'''
+import os
+import json
+import time
+import hashlib
+import logging
+import os.path as fs
+from itertools import islice
+from contextlib import contextmanager
+
+from .common import default_cache_dir
+from .commands import CommandError
+
+
+_log = logging.getLogger(__name__)
+
+
+class CatalogueIndex:
+    '''SQLite file holding the datasets, organizations, groups and users of
+    a CKAN instance indexed by name, owner organization, group and state.
+
+    The index is rebuilt as a whole into a temporary file which replaces the
+    previous one once complete, so it is never seen partially built.
+    '''
+    DIRNAME = 'index'
+    OBJECT_TYPES = ('package', 'group', 'organization', 'user')
+    BATCH_SIZE = 500
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS objects (
+            object TEXT NOT NULL,
+            id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            owner_org TEXT,
+            state TEXT,
+            private INTEGER NOT NULL DEFAULT 0,
+            value TEXT NOT NULL,
+            PRIMARY KEY (object, id)
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS ix_objects_name
+            ON objects (object, name);
+        CREATE INDEX IF NOT EXISTS ix_objects_owner_org
+            ON objects (object, owner_org);
+        CREATE INDEX IF NOT EXISTS ix_objects_state
+            ON objects (object, state);
+        CREATE TABLE IF NOT EXISTS object_groups (
+            object_id TEXT NOT NULL,
+            group_name TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ix_object_groups_name
+            ON object_groups (group_name, object_id);
+        CREATE TABLE IF NOT EXISTS info (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    @classmethod
+    def open(cls, urlbase, directory=None):
+        '''Returns the index of the instance at urlbase.
+        '''
+        directory = directory or fs.join(default_cache_dir(), cls.DIRNAME)
+        digest = hashlib.sha1(urlbase.encode('utf-8')).hexdigest()
+        return cls(fs.join(directory, '{}.sqlite'.format(digest)))
+
+    @staticmethod
+    def get_object(object_type):
+        return 'package' if object_type == 'dataset' else object_type
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            if not fs.exists(self.path):
+                raise CommandError(
+                    'No local index found; run `ckanta index build` first.'
+                )
+
+            import sqlite3
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        return self._conn
+
+    @contextmanager
+    def rebuild(self, urlbase=None):
+        '''Yields a writer adding records to a fresh copy of the index which
+        replaces this one if the block completes without error.
+        '''
+        import sqlite3
+
+        dirpath = fs.dirname(self.path)
+        if dirpath:
+            os.makedirs(dirpath, exist_ok=True)
+
+        tmp_path = '{}.tmp'.format(self.path)
+        if fs.exists(tmp_path):
+            os.remove(tmp_path)
+
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript(self.SCHEMA)
+            yield _IndexWriter(conn, self.BATCH_SIZE)
+            conn.executemany('INSERT INTO info VALUES (?, ?)', [
+                ('urlbase', urlbase or ''), ('built', str(time.time()))
+            ])
+            conn.commit()
+        except BaseException:
+            conn.close()
+            os.remove(tmp_path)
+            raise
+
+        conn.close()
+        self.close()
+        os.replace(tmp_path, self.path)
+
+    def get_info(self):
+        return dict(self.conn.execute('SELECT key, value FROM info'))
+
+    def list(self, object_type, all_fields=False, owner_org=None,
+             groups=None, state=None, include_private=False, limit=None,
+             offset=0, **options):
+        '''Returns the names, or records if all_fields, of indexed objects
+        of a type ordered by name; datasets can be filtered by the name of
+        their organization, group and state.
+        '''
+        object_type = self.get_object(object_type)
+        if options:
+            _log.warning('Options ignored by local index: {}'.format(
+                ', '.join(sorted(options))))
+
+        clauses, params = (['object = ?'], [object_type])
+        if owner_org is not None:
+            clauses.append('owner_org = ?')
+            params.append(owner_org)
+        if state is not None:
+            clauses.append('state = ?')
+            params.append(state)
+        if groups is not None:
+            clauses.append(
+                'id IN (SELECT object_id FROM object_groups '
+                'WHERE group_name = ?)'
+            )
+            params.append(groups)
+        if object_type == 'package' and not _is_true(include_private):
+            clauses.append('private = 0')
+
+        query = 'SELECT {} FROM objects WHERE {} ORDER BY name'.format(
+            'value' if _is_true(all_fields) else 'name',
+            ' AND '.join(clauses)
+        )
+        if limit is not None:
+            query += ' LIMIT ? OFFSET ?'
+            params.extend([int(limit), int(offset)])
+
+        rows = self.conn.execute(query, params)
+        if _is_true(all_fields):
+            return [json.loads(value) for (value,) in rows]
+        return [name for (name,) in rows]
+
+    def show(self, object_type, id):
+        '''Returns the indexed object of a type with the given id or name.
+        '''
+        row = self.conn.execute(
+            'SELECT value FROM objects WHERE object = ? AND (id = ? OR '
+            'name = ?)', (self.get_object(object_type), id, id)
+        ).fetchone()
+        if row is None:
+            raise CommandError('Not found in local index: {}'.format(id))
+        return json.loads(row[0])
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _IndexWriter:
+    '''Adds records to an index being built in batches.
+    '''
+
+    def __init__(self, conn, batch_size):
+        self.conn = conn
+        self.batch_size = batch_size
+
+    def add(self, object_type, records):
+        '''Adds records of a type and returns the number added.
+        '''
+        object_type = CatalogueIndex.get_object(object_type)
+        records, total = (iter(records), 0)
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                break
+
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(object_type, r['id'], r['name'], _get_owner_org(r),
+                  r.get('state'), int(bool(r.get('private'))), json.dumps(r))
+                 for r in batch]
+            )
+            self.conn.executemany(
+                'INSERT INTO object_groups VALUES (?, ?)',
+                [(r['id'], g['name']) for r in batch
+                 for g in r.get('groups') or [] if isinstance(g, dict)]
+            )
+            total += len(batch)
+        return total
+
+
+def _get_owner_org(record):
+    # organizations are filtered on by name as groups are
+    organization = record.get('organization')
+    if isinstance(organization, dict) and organization.get('name'):
+        return organization['name']
+    return record.get('owner_org')
+
+
+def _is_true(value):
+    return value in (True, 'true', 'True', '1', 1)
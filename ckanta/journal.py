@@ -0,0 +1,102 @@
+'''Checkpoint journal recording the items completed by bulk commands.
+'''
+import os
+import hashlib
+import logging
+import threading
+import os.path as fs
+
+from .common import default_cache_dir
+
+
+_log = logging.getLogger(__name__)
+
+
+def hash_file(file_obj, chunk_size=65536):
+    '''Returns a digest of the content of file_obj and a file object from
+    which the same content can be read again.
+
+    Seekable files are rewound after hashing. Others (e.g. piped stdin) are
+    returned unread with a None digest so they can still be consumed as
+    they arrive; runs over such input can't be resumed.
+    '''
+    try:
+        seekable = file_obj.seekable()
+    except (AttributeError, ValueError):
+        seekable = False
+
+    if not seekable:
+        return (None, file_obj)
+
+    digest = hashlib.sha1()
+    position = file_obj.tell()
+    for chunk in iter(lambda: file_obj.read(chunk_size), ''):
+        digest.update(chunk.encode('utf-8'))
+    file_obj.seek(position)
+    return (digest.hexdigest(), file_obj)
+
+
+class Journal:
+    '''Append-only file recording the keys of items a bulk command has
+    completed so that an interrupted run can be resumed.
+
+    The journal file is named after a digest of the identity parts given,
+    typically the command, target instance and a hash of the input.
+    '''
+    DIRNAME = 'journal'
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.completed = set()
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+        dirpath = fs.dirname(path)
+        if dirpath:
+            os.makedirs(dirpath, exist_ok=True)
+
+        if resume and fs.exists(path):
+            with open(path, 'r') as fp:
+                self.completed = set(ln.rstrip('\n') for ln in fp if ln)
+            _log.info('Resuming; {} item(s) completed earlier'.format(
+                len(self.completed)))
+        self._file = open(path, 'a' if resume else 'w')
+
+    @classmethod
+    def open(cls, *identity, resume=False, directory=None):
+        '''Opens the journal for the identified run.
+        '''
+        directory = directory or fs.join(default_cache_dir(), cls.DIRNAME)
+        value = '\0'.join(str(part) for part in identity)
+        digest = hashlib.sha1(value.encode('utf-8')).hexdigest()
+        return cls(fs.join(directory, '{}.log'.format(digest)), resume)
+
+    def is_done(self, key):
+        return key in self.completed
+
+    def filter(self, items, key=None):
+        '''Yields the items which are yet to be completed, counting the ones
+        skipped in `skipped`.
+        '''
+        for item in items:
+            if (key(item) if key else item) in self.completed:
+                self.skipped += 1
+                continue
+            yield item
+
+    def record(self, key):
+        '''Records the item identified by key as completed.
+        '''
+        with self._lock:
+            self.completed.add(key)
+            self._file.write('{}\n'.format(key))
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,74 @@
+'''CPU and memory profiling of ckanta command runs.
+'''
+import io
+import logging
+
+
+_log = logging.getLogger(__name__)
+
+
+class Profiler:
+    '''Profiles the code run between start and stop.
+
+    The `cpu` mode uses cProfile, which only sees the thread it was started
+    on; work done by the worker threads of bulk commands shows up as time
+    spent waiting on them. The `mem` mode uses tracemalloc and covers all
+    threads. Results are written to path as a pstats file or a tracemalloc
+    snapshot respectively.
+    '''
+    MODES = ('cpu', 'mem')
+    EXTENSIONS = {'cpu': 'pstats', 'mem': 'tracemalloc'}
+    TOP = 25
+    TRACEBACK_FRAMES = 10
+
+    def __init__(self, mode, path=None, top=None):
+        if mode not in self.MODES:
+            raise ValueError('Invalid profile mode: {}'.format(mode))
+
+        self.mode = mode
+        self.path = path or 'ckanta.{}'.format(self.EXTENSIONS[mode])
+        self.top = top or self.TOP
+        self._profile = None
+
+    def start(self):
+        if self.mode == 'cpu':
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            import tracemalloc
+            tracemalloc.start(self.TRACEBACK_FRAMES)
+
+    def stop(self):
+        '''Stops profiling, writes the results and returns a summary of the
+        top entries as text.
+        '''
+        if self.mode == 'cpu':
+            return self._stop_cpu()
+        return self._stop_mem()
+
+    def _stop_cpu(self):
+        import pstats
+
+        self._profile.disable()
+        self._profile.dump_stats(self.path)
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(self.top)
+        return stream.getvalue()
+
+    def _stop_mem(self):
+        import tracemalloc
+
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        snapshot.dump(self.path)
+
+        lines = ['Memory: current {:.1f} KiB, peak {:.1f} KiB'.format(
+            current / 1024, peak / 1024)]
+        lines.append('Top {} allocation sites:'.format(self.top))
+        for stat in snapshot.statistics('lineno')[:self.top]:
+            lines.append('  {}'.format(stat))
+        return '\n'.join(lines)
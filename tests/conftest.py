@@ -13,5 +13,10 @@ def cfg_s():
         [instance:dev]
         urlbase=http://dev.local.io:5000
         apikey=29chibads978237dluw072as3
+        pool-maxsize=32
+        keep-alive=no
+        timeout=30
+        rate-limit=20
+        max-retries=5
     ''')
     return cfg
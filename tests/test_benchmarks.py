@@ -0,0 +1,53 @@
+import pytest
+from benchmarks.fake_ckan import FakeCKAN
+from benchmarks.run import SCENARIOS, percentile, run_benchmarks
+from ckanta.common import ApiClient
+
+
+class TestFakeCKAN:
+
+    @pytest.fixture
+    def ckan(self):
+        with FakeCKAN(datasets=30, groups=3, organizations=2) as ckan:
+            yield ckan
+
+    def test_serves_paged_lists(self, ckan):
+        client = ApiClient(ckan.urlbase, 'key')
+        result = client('package_list', {'limit': 10, 'offset': 25})
+        assert result['result'] == [
+            'dataset-{:06}'.format(n) for n in range(25, 30)
+        ]
+
+    def test_serves_writes(self, ckan):
+        client = ApiClient(ckan.urlbase, 'key')
+        client('group_create', {'name': 'new'}, as_get=False)
+        client('dataset_purge', {'id': 'dataset-000000'}, as_get=False)
+        assert 'new' in ckan.catalogue['group']
+        assert 'dataset-000000' not in ckan.catalogue['package']
+        assert ckan.requests == 2
+
+    def test_injects_errors(self):
+        with FakeCKAN(datasets=1, error_rate=1.0) as ckan:
+            client = ApiClient(ckan.urlbase, 'key', max_retries=0)
+            with pytest.raises(Exception):
+                client('package_show', {'id': 'dataset-000000'})
+            assert ckan.errors == 1
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) is None
+
+
+def test_run_benchmarks():
+    report = run_benchmarks(
+        {'datasets': 20, 'latency': 0.0, 'error_rate': 0.0},
+        {'items': 5, 'workers': 2, 'page_size': 10}
+    )
+    assert set(report['results']) == set(name for (name, _) in SCENARIOS)
+    for result in report['results'].values():
+        assert result['requests'] > 0 and result['errors'] == 0
+        assert result['latency_ms']['p99'] >= result['latency_ms']['p50']
+        assert result['peak_memory_bytes'] > 0
@@ -0,0 +1,162 @@
+import pytest
+import os.path as fs
+from ckanta.cache import ResponseCache
+from ckanta.common import ApiClient, ConfigError
+
+
+URLBASE = 'http://localhost'
+
+
+@pytest.fixture(scope='function')
+def cache(tmpdir):
+    cache = ResponseCache(fs.join(str(tmpdir), 'cache', 'responses.sqlite'))
+    yield cache
+    cache.close()
+
+
+class CountingApiClient(ApiClient):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = []
+
+    def _request(self, action_name, data, as_get):
+        self.requests.append(action_name)
+        return {'success': True, 'result': [action_name, data]}
+
+
+class TestResponseCache:
+
+    def test_set_and_get(self, cache):
+        cache.set(URLBASE, 'u1', 'group_show', {'id': 'g'}, {'result': 1})
+        assert cache.get(URLBASE, 'u1', 'group_show', {'id': 'g'}) == {
+            'result': 1
+        }
+        assert cache.get(URLBASE, 'u2', 'group_show', {'id': 'g'}) is None
+        assert cache.get(URLBASE, 'u1', 'group_show', {'id': 'x'}) is None
+
+    def test_key_ignores_payload_key_order(self, cache):
+        key_a = cache.build_key(URLBASE, 'u', 'group_list', {'a': 1, 'b': 2})
+        key_b = cache.build_key(URLBASE, 'u', 'group_list', {'b': 2, 'a': 1})
+        assert key_a == key_b
+
+    def test_expired_entries_are_misses(self, cache):
+        cache.ttls['group_show'] = -1
+        cache.set(URLBASE, 'u', 'group_show', {'id': 'g'}, {'result': 1})
+        assert cache.get(URLBASE, 'u', 'group_show', {'id': 'g'}) is None
+
+    def test_least_recently_used_entries_evicted(self, cache):
+        cache.max_entries = 3
+        for n in range(3):
+            cache.set(URLBASE, 'u', 'group_show', {'id': n}, {'result': n})
+
+        # touch the oldest entry so that the second becomes the LRU one
+        assert cache.get(URLBASE, 'u', 'group_show', {'id': 0}) is not None
+        cache.set(URLBASE, 'u', 'group_show', {'id': 3}, {'result': 3})
+
+        assert cache.get(URLBASE, 'u', 'group_show', {'id': 1}) is None
+        for n in (0, 2, 3):
+            assert cache.get(URLBASE, 'u', 'group_show', {'id': n}) is not None
+
+    def test_writes_invalidate_affected_objects(self, cache):
+        cache.set(URLBASE, 'u', 'package_show', {'id': 'p'}, {'result': 1})
+        cache.set(URLBASE, 'u', 'user_show', {'id': 'u'}, {'result': 2})
+        cache.set('http://other', 'u', 'package_show', {'id': 'p'}, {})
+
+        cache.invalidate(URLBASE, 'dataset_purge')
+        assert cache.get(URLBASE, 'u', 'package_show', {'id': 'p'}) is None
+        assert cache.get(URLBASE, 'u', 'user_show', {'id': 'u'}) is not None
+        assert cache.get('http://other', 'u', 'package_show', {'id': 'p'}) \
+            is not None
+
+    @pytest.mark.parametrize('action_name', [
+        'member_create', 'group_member_create', 'organization_member_delete',
+        'user_delete'
+    ])
+    def test_member_writes_invalidate_member_lists(self, cache, action_name):
+        cache.set(URLBASE, 'u', 'member_list', {'id': 'g'}, {'result': []})
+        cache.invalidate(URLBASE, action_name)
+        assert cache.get(URLBASE, 'u', 'member_list', {'id': 'g'}) is None
+
+    def test_responses_with_secrets_not_stored(self, cache):
+        cache.set(URLBASE, 'u', 'user_show', {'id': 'u'}, {'result': {
+            'name': 'u', 'apikey': 'secret'
+        }})
+        assert cache.get(URLBASE, 'u', 'user_show', {'id': 'u'}) is None
+        assert cache.conn.execute(
+            'SELECT COUNT(*) FROM responses').fetchone() == (0,)
+
+    def test_unknown_writes_invalidate_instance(self, cache):
+        cache.set(URLBASE, 'u', 'user_show', {'id': 'u'}, {'result': 2})
+        cache.invalidate(URLBASE, 'eoc_request_create')
+        assert cache.get(URLBASE, 'u', 'user_show', {'id': 'u'}) is None
+
+    def test_refresh_skips_reads(self, cache):
+        cache.set(URLBASE, 'u', 'group_show', {'id': 'g'}, {'result': 1})
+        cache.refresh = True
+        assert cache.get(URLBASE, 'u', 'group_show', {'id': 'g'}) is None
+
+    def test_from_config(self, cfg_s, tmpdir):
+        cfg_s.read_string('''
+            [ckanta]
+            cache = yes
+            cache-path = {}/responses.sqlite
+            cache-ttl = 30
+            cache-ttls = package_show:600  group_list:5
+        '''.format(tmpdir))
+        cache = ResponseCache.from_config(cfg_s, refresh=True)
+        assert cache.path == '{}/responses.sqlite'.format(tmpdir)
+        assert cache.default_ttl == 30 and cache.refresh
+        assert cache.ttls['package_show'] == 600
+        assert cache.ttls['user_show'] == ResponseCache.ACTION_TTLS['user_show']
+
+    @pytest.mark.parametrize('content', [
+        '[ckanta]\ncache = no', '[ckanta]\nkey = value'
+    ])
+    def test_from_config_when_disabled(self, cfg_s, content):
+        cfg_s.read_string(content)
+        assert ResponseCache.from_config(cfg_s) is None
+
+    def test_from_config_with_invalid_value(self, cfg_s):
+        cfg_s.read_string('[ckanta]\ncache = yes\ncache-ttl = soon')
+        with pytest.raises(ConfigError):
+            ResponseCache.from_config(cfg_s)
+
+
+class TestApiClientCaching:
+
+    def test_reads_are_served_from_cache(self, cache):
+        client = CountingApiClient(URLBASE, 'secret', cache=cache)
+        first = client('package_show', {'id': 'p'})
+        assert client('package_show', {'id': 'p'}) == first
+        assert client.requests == ['package_show']
+
+    def test_writes_are_not_cached_and_invalidate(self, cache):
+        client = CountingApiClient(URLBASE, 'secret', cache=cache)
+        client('package_show', {'id': 'p'})
+        client('package_patch', {'id': 'p'}, as_get=False)
+        client('package_patch', {'id': 'p'}, as_get=False)
+        client('package_show', {'id': 'p'})
+        assert client.requests == [
+            'package_show', 'package_patch', 'package_patch', 'package_show'
+        ]
+
+    def test_client_without_cache_bypasses_it(self, cache):
+        client = CountingApiClient(URLBASE, 'secret', cache=cache)
+        client('member_list', {'id': 'g'})
+        uncached = client.without_cache()
+        uncached.requests = client.requests
+
+        uncached('member_list', {'id': 'g'})
+        assert client.requests == ['member_list', 'member_list']
+        assert client.cache is cache
+
+    def test_identities_do_not_share_entries(self, cache):
+        client = CountingApiClient(URLBASE, 'secret', cache=cache)
+        other = client.with_apikey('other-secret')
+        assert other.cache is cache
+
+        client('package_show', {'id': 'p'})
+        other.requests = client.requests
+        other('package_show', {'id': 'p'})
+        assert client.requests == ['package_show', 'package_show']
@@ -0,0 +1,198 @@
+import io
+import sys
+import json
+import subprocess
+import pytest
+
+
+# budget for importing the entry point and running a short command, not
+# counting interpreter startup; kept loose to absorb slow CI machines
+STARTUP_BUDGET = 0.1
+
+# modules only some subcommands need; none should load at startup
+DEFERRED_MODULES = (
+    'requests', 'furl', 'slugify', 'pkg_resources', 'aiohttp', 'asyncio',
+    'sqlite3', 'cleo', 'tabulate', 'ckanta.deprecated'
+)
+
+SCRIPT = '''
+import sys, json, time
+started = time.perf_counter()
+from ckanta.cli import ckanta
+try:
+    ckanta({args!r})
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - started
+sys.stdout = sys.__stdout__
+print(json.dumps([elapsed, sorted(sys.modules)]))
+'''
+
+
+def run_cli(args, tmpdir):
+    '''Runs the cli with args in a fresh interpreter and returns the time
+    taken and the modules loaded.
+    '''
+    env = {'HOME': str(tmpdir), 'XDG_CACHE_HOME': str(tmpdir.join('cache'))}
+    proc = subprocess.run(
+        [sys.executable, '-c', SCRIPT.format(args=args)],
+        stdout=subprocess.PIPE, env=env, check=True,
+        universal_newlines=True
+    )
+    elapsed, modules = json.loads(proc.stdout.strip().splitlines()[-1])
+    return (elapsed, set(modules))
+
+
+@pytest.mark.parametrize('args', [
+    ['--help'],
+    ['-u', 'http://localhost:5000', '-k', 'apikey', 'config'],
+])
+class TestStartup:
+
+    def test_defers_heavy_imports(self, args, tmpdir):
+        _, modules = run_cli(args, tmpdir)
+        assert modules.isdisjoint(DEFERRED_MODULES)
+
+    def test_within_budget(self, args, tmpdir):
+        # best of a few runs to discount a cold file cache
+        elapsed = min(run_cli(args, tmpdir)[0] for _ in range(3))
+        assert elapsed < STARTUP_BUDGET
+
+
+@pytest.mark.parametrize('resume', [False, True])
+def test_resume_of_piped_input_refused(resume):
+    from ckanta.cli import _hash_input
+    from ckanta.commands import CommandError
+
+    class Pipe(io.StringIO):
+        def seekable(self):
+            return False
+
+    pipe = Pipe('dataset-000000\n')
+    if resume:
+        with pytest.raises(CommandError):
+            _hash_input(pipe, resume)
+    else:
+        assert _hash_input(pipe, resume) == (None, pipe)
+
+
+class TestMultiInstance:
+    CONFIG = '[ckanta]\ncache = no\n'
+    INSTANCE = '\n[instance:{}]\nurlbase = {}\napikey = key\n'
+
+    @pytest.fixture
+    def portals(self, tmpdir, monkeypatch):
+        from benchmarks.fake_ckan import FakeCKAN
+
+        servers = [FakeCKAN(datasets=n, groups=n).start() for n in (1, 2)]
+        config = self.CONFIG + ''.join(
+            self.INSTANCE.format(name, server.urlbase) for (name, server) in
+            zip(('portal-a', 'portal-b'), servers)
+        ) + self.INSTANCE.format('other', 'http://127.0.0.1:1')
+
+        tmpdir.join('.config', 'ckanta.conf').write(config, ensure=True)
+        monkeypatch.setenv('HOME', str(tmpdir))
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('cache')))
+        yield servers
+        for server in servers:
+            server.stop()
+
+    def invoke(self, *args):
+        from click.testing import CliRunner
+        from ckanta.cli import ckanta
+        return CliRunner().invoke(ckanta, list(args))
+
+    def test_list_across_instances(self, portals):
+        result = self.invoke('-i', 'portal-*', 'list', 'group')
+        assert result.output.splitlines() == [
+            '[portal-a]', "['group-0000']", '',
+            '[portal-b]', "['group-0000', 'group-0001']", ''
+        ]
+
+    def test_ndjson_records_are_tagged(self, portals):
+        result = self.invoke('-i', 'portal-a,portal-b', 'list', 'dataset',
+                             '--ndjson')
+        records = [json.loads(ln) for ln in result.output.splitlines()]
+        assert sorted((r['instance'], r['record']) for r in records) == [
+            ('portal-a', 'dataset-000000'), ('portal-b', 'dataset-000000'),
+            ('portal-b', 'dataset-000001')
+        ]
+
+    def test_purge_across_instances(self, portals):
+        result = self.invoke('-i', 'portal-a', '-i', 'portal-b', 'purge',
+                             'dataset', '--id', 'dataset-000000')
+        assert result.output.count("['+ dataset-000000']") == 2
+        assert all(not p.catalogue['package'].get('dataset-000000')
+                   for p in portals)
+
+    def test_single_instance_commands_refuse_several(self, portals):
+        result = self.invoke('-i', 'portal-*', 'dump', 'dataset')
+        assert 'Only list, show, purge, membership' in result.output
+        assert not any(p.requests for p in portals)
+
+    def test_unknown_instance(self, portals):
+        result = self.invoke('-i', 'missing-*', 'list', 'group')
+        assert 'No configured instance matches: missing-*' in result.output
+
+    def test_mirror_between_instances(self, portals):
+        result = self.invoke('mirror', 'portal-b', 'portal-a', '-o', 'group',
+                             '--yes')
+        assert "'result': ['= group-0000', '+ group-0001']" in result.output
+        assert 'group-0001' in portals[0].catalogue['group']
+        assert not portals[0].catalogue['package'].get('dataset-000001')
+
+    def test_local_list_and_show(self, portals):
+        self.invoke('-i', 'portal-b', 'index', 'build')
+        requests = portals[1].requests
+
+        result = self.invoke('-i', 'portal-b', 'list', 'group', '--local')
+        assert result.output == "['group-0000', 'group-0001']\n"
+        result = self.invoke('-i', 'portal-b', 'show', 'dataset',
+                             'dataset-000001', '--local')
+        assert "'name': 'dataset-000001'" in result.output
+        assert portals[1].requests == requests
+
+    def test_purge_outcomes_written_to_outfile(self, portals, tmpdir):
+        infile = tmpdir.join('ids.txt')
+        infile.write('dataset-000000\ndataset-000001\ndataset-000000\n')
+        outfile = tmpdir.join('purged.txt')
+        result = self.invoke('-i', 'portal-*', 'purge', 'dataset', '-w', '2',
+                             '--infile', str(infile), '--outfile', str(outfile))
+
+        assert "'duplicates': 1" in result.output
+        assert sorted(outfile.read().splitlines()) == [
+            '[portal-a] + dataset-000000', '[portal-a] . dataset-000001',
+            '[portal-b] + dataset-000000', '[portal-b] + dataset-000001'
+        ]
+
+    def test_purge_dry_run_counts_matches(self, portals):
+        result = self.invoke('-i', 'portal-b', 'purge', 'dataset', '--query',
+                             'organization:org-0001', '--dry-run')
+        assert result.output == "{'count': 1}\n"
+        assert len(portals[1].catalogue['package']) == 2
+
+    def test_patch_datasets(self, portals):
+        result = self.invoke('-i', 'portal-b', 'patch', 'dataset', '--yes',
+                             '--id', 'dataset-000001', '--set', 'private=true',
+                             '--template', 'notes={name}')
+        assert "'result': ['~ dataset-000001']" in result.output
+        record = portals[1].catalogue['package']['dataset-000001']
+        assert (record['private'], record['notes']) == ('true', 'dataset-000001')
+
+    def test_patch_rejects_bad_assignment(self, portals):
+        result = self.invoke('-i', 'portal-b', 'patch', 'dataset', '--yes',
+                             '--id', 'dataset-000001', '--set', 'private')
+        assert 'Expected field=value, got: private' in result.output
+        assert not portals[1].requests
+
+    def test_membership_dataset(self, portals, tmpdir):
+        infile = tmpdir.join('sectors.txt')
+        infile.write('dataset-000000  group-0001\ndataset-000001  missing\n')
+        result = self.invoke('-i', 'portal-b', 'membership', 'dataset',
+                             '--infile', str(infile), '-w', '2')
+
+        assert "'+ dataset-000000: group-0001'" in result.output
+        assert "'failed': 1" in result.output
+        assert portals[1].members[('group', 'group-0001')] == {
+            'package-id-dataset-000000': 'member'
+        }
@@ -1,5 +1,15 @@
+import io
+import time
+import random
+import asyncio
 import pytest
-from ckanta.commands import MembershipCommand
+from collections import namedtuple
+from ckanta.common import CKANObject
+from ckanta.journal import Journal
+from ckanta.commands import CommandError, MembershipCommand, \
+     MembershipGrantCommand, UploadCommand, ListCommand, PurgeCommand, \
+     DumpCommand, UploadDatasetCommand, MirrorCommand, PatchCommand, \
+     DatasetMembershipCommand, diff_payload
 
 
 class DummyContext:
@@ -7,6 +17,77 @@ class DummyContext:
     debug = False
 
 
+class FakeApiClient:
+    '''Records the actions called and replies using the provided handler.
+    '''
+
+    def __init__(self, handler=None):
+        self.handler = handler or (lambda action, data: {'result': data})
+        self.pool_maxsize = 10
+        self.identities = []
+        self.calls = []
+
+    def __call__(self, action_name, data=None, as_get=True):
+        self.calls.append((action_name, data))
+        return self.handler(action_name, data)
+
+    def resize_pool(self, maxsize):
+        self.pool_maxsize = max(maxsize, self.pool_maxsize)
+
+    def iter_result(self, action_name, data=None, as_get=True,
+                    path=('result',)):
+        result = self(action_name, data, as_get)
+        for key in path:
+            result = result[key]
+        yield from result
+
+    def with_apikey(self, apikey):
+        client = FakeIdentityClient(self, apikey)
+        self.identities.append(client)
+        return client
+
+
+class FakeIdentityClient:
+    '''Client for another identity recording its calls with the client it
+    was created from.
+    '''
+
+    def __init__(self, parent, apikey):
+        self.parent = parent
+        self.apikey = apikey
+
+    def __call__(self, action_name, data=None, as_get=True):
+        self.parent.calls.append((action_name, dict(data, apikey=self.apikey)))
+        return self.parent.handler(action_name, data)
+
+
+class NotFoundError(Exception):
+    '''Error raised by requests for a missing object.
+    '''
+    response = namedtuple('Response', ['status_code'])(404)
+
+
+class FakeAsyncApiClient(FakeApiClient):
+
+    async def __call__(self, action_name, data=None, as_get=True):
+        await asyncio.sleep(random.random() / 100)
+        return super().__call__(action_name, data, as_get)
+
+
+def run_async(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class FakeContext(DummyContext):
+
+    def __init__(self, client):
+        self.client = client
+
+
 class TestMembershipCommand:
     
     def test_action_args_has_subcommand(self):
@@ -15,3 +96,921 @@ class TestMembershipCommand:
         assert cmd is not None
         assert 'object' in cmd.action_args
         assert cmd.action_args['object'] == cmd.COMMAND
+
+
+class TestUploadCommand:
+    GROUPS_CSV = 'title\n' + '\n'.join(
+        'Sector {:02}'.format(i) for i in range(20)
+    )
+
+    def _handler(self, action_name, data):
+        time.sleep(random.random() / 100)
+        if data['name'] == 'sector-13':
+            raise Exception('conflict')
+        return {'result': data}
+
+    @pytest.mark.parametrize('workers', [1, 4])
+    def test_upload_results_are_ordered(self, workers):
+        client = FakeApiClient(self._handler)
+        cmd = UploadCommand(FakeContext(client), object='group',
+                            infile=io.StringIO(self.GROUPS_CSV))
+        result = cmd.execute(as_get=False, workers=workers)
+
+        assert result['summary'] == {'total': 20, 'passed': 19, 'failed': 1}
+        assert result['result'][0] == '+ sector-00'
+        assert result['result'][13] == 'x sector-13'
+        assert result['result'][19] == '+ sector-19'
+        assert len(client.calls) == 20
+
+    def test_upload_resumes_from_journal(self, tmpdir):
+        journal = Journal.open('upload', directory=str(tmpdir))
+        client = FakeApiClient(self._handler)
+        cmd = UploadCommand(FakeContext(client), object='group',
+                            infile=io.StringIO(self.GROUPS_CSV))
+        cmd.execute(as_get=False, workers=4, journal=journal)
+        journal.close()
+
+        journal = Journal.open('upload', resume=True, directory=str(tmpdir))
+        client = FakeApiClient(self._handler)
+        cmd = UploadCommand(FakeContext(client), object='group',
+                            infile=io.StringIO(self.GROUPS_CSV))
+        result = cmd.execute(as_get=False, journal=journal)
+        journal.close()
+
+        assert result['result'] == ['x sector-13']
+        assert result['summary'] == {
+            'total': 1, 'passed': 0, 'failed': 1, 'skipped': 19
+        }
+
+    def test_upload_grows_pool_to_workers(self):
+        client = FakeApiClient()
+        cmd = UploadCommand(FakeContext(client), object='group',
+                            infile=io.StringIO(self.GROUPS_CSV))
+        cmd.execute(as_get=False, workers=16)
+        assert client.pool_maxsize == 16
+
+
+class TestAsyncExecution:
+
+    def test_list_command(self):
+        client = FakeAsyncApiClient()
+        cmd = ListCommand(FakeContext(client), object='group')
+        result = run_async(cmd.execute_async(as_get=True))
+        assert result['result']['sort'] == 'name asc'
+        assert client.calls[0][0] == 'group_list'
+
+    def test_upload_command(self):
+        def handler(action_name, data):
+            if data['name'] == 'sector-13':
+                raise Exception('conflict')
+            return {'result': data}
+
+        client = FakeAsyncApiClient(handler)
+        cmd = UploadCommand(FakeContext(client), object='group',
+                            infile=io.StringIO(TestUploadCommand.GROUPS_CSV))
+        result = run_async(cmd.execute_async(as_get=False, workers=5))
+        assert result['summary'] == {'total': 20, 'passed': 19, 'failed': 1}
+        assert result['result'][13] == 'x sector-13'
+        assert result['result'][14] == '+ sector-14'
+
+    def test_purge_command(self):
+        client = FakeAsyncApiClient()
+        cmd = PurgeCommand(FakeContext(client), object='dataset',
+                           infile=None, ids=['a,b', 'c'])
+        result = run_async(cmd.execute_async(workers=2))
+        assert result == ['+ a', '+ b', '+ c']
+        assert ('dataset_purge', {'id': 'a'}) in client.calls
+
+    @pytest.mark.parametrize('stream', [False, True])
+    def test_paged_records_unsupported(self, stream):
+        from ckanta.common import AsyncApiClient, CKANTAError
+
+        client = AsyncApiClient('http://localhost', '*secret*')
+        cmd = ListCommand(FakeContext(client), object='dataset')
+        with pytest.raises(CKANTAError) as excinfo:
+            list(cmd.iter_records(stream=stream))
+        assert 'not supported asynchronously' in str(excinfo.value)
+
+    def test_unsupported_command_fails(self):
+        cmd = MembershipGrantCommand(FakeContext(FakeAsyncApiClient()),
+                                     'user', 'member', ['org'], None)
+        with pytest.raises(CommandError):
+            run_async(cmd.execute_async(as_get=False))
+
+
+class TestListCommand:
+
+    def _paging_handler(self, total, max_limit=None):
+        names = ['pkg-{:03}'.format(i) for i in range(total)]
+
+        def handler(action_name, data):
+            limit = data['limit']
+            if max_limit is not None:
+                limit = min(limit, max_limit)
+            return {'result': names[data['offset']:data['offset'] + limit]}
+        return handler
+
+    @pytest.mark.parametrize('stream', [False, True])
+    @pytest.mark.parametrize('total', [0, 7, 10, 23])
+    def test_iter_records_walks_all_pages(self, total, stream):
+        client = FakeApiClient(self._paging_handler(total))
+        cmd = ListCommand(FakeContext(client), object='dataset')
+        records = list(cmd.iter_records(page_size=5, stream=stream))
+
+        assert records == ['pkg-{:03}'.format(i) for i in range(total)]
+        assert len(client.calls) == -(-total // 5) + 1
+        assert client.calls[0] == ('package_list', {'limit': 5, 'offset': 0})
+
+    @pytest.mark.parametrize('stream', [False, True])
+    def test_iter_records_walks_pages_capped_by_server(self, stream):
+        client = FakeApiClient(self._paging_handler(100, max_limit=25))
+        cmd = ListCommand(FakeContext(client), object='dataset')
+        records = list(cmd.iter_records(page_size=500, stream=stream))
+
+        assert records == ['pkg-{:03}'.format(i) for i in range(100)]
+        assert [c[1]['offset'] for c in client.calls] == [0, 25, 50, 75, 100]
+
+    @pytest.mark.parametrize('stream', [False, True])
+    def test_iter_records_stops_when_paging_ignored(self, stream):
+        # e.g. user_list on CKAN versions without limit/offset support
+        def handler(action_name, data):
+            return {'result': ['a', 'b', 'c', 'd', 'e']}
+
+        client = FakeApiClient(handler)
+        cmd = ListCommand(FakeContext(client), object='user')
+        records = cmd.iter_records(page_size=5, stream=stream)
+        assert list(records) == ['a', 'b', 'c', 'd', 'e']
+        assert len(client.calls) == 2
+
+    def test_iter_records_starts_from_offset_option(self):
+        client = FakeApiClient(self._paging_handler(12))
+        cmd = ListCommand(FakeContext(client), object='group', offset='4')
+        records = list(cmd.iter_records(page_size=5))
+        assert records[0] == 'pkg-004' and len(records) == 8
+
+
+class TestDumpCommand:
+
+    def _search_handler(self, total, max_rows=None):
+        records = [
+            {'id': str(i), 'name': 'pkg-{:03}'.format(i), 'notes': '...'}
+            for i in range(total)
+        ]
+
+        def handler(action_name, data):
+            start, rows = data.get('start', 0), data['rows']
+            if max_rows is not None:
+                rows = min(rows, max_rows)
+            return {'result': {
+                'count': total, 'results': records[start:start + rows]
+            }}
+        return handler
+
+    @pytest.mark.parametrize('total', [0, 4, 12])
+    def test_iter_records_pages_through_search(self, total):
+        client = FakeApiClient(self._search_handler(total))
+        cmd = DumpCommand(FakeContext(client), 'dataset', rows=4)
+        records = list(cmd.iter_records())
+
+        assert [r['name'] for r in records] == [
+            'pkg-{:03}'.format(i) for i in range(total)
+        ]
+        assert len(client.calls) == max(1, -(-total // 4))
+        assert client.calls[0][0] == 'package_search'
+        assert client.calls[0][1]['q'] == '*:*'
+
+    @pytest.mark.parametrize('total', [0, 4, 10])
+    def test_iter_records_streams_pages(self, total):
+        client = FakeApiClient(self._search_handler(total))
+        cmd = DumpCommand(FakeContext(client), 'dataset', rows=4)
+        records = list(cmd.iter_records(stream=True))
+
+        assert len(records) == total
+        # only an empty page ends a streamed search
+        assert len(client.calls) == -(-total // 4) + 1
+
+    @pytest.mark.parametrize('stream', [False, True])
+    def test_iter_records_pages_capped_by_server(self, stream):
+        client = FakeApiClient(self._search_handler(50, max_rows=10))
+        cmd = DumpCommand(FakeContext(client), 'dataset', rows=100)
+        records = list(cmd.iter_records(stream=stream))
+
+        assert [r['name'] for r in records] == [
+            'pkg-{:03}'.format(i) for i in range(50)
+        ]
+        assert [data['start'] for (_, data) in client.calls][:5] == \
+            [0, 10, 20, 30, 40]
+
+    def test_iter_records_projects_fields(self):
+        client = FakeApiClient(self._search_handler(3))
+        cmd = DumpCommand(FakeContext(client), 'dataset',
+                          query='organization:abia', fields=['id', 'name'])
+        records = list(cmd.iter_records())
+
+        assert records[0] == {'id': '0', 'name': 'pkg-000'}
+        assert client.calls[0][1]['fl'] == 'id name'
+        assert client.calls[0][1]['q'] == 'organization:abia'
+
+
+    def test_count_requests_no_rows(self):
+        client = FakeApiClient(self._search_handler(7))
+        cmd = DumpCommand(FakeContext(client), 'dataset', query='state:draft')
+        assert cmd.count() == 7
+        assert client.calls[0][1]['rows'] == 0
+
+    def _keyset_handler(self, total, max_rows=None):
+        names = ['pkg-{:03}'.format(i) for i in range(total)]
+
+        def handler(action_name, data):
+            after = data.get('fq', '"" TO')[len('name:{'):].split(' TO')[0]
+            remaining = [n for n in names if n > after.strip('"')]
+            rows = data['rows']
+            if max_rows is not None:
+                rows = min(rows, max_rows)
+            return {'result': {'count': len(remaining), 'results': [
+                {'name': n} for n in remaining[:rows]
+            ]}}
+        return handler
+
+    def test_keyset_paging_filters_on_last_name(self):
+        client = FakeApiClient(self._keyset_handler(10))
+        cmd = DumpCommand(FakeContext(client), 'dataset', rows=4,
+                          fields=['id'])
+        records = cmd.iter_records(keyset=True)
+
+        assert [r for r in records] == [{'id': None}] * 10
+        assert [data.get('fq') for (_, data) in client.calls] == [
+            None, 'name:{"pkg-003" TO *]', 'name:{"pkg-007" TO *]',
+            'name:{"pkg-009" TO *]'
+        ]
+        assert all(data['start'] == 0 and data['fl'] == 'id name'
+                   for (_, data) in client.calls)
+
+    @pytest.mark.parametrize('stream', [False, True])
+    def test_keyset_paging_capped_by_server(self, stream):
+        client = FakeApiClient(self._keyset_handler(50, max_rows=10))
+        cmd = DumpCommand(FakeContext(client), 'dataset', rows=100)
+        records = list(cmd.iter_records(stream=stream, keyset=True))
+
+        assert [r['name'] for r in records] == [
+            'pkg-{:03}'.format(i) for i in range(50)
+        ]
+        assert len(client.calls) == 6
+
+
+class TestPurgeCommand:
+
+    def test_purge_skips_ids_in_journal(self, tmpdir):
+        with Journal.open('purge', directory=str(tmpdir)) as journal:
+            journal.record('a')
+
+        client = FakeApiClient()
+        cmd = PurgeCommand(FakeContext(client), object='dataset',
+                           infile=io.StringIO('b\nc\n'), ids=['a'])
+        with Journal.open('purge', resume=True,
+                          directory=str(tmpdir)) as journal:
+            assert cmd.execute(journal=journal) == ['+ b', '+ c']
+            assert journal.is_done('c')
+        assert [data['id'] for (_, data) in client.calls] == ['b', 'c']
+
+    @pytest.mark.parametrize('workers', [1, 4])
+    def test_purge_dedupes_and_writes_outcomes(self, workers):
+        def handler(action_name, data):
+            time.sleep(random.random() / 200)
+            if data['id'] == 'c':
+                raise Exception('Not found')
+
+        client = FakeApiClient(handler)
+        cmd = PurgeCommand(FakeContext(client), object='dataset',
+                           infile=io.StringIO('a\nb\na\nc\nd\nb\n'),
+                           ids=['d'])
+        outfile = io.StringIO()
+        result = cmd.execute(workers=workers, outfile=outfile)
+
+        assert outfile.getvalue().splitlines() == ['+ d', '+ a', '+ b', '. c']
+        assert result == {'summary': {
+            'total': 4, 'passed': 3, 'failed': 1, 'duplicates': 3
+        }}
+        assert sorted(data['id'] for (_, data) in client.calls) == [
+            'a', 'b', 'c', 'd'
+        ]
+
+    def test_purge_by_query(self):
+        from benchmarks.fake_ckan import FakeCKAN
+        from ckanta.common import ApiClient
+
+        with FakeCKAN(datasets=30, organizations=3) as ckan:
+            context = FakeContext(ApiClient(ckan.urlbase, 'key'))
+            cmd = PurgeCommand(context, 'dataset', None, [],
+                               query='organization:org-0001')
+            assert cmd.count() == 10
+
+            cmd = PurgeCommand(context, 'dataset', None, [],
+                               query='organization:org-0001')
+            with pytest.MonkeyPatch.context() as mp:
+                mp.setattr(DumpCommand, 'ROWS', 3)
+                result = cmd.execute(workers=4)
+
+            assert len(result) == 10 and all(r[0] == '+' for r in result)
+            assert not [r for r in ckan.catalogue['package'].values()
+                        if r['owner_org'] == 'org-0001']
+            assert len(ckan.catalogue['package']) == 20
+
+    def test_query_only_selects_datasets(self):
+        with pytest.raises(CommandError):
+            PurgeCommand(DummyContext(), 'group', None, [], query='*:*')
+
+    def test_purge_reads_ids_as_needed(self):
+        read = []
+
+        def infile():
+            for line in ['a\n', '\n', 'b\n']:
+                read.append(line)
+                yield line
+
+        # number of lines read when each purge request is made
+        seen = []
+        client = FakeApiClient(lambda action, data: seen.append(len(read)))
+        cmd = PurgeCommand(FakeContext(client), object='dataset',
+                           infile=infile(), ids=[])
+        assert cmd.execute() == ['+ a', '+ b']
+        assert seen == [1, 3]
+
+
+class TestSyncUpload:
+    ORGS_CSV = (
+        'title,description,extras:code\n'
+        'Abia,Abia State,AB\n'
+        'Adamawa,Adamawa State,AD\n'
+        'Akwa Ibom,Akwa Ibom State,AK\n'
+    )
+    REMOTE = [
+        {'id': '1', 'name': 'abia', 'title': 'Abia', 'state': 'active',
+         'description': 'Abia State', 'package_count': 4,
+         'extras': [{'key': 'code', 'value': 'AB', 'state': 'active'}]},
+        {'id': '2', 'name': 'adamawa', 'title': 'Adamawa', 'state': 'active',
+         'description': 'Adamawa', 'package_count': 0,
+         'extras': [{'key': 'code', 'value': 'AD', 'state': 'active'}]},
+    ]
+
+    def _handler(self, action_name, data):
+        if action_name == 'organization_list':
+            return {'result': self.REMOTE[data['offset']:][:data['limit']]}
+        return {'result': data}
+
+    def test_diff_payload_normalizes_values(self):
+        payload = {'name': 'x', 'private': 'false', 'groups': [{'name': 'g'}]}
+        remote = {'name': 'x', 'private': False, 'id': '9',
+                  'groups': [{'name': 'g', 'id': '3', 'title': 'G'}]}
+        assert diff_payload(payload, remote) == {}
+
+        remote['private'] = True
+        assert diff_payload(payload, remote) == {'private': 'false'}
+
+    def test_sync_creates_patches_and_skips(self):
+        client = FakeApiClient(self._handler)
+        cmd = UploadCommand(FakeContext(client), object='organization',
+                            infile=io.StringIO(self.ORGS_CSV))
+        result = cmd.execute(as_get=False, sync=True)
+
+        assert result['result'] == ['= abia', '~ adamawa', '+ akwa-ibom']
+        assert result['summary'] == {
+            'total': 3, 'passed': 3, 'failed': 0,
+            'created': 1, 'patched': 1, 'unchanged': 1
+        }
+
+        # existing objects are fetched in bulk and changed ones patched
+        # as a whole
+        reads = [call for call in client.calls
+                 if call[0] == 'organization_list']
+        writes = client.calls[len(reads):]
+        assert len(reads) == 2
+        assert writes[0][0] == 'organization_patch'
+        assert writes[0][1]['id'] == '2'
+        assert writes[0][1]['description'] == 'Adamawa State'
+        assert writes[1][0] == 'organization_create'
+        assert writes[1][1]['name'] == 'akwa-ibom'
+
+
+class TestPatchCommand:
+
+    def test_patches_datasets_matching_query(self):
+        from benchmarks.fake_ckan import FakeCKAN
+        from ckanta.common import ApiClient
+
+        with FakeCKAN(datasets=9, organizations=3) as ckan:
+            context = FakeContext(ApiClient(ckan.urlbase, 'key'))
+            ckan.catalogue['package']['dataset-000004']['license_id'] = 'odc'
+
+            def _patch():
+                cmd = PatchCommand(
+                    context, 'dataset', query='organization:org-0001',
+                    set_fields={'license_id': 'odc'}, unset_fields=['url'],
+                    templates={'notes': '{title} by {owner_org}'}
+                )
+                return cmd.execute(workers=2)
+
+            result = _patch()
+            assert result['result'] == [
+                '~ dataset-000001', '~ dataset-000004', '~ dataset-000007'
+            ]
+            assert ckan.catalogue['package']['dataset-000007']['notes'] == \
+                'Dataset 7 by org-0001'
+            assert 'notes' not in ckan.catalogue['package']['dataset-000000']
+
+            result = _patch()
+            assert result['summary'] == {
+                'total': 3, 'passed': 3, 'failed': 0, 'created': 0,
+                'patched': 0, 'unchanged': 3
+            }
+
+    def test_patches_datasets_by_id_isolating_failures(self):
+        def handler(action_name, data):
+            if data['id'] == 'missing':
+                raise Exception('Not found')
+            return {'result': data}
+
+        client = FakeApiClient(handler)
+        cmd = PatchCommand(FakeContext(client), 'dataset',
+                           infile=io.StringIO('a\nmissing\n'), ids=['b'],
+                           set_fields={'private': 'true'})
+        result = cmd.execute(workers=3)
+
+        assert result['result'] == ['~ b', '~ a', 'x missing']
+        assert result['summary']['failed'] == 1
+        assert ('package_patch', {'id': 'a', 'private': 'true'}) in \
+            client.calls
+
+    def test_unset_field_missing_from_search_record(self):
+        def handler(action_name, data):
+            if action_name == 'package_search':
+                results = [{'id': 'id-a', 'name': 'a', 'sector': ''}]
+                if data.get('fq'):
+                    results = []
+                return {'result': {'count': 1, 'results': results}}
+            return {'result': data}
+
+        client = FakeApiClient(handler)
+        cmd = PatchCommand(FakeContext(client), 'dataset', query='name:a',
+                           unset_fields=['sector', 'custom_field'])
+        assert cmd.execute()['result'] == ['~ a']
+        assert ('package_patch', {'id': 'id-a', 'custom_field': ''}) in \
+            client.calls
+
+    def test_template_fetches_dataset(self):
+        client = FakeApiClient(lambda action, data: {'result': {
+            'id': 'id-a', 'name': 'a', 'title': 'Roads'
+        }})
+        cmd = PatchCommand(FakeContext(client), 'dataset', ids=['a'],
+                           templates={'title': 'Kano {title}',
+                                      'notes': '{missing}'})
+        assert cmd.execute()['result'] == ['x a']
+
+        cmd.templates.pop('notes')
+        assert cmd.execute()['result'] == ['~ a']
+        assert client.calls[-1] == (
+            'package_patch', {'id': 'id-a', 'title': 'Kano Roads'}
+        )
+
+    @pytest.mark.parametrize('kwargs', [
+        {'ids': ['a']}, {'set_fields': {'private': 'true'}}
+    ])
+    def test_requires_changes_and_selection(self, kwargs):
+        with pytest.raises(CommandError):
+            PatchCommand(DummyContext(), 'dataset', **kwargs)
+
+
+class TestMirrorCommand:
+
+    @pytest.fixture
+    def portals(self):
+        from benchmarks.fake_ckan import FakeCKAN
+        from ckanta.common import ApiClient
+
+        servers = [
+            FakeCKAN(datasets=5, groups=2, organizations=2).start(),
+            FakeCKAN(datasets=0, groups=1, organizations=0).start()
+        ]
+        yield [FakeContext(ApiClient(s.urlbase, 'key')) for s in servers], \
+              servers
+        for server in servers:
+            server.stop()
+
+    def test_mirror_creates_missing_objects(self, portals):
+        (source, target), (_, ckan) = portals
+        result = MirrorCommand(target, source).execute(workers=3)
+
+        assert list(result) == ['organization', 'group', 'dataset']
+        assert result['group']['result'] == ['= group-0000', '+ group-0001']
+        assert result['dataset']['summary'] == {
+            'total': 5, 'passed': 5, 'failed': 0,
+            'created': 5, 'patched': 0, 'unchanged': 0
+        }
+        assert ckan.catalogue['package']['dataset-000004']['owner_org'] == \
+            'org-0000'
+
+    def test_mirror_patches_changed_objects(self, portals):
+        (source, target), (src_ckan, _) = portals
+        MirrorCommand(target, source).execute()
+        src_ckan.catalogue['package']['dataset-000001']['title'] = 'Changed'
+
+        result = MirrorCommand(target, source, ['dataset']).execute()
+        assert list(result) == ['dataset']
+        assert result['dataset']['result'][:2] == [
+            '= dataset-000000', '~ dataset-000001'
+        ]
+
+    def test_destination_objects_looked_up_as_sent(self, portals):
+        (source, _), _ = portals
+
+        def handler(action_name, data):
+            if action_name != 'group_show':
+                return {'result': data}
+            if data['id'] != 'group-0000':
+                raise NotFoundError(data['id'])
+            return {'result': {'id': 'g0', 'name': 'group-0000'}}
+
+        client = FakeApiClient(handler)
+        result = MirrorCommand(FakeContext(client), source, ['group']) \
+            .execute(workers=2)
+
+        assert result['group']['result'] == ['~ group-0000', '+ group-0001']
+        assert sorted((a, d.get('id') or d['name']) for (a, d) in
+                      client.calls) == [
+            ('group_create', 'group-0001'), ('group_patch', 'g0'),
+            ('group_show', 'group-0000'), ('group_show', 'group-0001'),
+        ]
+
+    def test_dataset_payload_refers_to_objects_by_name(self):
+        cmd = MirrorCommand(DummyContext(), DummyContext())
+        payload = cmd._build_dataset_payload({
+            'id': 'ds-id', 'name': 'ds', 'owner_org': 'org-id',
+            'organization': {'id': 'org-id', 'name': 'org'},
+            'groups': [{'id': 'grp-id', 'name': 'grp', 'title': 'Group'}],
+            'resources': [{'id': 'res-id', 'package_id': 'ds-id',
+                           'url': 'http://example.org/data.csv'}],
+            'metadata_modified': '2018-01-01T00:00:00'
+        })
+        assert payload == {
+            'name': 'ds', 'owner_org': 'org', 'groups': [{'name': 'grp'}],
+            'resources': [{'url': 'http://example.org/data.csv'}]
+        }
+
+
+class TestMembershipGrant:
+    ORGS = {
+        'amina': [{'id': 'o1', 'name': 'abia', 'capacity': 'member'},
+                  {'id': 'o2', 'name': 'kano', 'capacity': 'admin'}],
+        'bello': [],
+    }
+
+    def _handler(self, action_name, data):
+        if action_name == 'organization_list_for_user':
+            return {'result': self.ORGS[data['id']]}
+        if action_name == 'user_show':
+            return {'result': {'id': 'id-' + data['id']}}
+        if action_name == 'member_list':
+            members = [('id-amina', 'user', 'member')]
+            return {'result': members if data['id'] == 'health' else []}
+        return {'result': data}
+
+    def _creates(self, client):
+        return sorted(
+            (data['username'], data['id'], data['role'])
+            for (action_name, data) in client.calls
+            if action_name.endswith('_member_create')
+        )
+
+    def test_skips_organizations_user_is_member_of(self):
+        client = FakeApiClient(self._handler)
+        cmd = MembershipGrantCommand(FakeContext(client), 'amina,bello',
+                                     'member', ['abia', 'o2'],
+                                     CKANObject.ORGANIZATION)
+        result = cmd.execute(as_get=False, workers=4)
+
+        assert result['result'] == [
+            '= amina: abia', '+ amina: o2', '+ bello: abia', '+ bello: o2'
+        ]
+        assert result['summary'] == {
+            'total': 4, 'passed': 4, 'failed': 0, 'unchanged': 1
+        }
+        assert self._creates(client) == [
+            ('amina', 'o2', 'member'), ('bello', 'abia', 'member'),
+            ('bello', 'o2', 'member')
+        ]
+        fetches = [data['id'] for (action_name, data) in client.calls
+                   if action_name == 'organization_list_for_user']
+        assert sorted(fetches) == ['amina', 'bello']
+
+    def test_skips_groups_user_is_member_of(self):
+        client = FakeApiClient(self._handler)
+        cmd = MembershipGrantCommand(FakeContext(client), 'amina', 'member',
+                                     [], CKANObject.GROUP,
+                                     [('amina', 'health'), ('amina', 'water'),
+                                      ('bello', 'health')])
+        result = cmd.execute(as_get=False, workers=2)
+
+        assert result['summary']['unchanged'] == 1
+        assert self._creates(client) == [
+            ('amina', 'water', 'member'), ('bello', 'health', 'member')
+        ]
+
+    def test_regrant_reads_fresh_memberships(self, tmpdir):
+        from benchmarks.fake_ckan import FakeCKAN
+        from ckanta.cache import ResponseCache
+        from ckanta.common import ApiClient
+
+        cache = ResponseCache(str(tmpdir.join('responses.sqlite')))
+        with FakeCKAN(groups=1, users=1) as ckan:
+            context = FakeContext(ApiClient(ckan.urlbase, 'key', cache=cache))
+
+            def _grant(role):
+                cmd = MembershipGrantCommand(context, 'user-0000', role,
+                                             ['group-0000'], CKANObject.GROUP)
+                return cmd.execute(as_get=False)['result']
+
+            ckan.members[('group', 'group-0000')] = {
+                'user-id-user-0000': 'member'
+            }
+            assert _grant('editor') == ['+ user-0000: group-0000']
+            assert _grant('member') == ['+ user-0000: group-0000']
+            assert ckan.members[('group', 'group-0000')] == {
+                'user-id-user-0000': 'member'
+            }
+        cache.close()
+
+    def test_failed_grants_are_reported(self):
+        def handler(action_name, data):
+            if action_name == 'group_member_create' and data['id'] == 'bad':
+                raise ValueError('denied')
+            return self._handler(action_name, data)
+
+        cmd = MembershipGrantCommand(FakeContext(FakeApiClient(handler)),
+                                     'bello', 'editor', ['bad', 'health'],
+                                     CKANObject.GROUP)
+        result = cmd.execute(as_get=False, workers=2)
+        assert result['result'] == [
+            '. bello: bad: err: denied', '+ bello: health'
+        ]
+        assert result['summary']['failed'] == 1
+
+    def _access_handler(self, action_name, data):
+        if action_name == 'user_show':
+            if data['id'] == 'ghost':
+                raise ValueError('Not found')
+            return {'result': {
+                'id': 'id-' + data['id'], 'display_name': data['id'].title(),
+                'email': '{}@example.org'.format(data['id']),
+                'apikey': 'key-' + data['id'], 'org_name': 'Example',
+                'org_category': 'Government', 'country_state': 'Kano'
+            }}
+        if action_name == 'eoc_request_create':
+            return {'result': {'id': 'req-' + data['entity_id']}}
+        return {'result': data}
+
+    def test_grants_dataset_access(self):
+        client = FakeApiClient(self._access_handler)
+        cmd = MembershipGrantCommand(FakeContext(client), 'amina,bello,ghost',
+                                     'member', ['ds-1', 'ds-2'],
+                                     CKANObject.DATASET)
+        result = cmd.execute(as_get=False, workers=4)
+
+        assert result['result'][:4] == [
+            '+ amina: ds-1', '+ amina: ds-2', '+ bello: ds-1', '+ bello: ds-2'
+        ]
+        assert result['result'][4:] == [
+            '. ghost: ds-1: err: Failed retrieving user details',
+            '. ghost: ds-2: err: Failed retrieving user details'
+        ]
+        assert result['summary']['passed'] == 4
+
+        # a client per identity and requests made as the user needing access
+        assert [c.apikey for c in client.identities] == [
+            'key-amina', 'key-bello'
+        ]
+        creates = sorted(
+            (data['apikey'], data['entity_id'], data['fullname'])
+            for (action_name, data) in client.calls
+            if action_name == 'eoc_request_create'
+        )
+        assert creates[0] == ('key-amina', 'ds-1', 'Amina (via CKANTA)')
+        assert creates[3] == ('key-bello', 'ds-2', 'Bello (via CKANTA)')
+
+        approvals = sorted(data['id'] for (action_name, data) in client.calls
+                           if action_name == 'eoc_request_patch')
+        assert approvals == ['req-ds-1', 'req-ds-1', 'req-ds-2', 'req-ds-2']
+
+    def test_read_grants(self):
+        infile = io.StringIO(
+            'user,group,organization\n'
+            'amina,health,abia\n'
+            'bello,,kano\n'
+        )
+        grants = MembershipGrantCommand.read_grants(infile)
+        assert grants == {
+            CKANObject.GROUP: [('amina', 'health')],
+            CKANObject.ORGANIZATION: [('amina', 'abia'), ('bello', 'kano')]
+        }
+
+    def test_read_grants_requires_columns(self):
+        with pytest.raises(CommandError):
+            MembershipGrantCommand.read_grants(io.StringIO('user,role\n'))
+
+
+class TestDatasetMembership:
+
+    def _handler(self, calls):
+        members = {'health': [['ds-1', 'package', 'member']], 'roads': []}
+
+        def handler(action_name, data):
+            if data['id'] == 'missing':
+                raise Exception('Not found')
+            if action_name == 'member_list':
+                if data['id'] == 'flaky':
+                    raise Exception('Timed out')
+                return {'result': members[data['id']]}
+            if data['object'] == 'broken':
+                raise Exception('Server error')
+            calls.append((data['object'], data['id']))
+        return handler
+
+    def test_read_pairs(self):
+        lines = [
+            '# dataset  group', 'Kano Roads  ds-2  roads', 'ds-3\thealth',
+            'ds-4 roads', '', 'ds-5  roads  #', 'end []', 'ds-6  roads'
+        ]
+        assert list(DatasetMembershipCommand.read_pairs(lines)) == [
+            ('ds-2', 'roads'), ('ds-3', 'health'), ('ds-4', 'roads')
+        ]
+        with pytest.raises(CommandError):
+            list(DatasetMembershipCommand.read_pairs(['ds-1']))
+
+    @pytest.mark.parametrize('batch_size', [2, 1000])
+    def test_pairs_grouped_and_failures_isolated(self, batch_size,
+                                                 monkeypatch):
+        monkeypatch.setattr(DatasetMembershipCommand, 'BATCH_SIZE',
+                            batch_size)
+        created = []
+        client = FakeApiClient(self._handler(created))
+        infile = io.StringIO(
+            'ds-1  health\nds-2  roads\nbroken  roads\nds-3  missing\n'
+            'ds-4  health\nds-2  roads\nds-6  flaky\n'
+        )
+        cmd = DatasetMembershipCommand(FakeContext(client), infile,
+                                       [('ds-5', 'roads')])
+        result = cmd.execute(workers=3)
+
+        # members of flaky couldn't be listed; its pairs are still added
+        assert sorted(created) == [
+            ('ds-2', 'roads'), ('ds-4', 'health'), ('ds-5', 'roads'),
+            ('ds-6', 'flaky')
+        ]
+        assert result['summary'] == {
+            'total': 7, 'passed': 5, 'failed': 2, 'unchanged': 1
+        }
+        assert '. broken: roads: err: Server error' in result['result']
+        assert '. ds-3: missing: err: Not found' in result['result']
+
+    def test_pairs_ordered_by_group_within_batch(self):
+        client = FakeApiClient(self._handler([]))
+        cmd = DatasetMembershipCommand(FakeContext(client), pairs=[
+            ('ds-2', 'roads'), ('ds-3', 'health'), ('ds-4', 'roads')
+        ])
+        assert cmd.execute()['result'] == [
+            '+ ds-2: roads', '+ ds-4: roads', '+ ds-3: health'
+        ]
+        member_lists = [d['id'] for (a, d) in client.calls
+                        if a == 'member_list']
+        assert member_lists == ['roads', 'health']
+
+
+class GeoContext(DummyContext):
+    State = namedtuple('State', ['code', 'name'])
+    CONFIG = {
+        'grid-geoserver-urlbase': 'https://geo.example.org/ows',
+        'grid-geoserver-service': 'WFS',
+        'grid-geoserver-version': '1.0.0',
+        'grid-geoserver-request': 'GetFeature',
+        'grid-geoserver-outputFormat': 'csv',
+        'grid-geoserver-authkey': 'k3y',
+    }
+
+    def __init__(self):
+        self.config_reads = 0
+        self.national_states = {
+            'abia': self.State('AB', 'Abia'),
+            'kano': self.State('KN', 'Kano'),
+        }
+
+    def get_config(self, name, section=None):
+        self.config_reads += 1
+        return self.CONFIG.get(name)
+
+
+class TestUploadDatasetCommand:
+    DATASETS_CSV = (
+        'title,sector_id,res:url\n'
+        'Roads,transport,"eHA:roads;state_code=\'AB\'"\n'
+        'Schools,education,"eHA:schools;state_code=\'AB\'"\n'
+    )
+
+    @pytest.mark.parametrize('workers', [1, 4])
+    def test_payload_per_organization(self, workers):
+        context = GeoContext()
+        context.client = FakeApiClient()
+        cmd = UploadDatasetCommand(context, io.StringIO(self.DATASETS_CSV),
+                                   'abia,kano', None, None, None)
+        result = cmd.execute(as_get=False, workers=workers)
+        assert result['summary']['passed'] == 4
+
+        payloads = sorted(
+            (data['owner_org'], data['title'], data['locations'],
+             data['resources'][0]['url'].split('%27')[1])
+            for (_, data) in context.client.calls
+        )
+        assert payloads == [
+            ('abia', 'Abia Roads', 'abia', 'AB'),
+            ('abia', 'Abia Schools', 'abia', 'AB'),
+            ('kano', 'Kano Roads', 'kano', 'KN'),
+            ('kano', 'Kano Schools', 'kano', 'KN'),
+        ]
+        assert not any(key.startswith('res:')
+                       for (_, data) in context.client.calls for key in data)
+
+    def test_sync_skips_unchanged_datasets(self):
+        context = GeoContext()
+        context.client = FakeApiClient()
+        cmd = UploadDatasetCommand(context, io.StringIO(self.DATASETS_CSV),
+                                   'abia', None, None, None)
+        cmd.execute(as_get=False)
+        # CKAN only returns package fields and refers to the organization
+        # by id in owner_org
+        remote = [
+            dict({k: v for (k, v) in data.items() if ':' not in k},
+                 id='id-{}'.format(data['name']),
+                 owner_org='5e4a2b3c-0d1f-4a6b-9c8d-7e6f5a4b3c2d',
+                 organization={'id': '5e4a2b3c-0d1f-4a6b-9c8d-7e6f5a4b3c2d',
+                               'name': 'abia', 'title': 'Abia'},
+                 resources=[dict(data['resources'][0], id='r1')])
+            for (_, data) in context.client.calls
+        ]
+        remote[1]['notes'] = 'Enrolment'
+        remote[1]['sector_id'] = 'health'
+
+        def handler(action_name, data):
+            if action_name == 'package_search':
+                results = remote[data['start']:][:data['rows']]
+                return {'result': {'count': 2, 'results': results}}
+            return {'result': data}
+
+        context.client = FakeApiClient(handler)
+        cmd = UploadDatasetCommand(context, io.StringIO(self.DATASETS_CSV),
+                                   'abia', None, None, None)
+        result = cmd.execute(as_get=False, sync=True)
+
+        assert result['result'] == ['= abia-roads', '~ abia-schools']
+        (action_name, data) = context.client.calls[-1]
+        assert action_name == 'package_patch'
+        assert (data['id'], data['sector_id']) == \
+            ('id-abia-schools', 'education')
+
+
+class TestResourceUrls:
+    URL_FMT = (
+        'https://geo.example.org/ows?typeName=eHA%3Aschools'
+        '&CQL_FILTER=state_code%3D%27{}%27&service=WFS&version=1.0.0'
+        '&request=GetFeature&outputFormat={}&authkey={}'
+    )
+
+    @pytest.mark.parametrize('res_url', [
+        "eHA:schools;state_code='AB'",
+        "eHA:schools;state_code='${state_code}'",
+    ])
+    def test_state_code_substituted(self, res_url):
+        cmd = UploadDatasetCommand(GeoContext(), None, 'abia,kano', None,
+                                   None, None)
+        assert cmd._build_resource_url(res_url, 'abia') == \
+            self.URL_FMT.format('AB', 'csv', 'k3y')
+        assert cmd._build_resource_url(res_url, 'kano') == \
+            self.URL_FMT.format('KN', 'csv', 'k3y')
+
+    def test_cli_params_override_config(self):
+        cmd = UploadDatasetCommand(GeoContext(), None, 'kano', None,
+                                   's3cret', 'JSON')
+        url = cmd._build_resource_url("eHA:schools;state_code='AB'", 'kano')
+        assert url == self.URL_FMT.format('KN', 'JSON', 's3cret')
+
+    def test_template_compiled_once_per_url(self):
+        context = GeoContext()
+        cmd = UploadDatasetCommand(context, None, 'abia,kano', None, None,
+                                   None)
+        for orgname in ('abia', 'kano') * 10:
+            cmd._build_resource_url("eHA:schools;state_code='AB'", orgname)
+        assert context.config_reads == 6
+        assert len(cmd._url_templates) == 1
+
+    def test_url_without_cql_filter(self):
+        cmd = UploadDatasetCommand(GeoContext(), None, 'abia', None, None,
+                                   None)
+        url = cmd._build_resource_url('eHA:settlements', 'abia')
+        assert 'CQL_FILTER' not in url and 'typeName=eHA%3Asettlements' in url
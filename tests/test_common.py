@@ -1,7 +1,17 @@
+import os
+import stat
+import time
+import json
+import asyncio
 import pytest
+import requests
+import threading
 import os.path as fs
 from ckanta.common import get_instance_config, Config, ConfigError, \
-     ApiClient, MembershipRole
+     CKANTAError, ApiClient, AsyncApiClient, MembershipRole, \
+     iter_concurrent, aiter_concurrent, encode_params, RateLimiter, \
+     parse_retry_after, compile_config, load_config, RequestStats, \
+     iter_json_items
 
 
 HERE = fs.abspath(fs.dirname(__file__))
@@ -28,6 +38,78 @@ class TestConfig:
         with pytest.raises(ConfigError):
             get_instance_config(cfg_s, 'x-local')
 
+    def test_get_instance_reads_client_options(self, cfg_s):
+        config = get_instance_config(cfg_s, 'dev')
+        assert config.name == 'dev'
+        assert config.options == {
+            'pool_maxsize': 32, 'keep_alive': False, 'timeout': 30.0,
+            'rate_limit': 20.0, 'max_retries': 5
+        }
+
+    def test_get_instance_without_client_options(self, cfg_s):
+        config = get_instance_config(cfg_s, 'local')
+        assert config.options == {}
+
+    def test_fails_for_invalid_client_option(self, cfg_s):
+        cfg_s['instance:local']['pool-maxsize'] = 'many'
+        with pytest.raises(ConfigError):
+            get_instance_config(cfg_s, 'local')
+
+
+class TestConfigSnapshot:
+    CONTENT = '''
+[ckanta]
+national-states = NG-KN:Kano  NG-LA:'Lagos'
+    NG-FC:Federal Capital Territory
+
+[instance:local]
+urlbase = http://localhost:5000
+apikey = 29dc8b28d78g923basd43w
+'''
+
+    @pytest.fixture
+    def paths(self, tmpdir):
+        config_path = tmpdir.join('ckanta.conf')
+        config_path.write(self.CONTENT)
+        return (str(config_path), str(tmpdir.join('cache', 'config.json')))
+
+    def test_load_without_snapshot(self, paths):
+        configp, states = load_config(*paths)
+        assert states is None
+        assert configp['instance:local']['urlbase'] == 'http://localhost:5000'
+
+    def test_load_compiled_snapshot(self, paths):
+        compile_config(*paths)
+        configp, states = load_config(*paths)
+        assert get_instance_config(configp, 'local').apikey == \
+            '29dc8b28d78g923basd43w'
+        assert list(states) == ['kano', 'lagos', 'federal-capital-territory']
+        assert states['lagos'] == ('NG-LA', 'Lagos')
+
+    def test_snapshot_readable_by_owner_only(self, paths):
+        os.makedirs(os.path.dirname(paths[1]))
+        with open(paths[1], 'w') as fp:
+            fp.write('{}')
+        os.chmod(paths[1], 0o644)
+
+        compile_config(*paths)
+        assert stat.S_IMODE(os.stat(paths[1]).st_mode) == 0o600
+
+    def test_stale_snapshot_is_recompiled(self, paths):
+        compile_config(*paths)
+        with open(paths[0], 'a') as fp:
+            fp.write('\n[instance:dev]\nurlbase = http://dev\napikey = k\n')
+
+        configp, states = load_config(*paths)
+        assert configp.has_section('instance:dev')
+        with open(paths[1]) as fp:
+            assert 'instance:dev' in json.load(fp)['sections']
+
+    def test_load_fails_for_missing_file(self, paths, tmpdir):
+        compile_config(*paths)
+        with pytest.raises(ConfigError):
+            load_config(str(tmpdir.join('missing.conf')), paths[1])
+
 
 class TestApiClient:
 
@@ -44,6 +126,39 @@ class TestApiClient:
         with pytest.raises(AssertionError):
             client('group_list', as_get=False)
 
+    def test_encoding_get_params(self):
+        params = encode_params({
+            'all_fields': False, 'limit': 10, 'sort': 'name asc',
+            'fl': ['id', 'name']
+        })
+        assert params == {
+            'all_fields': 'false', 'limit': 10, 'sort': 'name asc',
+            'fl': '["id", "name"]'
+        }
+        assert encode_params(None) == {}
+
+    def test_client_from_config_applies_options(self, cfg_s):
+        client = ApiClient.from_config(get_instance_config(cfg_s, 'dev'))
+        assert client.pool_maxsize == 32
+        assert client.pool_connections == ApiClient.POOL_CONNECTIONS
+        assert client.session.headers['Connection'] == 'close'
+        adapter = client.session.get_adapter(client.urlbase)
+        assert adapter._pool_maxsize == 32
+        assert client.rate_limiter.rate == 20.0
+        assert client.max_retries == 5
+
+    def test_session_is_reused_across_requests(self):
+        client = ApiClient('http://localhost', '*secret*')
+        assert client.session is client.session
+
+    def test_client_with_apikey_shares_session(self):
+        client = ApiClient('http://localhost', '*secret*')
+        other = client.with_apikey('*other*')
+        assert other.apikey == '*other*'
+        assert other.urlbase == client.urlbase
+        assert other.session is client.session
+        assert other.rate_limiter is client.rate_limiter
+
 
 class TestMembershipRole:
 
@@ -69,3 +184,339 @@ class TestMembershipRole:
         assert names and len(names) == 2
         assert MembershipRole.ADMIN.name.lower() not in names
         assert MembershipRole.NONE.name.lower() not in names
+
+
+class TestIterConcurrent:
+
+    def test_results_follow_input_order(self):
+        def func(n):
+            time.sleep((10 - n) / 1000)
+            if n == 3:
+                raise ValueError(n)
+            return n * n
+
+        outcomes = list(iter_concurrent(func, range(10), workers=4))
+        assert [item for (item, _, _) in outcomes] == list(range(10))
+        assert outcomes[2] == (2, 4, None)
+        assert isinstance(outcomes[3][2], ValueError)
+
+    def test_inflight_calls_are_bounded(self):
+        lock, state = threading.Lock(), {'active': 0, 'peak': 0}
+
+        def func(n):
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            time.sleep(0.002)
+            with lock:
+                state['active'] -= 1
+
+        drawn = []
+        def items():
+            for n in range(40):
+                drawn.append(n)
+                yield n
+
+        for (item, _, _) in iter_concurrent(func, items(), workers=3):
+            # items are drawn lazily; never more than the window ahead
+            assert len(drawn) - item <= 6
+        assert state['peak'] <= 3
+
+
+class TestAiterConcurrent:
+
+    def test_results_follow_input_order(self):
+        state = {'active': 0, 'peak': 0}
+
+        async def func(n):
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+            await asyncio.sleep((10 - n) / 1000)
+            state['active'] -= 1
+            if n == 3:
+                raise ValueError(n)
+            return n * n
+
+        async def collect():
+            return [o async for o in aiter_concurrent(func, range(10), 4)]
+
+        loop = asyncio.new_event_loop()
+        outcomes = loop.run_until_complete(collect())
+        loop.close()
+
+        assert [item for (item, _, _) in outcomes] == list(range(10))
+        assert outcomes[2] == (2, 4, None)
+        assert isinstance(outcomes[3][2], ValueError)
+        assert state['peak'] <= 4
+
+
+class TestAsyncApiClient:
+
+    @pytest.mark.parametrize('method, args', [
+        ('iter_result', ('package_list',)),
+        ('_request', ('package_list', None, True)),
+    ])
+    def test_blocking_paths_unsupported(self, method, args):
+        client = AsyncApiClient('http://localhost', '*secret*')
+        with pytest.raises(CKANTAError) as excinfo:
+            result = getattr(client, method)(*args)
+            next(iter(result))
+        assert 'not supported asynchronously' in str(excinfo.value)
+
+    def test_requests_made_on_event_loop(self):
+        web = pytest.importorskip('aiohttp.web')
+
+        async def handle(request):
+            body = await request.text()
+            return web.json_response({
+                'success': True,
+                'result': {
+                    'method': request.method,
+                    'auth': request.headers['Authorization'],
+                    'data': json.loads(body) if body else None
+                }
+            })
+
+        async def scenario():
+            app = web.Application()
+            app.router.add_route('*', '/api/3/action/{name}', handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            try:
+                urlbase = 'http://127.0.0.1:{}/'.format(port)
+                async with AsyncApiClient(urlbase, '*secret*') as client:
+                    return await asyncio.gather(
+                        client('group_list'),
+                        client('group_create', {'name': 'g'}, as_get=False)
+                    )
+            finally:
+                await runner.cleanup()
+
+        loop = asyncio.new_event_loop()
+        got, posted = loop.run_until_complete(scenario())
+        loop.close()
+
+        assert got['result'] == {
+            'method': 'GET', 'auth': '*secret*', 'data': None
+        }
+        assert posted['result']['method'] == 'POST'
+        assert posted['result']['data'] == {'name': 'g'}
+
+
+def build_response(status_code, body=None, headers=None):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp._content = json.dumps(body or {}).encode('utf-8')
+    resp.headers.update(headers or {})
+    return resp
+
+
+class FakeSession:
+    '''Replays the queued responses (or raises queued exceptions).
+    '''
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def _reply(self, method, url):
+        self.requests.append((method, url))
+        reply = self.responses.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def get(self, url, **kwargs):
+        return self._reply('GET', url)
+
+    def post(self, url, **kwargs):
+        return self._reply('POST', url)
+
+
+class TestRateLimiter:
+
+    def test_burst_is_available_immediately(self):
+        limiter = RateLimiter(rate=2, burst=3)
+        delays = [limiter.reserve() for _ in range(5)]
+        assert delays[:3] == [0, 0, 0]
+        assert delays[3] == pytest.approx(0.5, abs=0.01)
+        assert delays[4] == pytest.approx(1.0, abs=0.01)
+
+    def test_invalid_rate_fails(self):
+        with pytest.raises(ValueError):
+            RateLimiter(rate=0)
+
+
+class TestRetries:
+
+    @pytest.fixture(autouse=True)
+    def sleeps(self, monkeypatch):
+        sleeps = []
+        monkeypatch.setattr('ckanta.common.time.sleep', sleeps.append)
+        return sleeps
+
+    def test_parse_retry_after(self):
+        assert parse_retry_after('7') == 7.0
+        assert parse_retry_after(None) is None
+        assert parse_retry_after('soon') is None
+        assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+    def test_read_action_retried_on_unavailable(self, sleeps):
+        session = FakeSession(
+            build_response(503), requests.ConnectionError('reset'),
+            build_response(200, {'result': 'ok'})
+        )
+        client = ApiClient('http://localhost', '*secret*', session=session)
+        assert client('package_show', {'id': 'p'}) == {'result': 'ok'}
+        assert len(session.requests) == 3
+        assert len(sleeps) == 2
+        assert all(0 <= delay <= 1 for delay in sleeps)
+
+    def test_retry_after_is_honoured(self, sleeps):
+        session = FakeSession(
+            build_response(429, headers={'Retry-After': '4'}),
+            build_response(200, {'result': 'ok'})
+        )
+        client = ApiClient('http://localhost', '*secret*', session=session)
+        client('package_create', {'name': 'p'}, as_get=False)
+        assert sleeps == [4.0]
+
+    def test_unsafe_action_not_retried_on_unavailable(self, sleeps):
+        session = FakeSession(build_response(503))
+        client = ApiClient('http://localhost', '*secret*', session=session)
+        with pytest.raises(requests.HTTPError):
+            client('package_create', {'name': 'p'}, as_get=False)
+        assert sleeps == []
+
+    def test_gives_up_after_max_retries(self, sleeps):
+        session = FakeSession(*[build_response(503) for _ in range(3)])
+        client = ApiClient('http://localhost', '*secret*', session=session,
+                           max_retries=2)
+        with pytest.raises(requests.HTTPError):
+            client('dataset_purge', {'id': 'p'}, as_get=False)
+        assert len(sleeps) == 2 and not session.responses
+
+    def test_backoff_is_capped(self):
+        client = ApiClient('http://localhost', '*secret*', max_retries=20,
+                           backoff_factor=1, max_backoff=5)
+        delays = [client.get_retry_delay('group_show', n) for n in range(20)]
+        assert max(delays) <= 5
+        assert client.get_retry_delay('group_show', 20) is None
+
+
+class TestRequestStats:
+
+    def test_record(self):
+        stats = RequestStats()
+        stats.record('package_show', 200, 0.02, 10, 100)
+        stats.record('package_show', 503, 0.3, 10, 5)
+        stats.record('package_show', None, 20, retry=True)
+        stats.record_cached('package_show')
+
+        entry = stats.as_dict()['package_show']
+        assert entry['requests'] == 3 and entry['cached'] == 1
+        assert entry['errors'] == 2 and entry['retries'] == 1
+        assert (entry['bytes_sent'], entry['bytes_received']) == (20, 105)
+        assert entry['status_codes'] == {'200': 1, '503': 1, 'error': 1}
+        assert entry['latency']['max'] == 20
+        assert entry['latency']['histogram']['<=0.025'] == 1
+        assert entry['latency']['histogram']['<=0.5'] == 1
+        assert entry['latency']['histogram']['>10'] == 1
+
+    def test_format_table(self):
+        stats = RequestStats()
+        stats.record('member_create', 200, 0.25, 10, 100)
+        header, _, row = stats.format_table().splitlines()
+        assert header.split()[:3] == ['action', 'requests', 'errors']
+        assert row.split() == [
+            'member_create', '1', '0', '0', '0', '10', '100', '250.0', '250.0'
+        ]
+
+    def test_client_records_requests(self, monkeypatch):
+        monkeypatch.setattr('ckanta.common.time.sleep', lambda delay: None)
+        session = FakeSession(
+            build_response(503), build_response(200, {'result': 'ok'})
+        )
+        client = ApiClient('http://localhost', '*secret*', session=session)
+        client('package_show', {'id': 'p'})
+        assert client.with_apikey('other').stats is client.stats
+
+        entry = client.stats.as_dict()['package_show']
+        assert entry['requests'] == 2 and entry['retries'] == 1
+        assert entry['status_codes'] == {'503': 1, '200': 1}
+        assert entry['bytes_received'] == len(b'{}') + len(b'{"result": "ok"}')
+
+
+def split_chunks(text, size):
+    content = text.encode('utf-8')
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+
+class TestStreaming:
+    DOCUMENT = json.dumps({
+        'help': 'http://localhost/api/3/action/help_show?name=package_list',
+        'success': True,
+        'result': ['dataset-1', 12345, {'name': 'Kanó', 'tags': [1, 2]}, None]
+    })
+
+    @pytest.mark.parametrize('size', [1, 2, 7, 4096])
+    def test_items_decoded_across_chunks(self, size):
+        items = iter_json_items(split_chunks(self.DOCUMENT, size))
+        assert list(items) == json.loads(self.DOCUMENT)['result']
+
+    def test_document_split_at_every_offset(self):
+        document = ('{"count": 12.5, "neg": -3e+2, "result": '
+                    '[12.5, -7, 1E-3, 0.25e10, true, 40, {"n": -1.5}]}')
+        content = document.encode('utf-8')
+        expected = json.loads(document)['result']
+        for offset in range(1, len(content)):
+            chunks = [content[:offset], content[offset:]]
+            assert list(iter_json_items(chunks)) == expected, offset
+
+    def test_items_at_nested_path(self):
+        document = json.dumps({'result': {
+            'count': 2, 'facets': {}, 'results': [{'id': 1}, {'id': 2}],
+            'sort': 'name asc'
+        }})
+        items = iter_json_items(split_chunks(document, 5),
+                                ('result', 'results'))
+        assert list(items) == [{'id': 1}, {'id': 2}]
+
+    def test_document_read_lazily(self):
+        read = []
+
+        def chunks():
+            for chunk in split_chunks(self.DOCUMENT, 8):
+                read.append(chunk)
+                yield chunk
+
+        items = iter_json_items(chunks())
+        assert next(items) == 'dataset-1'
+        assert len(b''.join(read)) < len(self.DOCUMENT)
+
+    @pytest.mark.parametrize('document', [
+        '{"success": true}', '{"result": [1, 2', '[1, 2]',
+    ])
+    def test_invalid_document_fails(self, document):
+        with pytest.raises(ValueError):
+            list(iter_json_items(split_chunks(document, 3)))
+
+    def test_empty_result(self):
+        assert list(iter_json_items([b'{"result": [ ]}'])) == []
+
+    def test_client_streams_gzipped_result(self):
+        from benchmarks.fake_ckan import FakeCKAN
+
+        with FakeCKAN(datasets=30) as ckan:
+            client = ApiClient(ckan.urlbase, 'key')
+            items = client.iter_result('package_list', {'limit': 25})
+            assert list(items) == [
+                'dataset-{:06}'.format(n) for n in range(25)
+            ]
+
+            entry = client.stats.as_dict()['package_list']
+            assert entry['requests'] == 1
+            assert 0 < entry['bytes_received'] < 25 * len('"dataset-000000"')
@@ -0,0 +1,96 @@
+import pytest
+import os.path as fs
+from ckanta.common import ApiClient
+from ckanta.commands import CommandError, IndexBuildCommand
+from ckanta.index import CatalogueIndex
+
+
+DATASETS = [
+    {'id': 'd1', 'name': 'kano-roads', 'state': 'active', 'private': False,
+     'organization': {'id': 'o1', 'name': 'kano'}, 'owner_org': 'o1',
+     'groups': [{'id': 'g1', 'name': 'transport'}]},
+    {'id': 'd2', 'name': 'abia-schools', 'state': 'active', 'private': False,
+     'owner_org': 'abia', 'groups': [{'id': 'g2', 'name': 'education'}]},
+    {'id': 'd3', 'name': 'kano-clinics', 'state': 'draft', 'private': True,
+     'organization': {'id': 'o1', 'name': 'kano'}, 'owner_org': 'o1',
+     'groups': []},
+]
+
+
+class FakeContext:
+
+    def __init__(self, client):
+        self.client = client
+
+
+@pytest.fixture
+def index(tmpdir):
+    index = CatalogueIndex(fs.join(str(tmpdir), 'index', 'test.sqlite'))
+    with index.rebuild('http://localhost') as writer:
+        writer.add('dataset', DATASETS)
+        writer.add('group', [{'id': 'g1', 'name': 'transport'}])
+    yield index
+    index.close()
+
+
+class TestCatalogueIndex:
+
+    def test_list_excludes_private_datasets(self, index):
+        assert index.list('dataset') == ['abia-schools', 'kano-roads']
+        assert index.list('dataset', include_private='true') == [
+            'abia-schools', 'kano-clinics', 'kano-roads'
+        ]
+
+    @pytest.mark.parametrize('filters, expected', [
+        ({'owner_org': 'kano'}, ['kano-clinics', 'kano-roads']),
+        ({'owner_org': 'abia'}, ['abia-schools']),
+        ({'groups': 'transport'}, ['kano-roads']),
+        ({'state': 'draft'}, ['kano-clinics']),
+        ({'limit': '1', 'offset': '1'}, ['kano-clinics']),
+    ])
+    def test_list_filters(self, index, filters, expected):
+        assert index.list('dataset', include_private=True, **filters) == \
+            expected
+
+    def test_list_all_fields(self, index):
+        assert index.list('group', all_fields='true') == [
+            {'id': 'g1', 'name': 'transport'}
+        ]
+
+    def test_show_by_id_or_name(self, index):
+        assert index.show('dataset', 'd2') == DATASETS[1]
+        assert index.show('dataset', 'abia-schools') == DATASETS[1]
+        with pytest.raises(CommandError):
+            index.show('group', 'education')
+
+    def test_failed_rebuild_keeps_index(self, index):
+        with pytest.raises(RuntimeError):
+            with index.rebuild() as writer:
+                writer.add('group', [{'id': 'g2', 'name': 'education'}])
+                raise RuntimeError()
+        assert index.list('group') == ['transport']
+        assert not fs.exists('{}.tmp'.format(index.path))
+
+    def test_missing_index(self, tmpdir):
+        index = CatalogueIndex(fs.join(str(tmpdir), 'missing.sqlite'))
+        with pytest.raises(CommandError):
+            index.list('dataset')
+
+
+def test_build_index(tmpdir):
+    from benchmarks.fake_ckan import FakeCKAN
+
+    with FakeCKAN(datasets=30, groups=3, organizations=2, users=4) as ckan:
+        client = ApiClient(ckan.urlbase, 'key')
+        index = CatalogueIndex.open(ckan.urlbase, str(tmpdir))
+        cmd = IndexBuildCommand(FakeContext(client), index)
+        assert cmd.execute() == {
+            'organization': 2, 'group': 3, 'dataset': 30, 'user': 4
+        }
+
+        requests = ckan.requests
+        assert len(index.list('dataset', owner_org='org-0001')) == 15
+        assert index.show('user', 'user-0002')['id'] == 'user-id-user-0002'
+        assert index.get_info()['urlbase'] == ckan.urlbase
+        assert ckan.requests == requests
+        index.close()
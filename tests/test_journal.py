@@ -0,0 +1,57 @@
+import io
+from ckanta.journal import Journal, hash_file
+
+
+class NonSeekableFile(io.StringIO):
+
+    def seekable(self):
+        return False
+
+
+class TestHashFile:
+
+    def test_seekable_file_is_rewound(self):
+        file_obj = io.StringIO('title\nSector A\n')
+        digest, same_obj = hash_file(file_obj)
+        assert same_obj is file_obj
+        assert same_obj.read() == 'title\nSector A\n'
+
+    def test_non_seekable_file_is_not_read(self):
+        pipe = NonSeekableFile('title\nSector A\n')
+        digest, file_obj = hash_file(pipe)
+        assert digest is None and file_obj is pipe
+        assert pipe.tell() == 0
+
+    def test_different_content_differs(self):
+        digest_a, _ = hash_file(io.StringIO('a'))
+        digest_b, _ = hash_file(io.StringIO('b'))
+        assert digest_a != digest_b
+
+
+class TestJournal:
+
+    def test_records_persist_for_resume(self, tmpdir):
+        with Journal.open('upload', 'x', directory=str(tmpdir)) as journal:
+            journal.record('sector-a')
+            journal.record('sector-b')
+
+        with Journal.open('upload', 'x', resume=True,
+                          directory=str(tmpdir)) as journal:
+            assert journal.is_done('sector-a')
+            remaining = list(journal.filter(['sector-a', 'sector-c']))
+            assert remaining == ['sector-c']
+            assert journal.skipped == 1
+
+    def test_fresh_run_discards_records(self, tmpdir):
+        with Journal.open('upload', 'x', directory=str(tmpdir)) as journal:
+            journal.record('sector-a')
+
+        with Journal.open('upload', 'x', directory=str(tmpdir)) as journal:
+            assert not journal.is_done('sector-a')
+
+    def test_identity_selects_journal(self, tmpdir):
+        journal_a = Journal.open('upload', 'x', directory=str(tmpdir))
+        journal_b = Journal.open('upload', 'y', directory=str(tmpdir))
+        assert journal_a.path != journal_b.path
+        journal_a.close()
+        journal_b.close()
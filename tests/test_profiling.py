@@ -0,0 +1,41 @@
+import pstats
+import pytest
+import tracemalloc
+from ckanta.profiling import Profiler
+
+
+def busy():
+    return [str(n) * 10 for n in range(20000)]
+
+
+class TestProfiler:
+
+    def test_cpu_profile(self, tmpdir):
+        path = str(tmpdir.join('run.pstats'))
+        profiler = Profiler('cpu', path, top=5)
+        profiler.start()
+        busy()
+        summary = profiler.stop()
+
+        assert 'busy' in summary
+        assert any(func[2] == 'busy' for func in pstats.Stats(path).stats)
+
+    def test_mem_profile(self, tmpdir):
+        path = str(tmpdir.join('run.tracemalloc'))
+        profiler = Profiler('mem', path, top=5)
+        profiler.start()
+        values = busy()
+        summary = profiler.stop()
+
+        assert not tracemalloc.is_tracing()
+        assert summary.startswith('Memory: current')
+        assert 'test_profiling.py' in summary
+        assert tracemalloc.Snapshot.load(path).statistics('lineno')
+        del values
+
+    def test_default_path(self):
+        assert Profiler('mem').path == 'ckanta.tracemalloc'
+
+    def test_invalid_mode(self):
+        with pytest.raises(ValueError):
+            Profiler('io')